@@ -0,0 +1,117 @@
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_client import fetch_file, fetch_stats
+
+# Téléchargements simultanés d'un même fichier, avec et sans le cache des fichiers
+# chauds (p2p_cache.py) : durée, lectures du serveur (octets lus sur le disque,
+# octets et appels de lecture) relevées dans /proc/<pid>/io (Linux). Le fichier est
+# retiré du cache du noyau avant chaque mesure (posix_fadvise DONTNEED).
+
+def serve(config):
+    from p2p_server import create_server
+    server = create_server(config)
+    server.start()
+    while True:
+        time.sleep(3600)
+
+def process_io(pid):
+    values = {}
+    with open(f"/proc/{pid}/io") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            values[key] = int(value)
+    return values
+
+# Attendre que le serveur ait fini de lire le dossier partagé (index, empreintes)
+def wait_idle(pid, delay=0.3):
+    previous = None
+    while True:
+        current = process_io(pid)["rchar"]
+        if current == previous:
+            return
+        previous = current
+        time.sleep(delay)
+
+def drop_page_cache(path):
+    with open(path, "rb") as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+def run(label, config, args, path, tmp):
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(config,), daemon=True)
+    process.start()
+    time.sleep(0.5)
+    wait_idle(process.pid)
+    drop_page_cache(path)
+    before = process_io(process.pid)
+    dirs = []
+    for i in range(args.clients):
+        dirs.append(os.path.join(tmp, f"{label}-{i}"))
+        os.makedirs(dirs[-1])
+    client_config = {"compression": False, "dedup_transfers": False, "delta_sync": False,
+                     "parallel_connections": 1}
+    errors = []
+
+    def download(dest):
+        try:
+            fetch_file("127.0.0.1", config["port"], "hot.bin", dest, client_config)
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=download, args=(dest,)) for dest in dirs]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = process_io(process.pid)
+    gauges = fetch_stats("127.0.0.1", config["port"], {})["gauges"]
+    process.terminate()
+    for dest in dirs:
+        shutil.rmtree(dest)
+    size = args.size_mb * 1024 * 1024
+    print(f"{label:>14}: {elapsed:6.2f} s, {args.clients * size / elapsed / 1024 / 1024:8.1f} Mo/s | "
+          f"disque {(after['read_bytes'] - before['read_bytes']) / size:5.2f} x le fichier | "
+          f"read() {(after['rchar'] - before['rchar']) / size:6.2f} x, {after['syscr'] - before['syscr']} appels | "
+          f"cache {gauges.get('p2p_file_cache_hit_ratio')}" + (f" | {len(errors)} erreur(s)" if errors else ""))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du cache des fichiers chauds")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--sendfile", action="store_true", help="envoi zero-copy (sinon bufferisé)")
+    parser.add_argument("--port", type=int, default=5940)
+    args = parser.parse_args()
+    if not os.path.exists("/proc/self/io"):
+        sys.exit("/proc/<pid>/io indisponible (Linux uniquement)")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        shared = os.path.join(tmp, "serveur")
+        os.makedirs(shared)
+        path = os.path.join(shared, "hot.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+            # Pages écrites sur le disque : elles peuvent alors être retirées du cache
+            os.fsync(f.fileno())
+        config = {"host": "127.0.0.1", "port": args.port, "shared_dir": shared, "server_mode": args.mode,
+                  "index_use_inotify": False, "use_sendfile": args.sendfile, "compression": False}
+        print(f"{args.clients} téléchargements simultanés de {args.size_mb} Mo "
+              f"({args.mode}, {'sendfile' if args.sendfile else 'bufferisé'})")
+        run("sans cache", dict(config, file_cache_size=0), args, path, tmp)
+        run("avec cache", dict(config, port=args.port + 1), args, path, tmp)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_client import _pool, fetch_file
+from p2p_compress import available_encodings
+from p2p_server import create_server
+from netsim import LinkProxy
+
+# Compression à la volée sur un lien lent
+#
+# Un proxy TCP local (netsim) limite le débit entre client et serveur (lien simulé) ; on
+# mesure le débit effectif (octets du fichier / durée) de GET_FILE sans compression
+# puis avec chaque algorithme disponible, pour un journal texte, un CSV et des
+# données aléatoires (incompressibles : le serveur doit les envoyer telles quelles).
+
+def make_log(size, rng):
+    levels = ["INFO", "INFO", "INFO", "DEBUG", "WARNING", "ERROR"]
+    lines = []
+    total = 0
+    i = 0
+    while total < size:
+        line = (f"2026-10-17 12:{i // 60 % 60:02d}:{i % 60:02d} {rng.choice(levels)} "
+                f"pair 192.168.1.{rng.randint(2, 254)} requete GET_FILE fichier_{rng.randint(0, 500)}.bin "
+                f"traitee en {rng.randint(1, 900)} ms\n").encode()
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines)[:size]
+
+def make_csv(size, rng):
+    lines = [b"id;date;client;montant;statut\n"]
+    total = 0
+    i = 0
+    while total < size:
+        line = (f"{i};2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d};client{rng.randint(0, 999)};"
+                f"{rng.uniform(0, 5000):.2f};{rng.choice(['payé', 'en attente', 'annulé'])}\n").encode()
+        lines.append(line)
+        total += len(line)
+        i += 1
+    return b"".join(lines)[:size]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la compression à la volée")
+    parser.add_argument("--size-mb", type=int, default=16)
+    parser.add_argument("--rate-mb", type=float, default=10, help="débit du lien simulé (Mo/s)")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--port", type=int, default=5930)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    size = args.size_mb * 1024 * 1024
+    tmp = tempfile.mkdtemp()
+    proxy = None
+    server = None
+    try:
+        server_dir = os.path.join(tmp, "serveur")
+        client_dir = os.path.join(tmp, "client")
+        os.makedirs(server_dir)
+        os.makedirs(client_dir)
+        files = {"journal.log": make_log(size, rng), "ventes.csv": make_csv(size, rng),
+                 "aleatoire.bin": os.urandom(size)}
+        for name, data in files.items():
+            with open(os.path.join(server_dir, name), "wb") as f:
+                f.write(data)
+        encodings = available_encodings()
+        host = "127.0.0.1"
+        server = create_server({"host": host, "port": args.port, "shared_dir": server_dir,
+                                "server_mode": args.mode, "index_use_inotify": False,
+                                "compression": encodings})
+        server.start()
+        proxy = LinkProxy(args.port + 1, (host, args.port), args.rate_mb * 1024 * 1024)
+        time.sleep(0.3)
+
+        print(f"Fichiers de {args.size_mb} Mo | lien limité à {args.rate_mb:g} Mo/s")
+        print(f"{'Fichier':<16}{'Compression':<14}{'Durée':>9}{'Débit effectif':>18}{'Gain':>7}")
+        for name, data in files.items():
+            reference = None
+            for encoding in [None] + encodings:
+                _pool.close_all()
+                config = {"compression": [encoding] if encoding else False}
+                start = time.perf_counter()
+                fetch_file(host, args.port + 1, name, client_dir, config)
+                elapsed = time.perf_counter() - start
+                with open(os.path.join(client_dir, name), "rb") as f:
+                    if f.read() != data:
+                        raise SystemExit(f"{name}: contenu reçu différent")
+                reference = reference or elapsed
+                print(f"{name:<16}{encoding or 'aucune':<14}{elapsed:>8.2f}s"
+                      f"{size / elapsed / 1024 / 1024:>13.1f} Mo/s{reference / elapsed:>6.1f}x")
+    finally:
+        _pool.close_all()
+        if proxy is not None:
+            proxy.close()
+        if server is not None and hasattr(server, "stop"):
+            server.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
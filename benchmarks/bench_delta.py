@@ -0,0 +1,99 @@
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_client import fetch_file, sync_file
+from p2p_delta import numpy
+from p2p_server import create_server
+
+# Synchronisation DELTA contre téléchargement complet (GET_FILE)
+#
+# Pour chaque scénario, le pair serveur possède une version modifiée d'un fichier
+# dont le client a l'ancienne version ; on mesure les octets échangés et la durée
+# de la mise à jour par GET_FILE puis par DELTA (signature envoyée + delta reçu).
+
+# Appliquer des modifications à une copie des données
+def edit(data, kind, count, rng):
+    data = bytearray(data)
+    for _ in range(count):
+        position = rng.randrange(len(data))
+        if kind == "modif":
+            data[position:position + 100] = os.urandom(100)
+        elif kind == "insertion":
+            data[position:position] = os.urandom(rng.randint(1, 4096))
+        elif kind == "suppression":
+            del data[position:position + rng.randint(1, 4096)]
+    if kind == "ajout":
+        data += os.urandom(count * 1024)
+    return bytes(data)
+
+def run_scenario(host, port, server_dir, client_dir, original, modified, config):
+    name = "bench.bin"
+    with open(os.path.join(server_dir, name), "wb") as f:
+        f.write(modified)
+    local_path = os.path.join(client_dir, name)
+
+    with open(local_path, "wb") as f:
+        f.write(original)
+    start = time.perf_counter()
+    full_bytes = fetch_file(host, port, name, client_dir, config)
+    full_time = time.perf_counter() - start
+
+    with open(local_path, "wb") as f:
+        f.write(original)
+    start = time.perf_counter()
+    stats = sync_file(host, port, name, client_dir, config)
+    delta_time = time.perf_counter() - start
+    with open(local_path, "rb") as f:
+        if f.read() != modified:
+            raise SystemExit("Fichier reconstruit différent de la version du serveur")
+    return full_bytes, full_time, stats["sent"] + stats["received"], delta_time
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DELTA contre GET_FILE")
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--edits", type=int, default=10, help="modifications par scénario")
+    parser.add_argument("--block-size", type=int, default=32 * 1024)
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--port", type=int, default=5910)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp()
+    try:
+        server_dir = os.path.join(tmp, "serveur")
+        client_dir = os.path.join(tmp, "client")
+        os.makedirs(server_dir)
+        os.makedirs(client_dir)
+        host = "127.0.0.1"
+        server = create_server({"host": host, "port": args.port, "shared_dir": server_dir,
+                                "server_mode": args.mode, "index_use_inotify": False})
+        server.start()
+        time.sleep(0.3)
+        config = {"delta_block_size": args.block_size}
+        original = os.urandom(args.size_mb * 1024 * 1024)
+        print(f"Fichier de {args.size_mb} Mo | blocs de {args.block_size // 1024} Ko | "
+              f"numpy: {'oui' if numpy is not None else 'non'}")
+        print(f"{'Scénario':<22}{'GET_FILE':>22}{'DELTA':>22}{'Gain':>9}")
+        for kind in ("identique", "modif", "insertion", "suppression", "ajout"):
+            modified = original if kind == "identique" else edit(original, kind, args.edits, rng)
+            full_bytes, full_time, delta_bytes, delta_time = run_scenario(
+                host, args.port, server_dir, client_dir, original, modified, config)
+            label = kind if kind == "identique" else f"{kind} x{args.edits}"
+            print(f"{label:<22}{full_bytes / 1024:>12.0f} Ko {full_time:>6.2f} s"
+                  f"{delta_bytes / 1024:>12.0f} Ko {delta_time:>6.2f} s"
+                  f"{full_bytes / max(1, delta_bytes):>8.0f}x")
+        if hasattr(server, "stop"):
+            server.stop()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
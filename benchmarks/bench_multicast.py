@@ -0,0 +1,91 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_multicast import MulticastReceiver, MulticastSender
+
+# Diffusion multicast d'un fichier à plusieurs récepteurs locaux (un processus chacun),
+# avec perte de paquets simulée : durée, octets émis (comparés aux N copies qu'enverrait
+# un serveur unicast), réparations et débit final choisi par le contrôle de débit.
+
+def receive(config, dest, loss, timeout, results):
+    receiver = MulticastReceiver(config, dest, loss)
+    finished = multiprocessing.Event()
+
+    def done(state):
+        results.put(state)
+        finished.set()
+    receiver.add_listener(done)
+    receiver.start()
+    finished.wait(timeout)
+    receiver.stop()
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la diffusion multicast")
+    parser.add_argument("--receivers", type=int, default=4)
+    parser.add_argument("--size-mb", type=int, default=64)
+    parser.add_argument("--loss", type=float, default=0.01, help="perte simulée par récepteur (0-1)")
+    parser.add_argument("--rate-mb", type=float, default=20, help="débit initial (Mo/s)")
+    parser.add_argument("--block-size", type=int, default=8192)
+    parser.add_argument("--port", type=int, default=9950)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp, "diffusion.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        # Seuil de pertes au-dessus de la perte simulée : le débit ne réagit qu'aux
+        # pertes dues à la charge (tampons des récepteurs pleins)
+        config = {"multicast_data_port": args.port, "multicast_block_size": args.block_size,
+                  "multicast_rate": int(args.rate_mb * 1024 * 1024),
+                  "multicast_loss_threshold": args.loss + 0.02}
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        processes = []
+        for i in range(args.receivers):
+            dest = os.path.join(tmp, f"recepteur-{i}")
+            processes.append(context.Process(target=receive, args=(config, dest, args.loss, args.timeout, results)))
+            processes[-1].start()
+        print(f"Diffusion de {args.size_mb} Mo à {args.receivers} récepteur(s), perte simulée "
+              f"{args.loss * 100:.1f}%, blocs de {args.block_size} octets")
+        start = time.perf_counter()
+        report = MulticastSender(config, path, receivers=args.receivers, timeout=args.timeout).run()
+        elapsed = time.perf_counter() - start
+        states = [results.get(timeout=args.timeout) for _ in range(report["done"])]
+        for process in processes:
+            process.join(args.timeout)
+        expected = sha256(path)
+        valid = sum(1 for i in range(args.receivers)
+                    if os.path.exists(os.path.join(tmp, f"recepteur-{i}", "diffusion.bin"))
+                    and sha256(os.path.join(tmp, f"recepteur-{i}", "diffusion.bin")) == expected)
+        size = args.size_mb * 1024 * 1024
+        sent = report["sent"]
+        print(f"durée {elapsed:.2f} s (dont attente des récepteurs), {valid}/{args.receivers} copie(s) "
+              f"identique(s), réception la plus lente {max((s['elapsed'] for s in states), default=0):.2f} s")
+        print(f"octets émis {report['bytes_sent'] / size:.3f} x le fichier "
+              f"(unicast : {args.receivers} x) | blocs {sent['data']}, réparations {sent['repair_multicast']} "
+              f"multicast + {sent['repair_unicast']} unicast, {sent['nacks']} NACK")
+        print(f"débit final {report['rate'] / 1024 / 1024:.1f} Mo/s, pertes max "
+              + ", ".join(f"{r['max_loss'] * 100:.1f}%" for r in report["receivers"].values()))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
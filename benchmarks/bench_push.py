@@ -0,0 +1,111 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_push import push_file
+from p2p_shaping import BandwidthShaper
+
+# Réplication d'un fichier vers N pairs locaux (un processus serveur chacun) en chaîne,
+# en arbre et en étoile (la source envoie à tous) : durée, débit du lien le plus lent,
+# copies identiques. --rate-mb limite le débit d'envoi de chaque pair et de la source
+# (max_upload_rate : lien montant de chaque machine). --dead ajoute un pair
+# injoignable au milieu de la chaîne, --kill arrête un pair pendant le transfert :
+# ses successeurs doivent être rattachés.
+
+def serve(config):
+    from p2p_server import create_server
+    server = create_server(config)
+    server.start()
+    while True:
+        time.sleep(3600)
+
+def sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def nodes(report):
+    for child in report["children"]:
+        yield child
+        yield from nodes(child)
+
+def run(label, targets, path, dirs, fanout, args, kill=None):
+    for dest in dirs:
+        target = os.path.join(dest, "replica.bin")
+        if os.path.exists(target):
+            os.remove(target)
+    if kill is not None:
+        threading.Timer(args.kill, kill.terminate).start()
+    shaper = BandwidthShaper.from_config({"max_upload_rate": int(args.rate_mb * 1024 * 1024)}, "upload")
+    report = push_file(targets, path, "replica.bin", {"chunk_size": 256 * 1024, "push_timeout": 5}, fanout,
+                       shaper=shaper)
+    expected = sha256(path)
+    valid = sum(1 for dest in dirs if os.path.exists(os.path.join(dest, "replica.bin"))
+                and sha256(os.path.join(dest, "replica.bin")) == expected)
+    reached = [node for node in nodes(report) if node["ok"]]
+    failed = [node for node in nodes(report) if not node["ok"]]
+    rates = [node["rate"] for node in reached if node.get("rate")]
+    print(f"{label:>16}: {report['seconds']:6.2f} s, {report['size'] / report['seconds'] / 1024 / 1024:7.1f} Mo/s "
+          f"de bout en bout | lien le plus lent {min(rates, default=0) / 1024 / 1024:7.1f} Mo/s | "
+          f"{valid}/{len(dirs)} copie(s) identique(s), {sum(1 for node in reached if node['rerouted'])} "
+          f"rattaché(s), {len(failed)} en panne")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la réplication en chaîne ou en arbre (PUSH_FILE)")
+    parser.add_argument("--peers", type=int, default=6)
+    parser.add_argument("--size-mb", type=int, default=128)
+    parser.add_argument("--fanouts", default="1,2", help="fanouts à mesurer (étoile ajoutée)")
+    parser.add_argument("--rate-mb", type=float, default=0, help="débit d'envoi maximal de chaque pair (Mo/s)")
+    parser.add_argument("--dead", action="store_true", help="pair injoignable au milieu de la chaîne")
+    parser.add_argument("--kill", type=float, help="arrêter un pair après KILL secondes (chaîne)")
+    parser.add_argument("--port", type=int, default=5960)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    processes = []
+    try:
+        path = os.path.join(tmp, "source.bin")
+        with open(path, "wb") as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+        context = multiprocessing.get_context("spawn")
+        targets, dirs = [], []
+        for i in range(args.peers):
+            dest = os.path.join(tmp, f"pair-{i}")
+            os.makedirs(dest)
+            config = {"host": "127.0.0.1", "port": args.port + i, "shared_dir": dest, "index_use_inotify": False,
+                      "chunk_size": 256 * 1024, "max_upload_rate": int(args.rate_mb * 1024 * 1024), "push_accept": True}
+            processes.append(context.Process(target=serve, args=(config,), daemon=True))
+            processes[-1].start()
+            targets.append(("127.0.0.1", args.port + i))
+            dirs.append(dest)
+        time.sleep(1.5)
+        print(f"Réplication de {args.size_mb} Mo vers {args.peers} pair(s)")
+        for fanout in [int(value) for value in args.fanouts.split(",")]:
+            run("chaîne" if fanout == 1 else f"arbre (x{fanout})", targets, path, dirs, fanout, args)
+        run("étoile", targets, path, dirs, args.peers, args)
+        if args.dead:
+            # Port sans serveur au milieu de la chaîne
+            middle = len(targets) // 2
+            run("chaîne + panne", targets[:middle] + [("127.0.0.1", args.port + args.peers)] + targets[middle:],
+                path, dirs, 1, args)
+        if args.kill is not None:
+            victim = len(targets) // 2
+            run("chaîne + arrêt", targets, path, dirs[:victim] + dirs[victim + 1:], 1, args, processes[victim])
+    finally:
+        for process in processes:
+            process.terminate()
+        shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_transfer import (
+    DEFAULT_CHUNK_SIZE, DEFAULT_SOCKET_BUFFER_SIZE, configure_socket,
+    send_file_buffered, send_file_zero_copy
+)
+
+# Benchmark loopback : débit et CPU du mode zero-copy (sendfile) face au mode bufferisé
+
+# Créer un fichier de test de la taille demandée
+def make_test_file(directory, size):
+    path = os.path.join(directory, "bench.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:min(len(block), remaining)])
+            remaining -= len(block)
+    return path
+
+# Serveur d'un seul transfert : envoie le fichier au premier client connecté
+def serve_once(server_sock, path, mode, config, result):
+    conn, _ = server_sock.accept()
+    configure_socket(conn, config)
+    cpu_start = time.thread_time()
+    with open(path, "rb") as f:
+        if mode == "sendfile":
+            send_file_zero_copy(conn, f)
+        else:
+            send_file_buffered(conn, f, chunk_size=config["chunk_size"])
+    result["server_cpu"] = time.thread_time() - cpu_start
+    conn.close()
+
+# Mesurer un transfert complet sur loopback dans le mode donné
+def run_transfer(path, mode, config):
+    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_sock.bind(("127.0.0.1", 0))
+    server_sock.listen(1)
+    result = {}
+    t = threading.Thread(target=serve_once, args=(server_sock, path, mode, config, result))
+    t.start()
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    configure_socket(client, config)
+    start = time.perf_counter()
+    client.connect(server_sock.getsockname())
+    buf = bytearray(config["chunk_size"])
+    received = 0
+    while True:
+        n = client.recv_into(buf)
+        if not n:
+            break
+        received += n
+    elapsed = time.perf_counter() - start
+    client.close()
+    t.join()
+    server_sock.close()
+    return received, elapsed, result["server_cpu"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sendfile vs bufferisé sur loopback")
+    parser.add_argument("--size-mb", type=int, default=256, help="taille du fichier de test (Mo)")
+    parser.add_argument("--runs", type=int, default=3, help="nombre de transferts par mode")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--socket-buffer-size", type=int, default=DEFAULT_SOCKET_BUFFER_SIZE)
+    args = parser.parse_args()
+
+    config = {"chunk_size": args.chunk_size, "socket_buffer_size": args.socket_buffer_size}
+    modes = ["buffered"]
+    if hasattr(os, "sendfile"):
+        modes.insert(0, "sendfile")
+    else:
+        print("[!] os.sendfile indisponible sur cette plateforme, seul le mode bufferisé est mesuré.")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = make_test_file(tmp, args.size_mb * 1024 * 1024)
+        print(f"Fichier: {args.size_mb} Mo | chunk: {args.chunk_size} o | tampon socket: {args.socket_buffer_size} o")
+        for mode in modes:
+            best = None
+            cpu_total = 0.0
+            for _ in range(args.runs):
+                received, elapsed, cpu = run_transfer(path, mode, config)
+                throughput = received / elapsed / (1024 * 1024)
+                best = throughput if best is None else max(best, throughput)
+                cpu_total += cpu
+            print(f"{mode:>9}: meilleur débit {best:8.1f} Mo/s | CPU serveur moyen {cpu_total / args.runs:.3f} s")
+
+if __name__ == "__main__":
+    main()
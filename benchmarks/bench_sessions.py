@@ -0,0 +1,96 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_client import _pool, fetch_file, fetch_files, fetch_many
+from p2p_server import create_server
+
+# Téléchargement de nombreux petits fichiers : une connexion par fichier, connexions
+# persistantes réutilisées (pool), requêtes envoyées d'avance (pipelining) et flux
+# unique GET_MANY, comparés au téléchargement d'un seul fichier de même taille totale
+
+def run(label, function, repeat):
+    best = None
+    for _ in range(repeat):
+        _pool.close_all()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return label, best
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark des connexions persistantes")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--file-size-kb", type=int, default=4)
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--host", help="cibler une instance existante (fichiers f0.bin, f1.bin...)")
+    parser.add_argument("--port", type=int, default=5920)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        client_dir = os.path.join(tmp, "client")
+        os.makedirs(client_dir)
+        names = [f"f{i}.bin" for i in range(args.files)]
+        host = args.host or "127.0.0.1"
+        server = None
+        if not args.host:
+            server_dir = os.path.join(tmp, "serveur")
+            os.makedirs(server_dir)
+            for name in names:
+                with open(os.path.join(server_dir, name), "wb") as f:
+                    f.write(os.urandom(args.file_size_kb * 1024))
+            with open(os.path.join(server_dir, "ensemble.bin"), "wb") as f:
+                f.write(os.urandom(args.files * args.file_size_kb * 1024))
+            server = create_server({"host": host, "port": args.port, "shared_dir": server_dir,
+                                    "server_mode": args.mode, "index_use_inotify": False})
+            server.start()
+            time.sleep(0.3)
+
+        def one_connection_per_file():
+            for name in names:
+                fetch_file(host, args.port, name, client_dir, {"keepalive": False})
+
+        def pooled():
+            for name in names:
+                fetch_file(host, args.port, name, client_dir, {})
+
+        def pipelined():
+            for name, _, error in fetch_files(host, args.port, names, client_dir, {}):
+                if error:
+                    raise SystemExit(f"{name}: {error}")
+
+        def get_many(archive):
+            for name, _, error in fetch_many(host, args.port, names, client_dir, {}, archive=archive):
+                if error:
+                    raise SystemExit(f"{name}: {error}")
+
+        def single_file():
+            fetch_file(host, args.port, "ensemble.bin", client_dir, {})
+
+        print(f"{args.files} fichiers de {args.file_size_kb} Ko | serveur {host}:{args.port}")
+        results = [run("une connexion par fichier", one_connection_per_file, args.repeat),
+                   run("connexions persistantes", pooled, args.repeat),
+                   run("pipelining", pipelined, args.repeat),
+                   run("GET_MANY", lambda: get_many(False), args.repeat),
+                   run("GET_MANY (tar)", lambda: get_many(True), args.repeat)]
+        if not args.host:
+            results.append(run("un seul fichier (référence)", single_file, args.repeat))
+        reference = results[0][1]
+        for label, elapsed in results:
+            print(f"  {label:<30}{elapsed * 1000:8.1f} ms{args.files / elapsed:9.0f} fichiers/s"
+                  f"{reference / elapsed:7.1f}x")
+        if server is not None and hasattr(server, "stop"):
+            server.stop()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
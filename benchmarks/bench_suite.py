@@ -0,0 +1,396 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_client import _pool, fetch_file, fetch_file_index, fetch_file_list
+from p2p_discovery import DiscoveryService
+from p2p_download import parallel_download
+from p2p_peers import registry
+from p2p_server import create_server
+from netsim import LinkProxy
+
+# Suite de benchmarks de bout en bout : découverte, listing et transferts
+#
+# Démarre N pairs sur la boucle locale, dans ce processus ou un processus chacun
+# (--processes), chacun avec son dossier partagé temporaire, et mesure :
+# - la découverte : délai avant qu'un pair qui démarre connaisse tous les autres
+#   (discovery.full), et délai avant qu'un nouveau pair soit vu (discovery.join) ;
+# - LIST_FILES : latence à mesure que le dossier partagé d'un pair grandit ;
+# - les transferts : durée et débit d'un flux (GET_FILE depuis un pair) et de
+#   plusieurs flux (téléchargement par segments depuis tous les pairs), pour des
+#   tailles de 1 Ko à plusieurs Go.
+# Avec --latency-ms / --rate-mb, les connexions TCP passent par un proxy local qui
+# simule le lien (voir netsim). Les résultats sont écrits en JSON (--output) et
+# comparés à ceux d'une exécution précédente avec --compare. Les pairs découverts
+# sont enregistrés dans un fichier d'hôtes temporaire, et non dans p2p_hosts.txt.
+
+SUITE_VERSION = 1
+DEFAULT_SIZES = "1K,64K,1M,16M,256M"
+DEFAULT_LIST_SIZES = "100,1000,10000"
+UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+WRITE_BLOCK = 4 * 1024 * 1024
+READY_TIMEOUT = 120
+DISCOVERY_TIMEOUT = 10
+
+def parse_size(text):
+    text = text.strip().upper().rstrip("B")
+    if text and text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+def format_size(n):
+    for unit in ("G", "M", "K"):
+        if n >= UNITS[unit] and n % UNITS[unit] == 0:
+            return f"{n // UNITS[unit]}{unit}"
+    return str(n)
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {"samples": [round(s, 6) for s in samples], "median": round(statistics.median(ordered), 6),
+            "p90": round(ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))], 6),
+            "min": round(ordered[0], 6)}
+
+def write_random_file(path, size):
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            block = os.urandom(min(WRITE_BLOCK, remaining))
+            f.write(block)
+            remaining -= len(block)
+
+# Placer le même fichier dans un autre dossier (lien physique si possible)
+def link_or_copy(source, dest):
+    try:
+        os.link(source, dest)
+    except OSError:
+        shutil.copyfile(source, dest)
+
+def wait_port(port, timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Le pair du port {port} ne répond pas")
+            time.sleep(0.05)
+
+# Attendre que l'index d'un pair contienne count fichiers, tous hachés (le hachage en
+# arrière-plan fausserait les mesures)
+def wait_indexed(port, count, timeout=READY_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while True:
+        files = fetch_file_index("127.0.0.1", port, {}, timeout=30)
+        if len(files) == count and all(f.get("sha256") for f in files):
+            return
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Index du pair du port {port} incomplet ({len(files)}/{count} fichiers)")
+        time.sleep(0.2)
+
+# Fichier d'hôtes du registre des pairs de ce processus
+def use_hosts_file(path):
+    registry.path = path
+    registry.hosts = None
+
+# Démarrer un pair (serveur et, si demandé, service de découverte) dans ce processus
+def start_peer(config, discovery):
+    server = create_server(config)
+    server.start()
+    service = None
+    if discovery:
+        service = DiscoveryService(config, server)
+        service.start()
+    return server, service
+
+# Corps d'un processus pair (--processes) : tourne jusqu'à ce que stop soit positionné
+def peer_process(config, discovery, stop, hosts_file):
+    use_hosts_file(hosts_file)
+    server, service = start_peer(config, discovery)
+    stop.wait()
+    if service is not None:
+        service.stop()
+    if hasattr(server, "stop"):
+        server.stop()
+
+# Groupe de pairs locaux ; ports[i] est le port à utiliser par le client pour le pair i
+# (celui de son proxy si un lien est simulé)
+class Cluster:
+    def __init__(self, args, hosts_file):
+        self.args = args
+        self.hosts_file = hosts_file
+        self.ports = []
+        self.names = []
+        self.handles = []
+        self.proxies = []
+        self.context = multiprocessing.get_context("spawn")
+        self.stop_event = self.context.Event() if args.processes else None
+
+    def add(self, shared_dir, port):
+        name = f"bench-{len(self.names)}"
+        config = {"host": "127.0.0.1", "port": port, "shared_dir": shared_dir, "server_mode": self.args.mode,
+                  "discovery_port": self.args.discovery_port, "peer_name": name, "index_poll_interval": 0.5}
+        if self.args.processes:
+            process = self.context.Process(target=peer_process, args=(config, True, self.stop_event, self.hosts_file),
+                                           daemon=True)
+            process.start()
+            self.handles.append(process)
+        else:
+            self.handles.append(start_peer(config, True))
+        wait_port(port)
+        client_port = port
+        if self.args.latency_ms or self.args.rate_mb:
+            rate = self.args.rate_mb * 1024 * 1024 if self.args.rate_mb else None
+            proxy = LinkProxy(0, ("127.0.0.1", port), rate, self.args.latency_ms / 1000)
+            self.proxies.append(proxy)
+            client_port = proxy.port
+        self.ports.append(client_port)
+        self.names.append(name)
+        return client_port
+
+    def stop(self):
+        _pool.close_all()
+        for proxy in self.proxies:
+            proxy.close()
+        if self.stop_event is not None:
+            self.stop_event.set()
+            for process in self.handles:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+            return
+        # Les serveurs en mode "threaded" n'ont pas d'arrêt : ils finissent avec le processus
+        for server, service in self.handles:
+            if service is not None:
+                service.stop()
+            if hasattr(server, "stop"):
+                server.stop()
+
+# Découverte : un observateur démarré après les pairs doit tous les connaître (full) ;
+# un pair qui rejoint le groupe doit être vu par un observateur déjà actif (join)
+def bench_discovery(args, cluster):
+    results = []
+    config = {"discovery_port": args.discovery_port}
+    expected = set(cluster.names)
+    full, join = [], []
+    for run in range(args.repeat):
+        seen = threading.Event()
+        observer = DiscoveryService(dict(config, peer_name=f"bench-observer-{run}"))
+        observer.add_listener(lambda peers: expected.issubset(peers) and seen.set())
+        start = time.perf_counter()
+        observer.start()
+        if not seen.wait(DISCOVERY_TIMEOUT):
+            raise RuntimeError(f"Découverte incomplète : {sorted(expected - set(observer.peers()))} non vus")
+        full.append(time.perf_counter() - start)
+
+        joiner_name = f"bench-joiner-{run}"
+        joined = threading.Event()
+        observer.add_listener(lambda peers: joiner_name in peers and joined.set())
+        joiner = DiscoveryService(dict(config, peer_name=joiner_name))
+        start = time.perf_counter()
+        joiner.start()
+        if not joined.wait(DISCOVERY_TIMEOUT):
+            raise RuntimeError("Nouveau pair non découvert")
+        join.append(time.perf_counter() - start)
+        joiner.stop()
+        observer.stop()
+    results.append(dict(name="discovery.full", params={"peers": len(expected)}, **summarize(full)))
+    results.append(dict(name="discovery.join", params={"peers": len(expected)}, **summarize(join)))
+    return results
+
+# LIST_FILES à mesure que le dossier du pair de listing grandit (fichiers ajoutés
+# entre deux paliers, pris en compte par son index)
+def bench_listing(args, port, shared_dir):
+    results = []
+    created = 0
+    for count in sorted(parse_size(n) for n in args.list_sizes.split(",")):
+        while created < count:
+            with open(os.path.join(shared_dir, f"fichier_{created:07d}.txt"), "wb") as f:
+                f.write(b"x" * 100)
+            created += 1
+        wait_indexed(port, count)
+        fetch_file_list("127.0.0.1", port, {})
+        samples = []
+        for _ in range(max(args.repeat, 5)):
+            _pool.close_all()
+            start = time.perf_counter()
+            names = fetch_file_list("127.0.0.1", port, {})
+            samples.append(time.perf_counter() - start)
+            if len(names) != count:
+                raise RuntimeError(f"LIST_FILES : {len(names)} fichiers au lieu de {count}")
+        results.append(dict(name="list_files", params={"files": count}, **summarize(samples)))
+    return results
+
+def remove_download(dest_dir, name):
+    for suffix in ("", ".part", ".part.json"):
+        try:
+            os.remove(os.path.join(dest_dir, name + suffix))
+        except FileNotFoundError:
+            pass
+
+# Transferts : un flux depuis le premier pair, puis args.streams connexions réparties
+# sur tous les pairs (segments de taille fixe, vérification SHA-256 comprise)
+def bench_transfers(args, ports, files, dest_dir):
+    results = []
+    sources = [("127.0.0.1", port) for port in ports]
+    multi_config = {"parallel_connections": args.streams, "dedup_transfers": False, "compression": False,
+                    "segment_size": args.segment_mb * 1024 * 1024}
+    for name, size in files:
+        for label, download in (
+                ("transfer.single", lambda: fetch_file("127.0.0.1", ports[0], name, dest_dir,
+                                                       {"compression": False})),
+                ("transfer.multi", lambda: parallel_download(sources, name, dest_dir, multi_config))):
+            samples = []
+            for _ in range(args.repeat):
+                remove_download(dest_dir, name)
+                _pool.close_all()
+                start = time.perf_counter()
+                download()
+                samples.append(time.perf_counter() - start)
+                if os.path.getsize(os.path.join(dest_dir, name)) != size:
+                    raise RuntimeError(f"{label} {name} : taille reçue incorrecte")
+            params = {"size": size}
+            if label == "transfer.multi":
+                params.update(streams=args.streams, peers=len(sources))
+            result = dict(name=label, params=params, **summarize(samples))
+            result["throughput_mb_s"] = round(size / result["median"] / 1024 / 1024, 2)
+            results.append(result)
+            remove_download(dest_dir, name)
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def result_key(result):
+    return result["name"], json.dumps(result["params"], sort_keys=True)
+
+def describe(result):
+    params = dict(result["params"])
+    if "size" in params:
+        params["size"] = format_size(params["size"])
+    return result["name"] + " " + " ".join(f"{k}={v}" for k, v in params.items())
+
+def print_results(results):
+    print(f"{'Mesure':<48}{'Médiane':>11}{'p90':>11}{'Débit':>14}")
+    for result in results:
+        rate = f"{result['throughput_mb_s']:.1f} Mo/s" if "throughput_mb_s" in result else ""
+        print(f"{describe(result):<48}{result['median'] * 1000:>9.2f}ms{result['p90'] * 1000:>9.2f}ms{rate:>14}")
+
+# Comparer aux résultats d'une exécution précédente (médianes) ; renvoie le nombre de
+# mesures plus lentes au-delà du seuil
+def compare(results, previous, threshold):
+    if previous.get("settings") != results["settings"]:
+        print("[!] Paramètres différents de l'exécution de référence : comparaison indicative")
+    before = {result_key(r): r for r in previous.get("results", [])}
+    regressions = 0
+    print(f"\n{'Mesure':<48}{'Référence':>11}{'Actuel':>11}{'Écart':>9}")
+    for result in results["results"]:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        change = (result["median"] - old["median"]) / old["median"] if old["median"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  plus lent"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  plus rapide"
+        print(f"{describe(result):<48}{old['median'] * 1000:>9.2f}ms{result['median'] * 1000:>9.2f}ms"
+              f"{change * 100:>+8.1f}%{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de bout en bout (découverte, listing, transferts)")
+    parser.add_argument("--peers", type=int, default=3)
+    parser.add_argument("--processes", action="store_true", help="un processus par pair")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="threaded")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="tailles des fichiers transférés (1K, 1M, 4G...)")
+    parser.add_argument("--list-sizes", default=DEFAULT_LIST_SIZES, help="paliers du dossier listé (nombre de fichiers)")
+    parser.add_argument("--streams", type=int, default=4, help="connexions du transfert multi-flux")
+    parser.add_argument("--segment-mb", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=0, help="latence ajoutée dans chaque sens (proxy)")
+    parser.add_argument("--rate-mb", type=float, default=0, help="débit du lien simulé vers chaque pair (Mo/s)")
+    parser.add_argument("--base-port", type=int, default=5960)
+    parser.add_argument("--discovery-port", type=int, default=9989, help="groupe de découverte isolé")
+    parser.add_argument("--skip", default="", help="parties à sauter : discovery,listing,transfers")
+    parser.add_argument("--output", help="fichier JSON des résultats")
+    parser.add_argument("--compare", help="résultats JSON d'une exécution précédente")
+    parser.add_argument("--threshold", type=float, default=0.10, help="écart signalé lors de la comparaison")
+    args = parser.parse_args()
+    skip = {part.strip() for part in args.skip.split(",") if part.strip()}
+
+    tmp = tempfile.mkdtemp()
+    hosts_file = os.path.join(tmp, "p2p_hosts.txt")
+    use_hosts_file(hosts_file)
+    cluster = Cluster(args, hosts_file)
+    results = []
+    try:
+        data_dir = os.path.join(tmp, "donnees")
+        dest_dir = os.path.join(tmp, "client")
+        os.makedirs(data_dir)
+        os.makedirs(dest_dir)
+        files = []
+        if "transfers" not in skip:
+            for size in sorted(parse_size(s) for s in args.sizes.split(",")):
+                name = f"fichier_{format_size(size)}.bin"
+                write_random_file(os.path.join(data_dir, name), size)
+                files.append((name, size))
+        for i in range(args.peers):
+            shared_dir = os.path.join(tmp, f"pair{i}")
+            os.makedirs(shared_dir)
+            for name, _ in files:
+                link_or_copy(os.path.join(data_dir, name), os.path.join(shared_dir, name))
+            cluster.add(shared_dir, args.base_port + i)
+        listing_dir = os.path.join(tmp, "listing")
+        os.makedirs(listing_dir)
+        listing_port = cluster.add(listing_dir, args.base_port + args.peers)
+        for port in cluster.ports[:args.peers]:
+            wait_indexed(port, len(files))
+
+        if "discovery" not in skip:
+            results += bench_discovery(args, cluster)
+        if "listing" not in skip:
+            results += bench_listing(args, listing_port, listing_dir)
+        if "transfers" not in skip:
+            # Le pair de listing ne sert pas de fichiers
+            results += bench_transfers(args, cluster.ports[:args.peers], files, dest_dir)
+    finally:
+        cluster.stop()
+        registry.flush()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    settings = {k: getattr(args, k) for k in ("peers", "processes", "mode", "streams", "segment_mb",
+                                              "latency_ms", "rate_mb")}
+    report = {"suite": "p2p-bench", "version": SUITE_VERSION, "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+              "commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "settings": settings, "results": results}
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Résultats écrits dans {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        if compare(report, previous, args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_protocol import MAGIC, RESPONSE_HEADER, STATUS_OK, pack_request
+from p2p_server import create_server
+
+# Test de charge : des centaines de clients simultanés contre une instance locale
+#
+# Chaque client envoie ses requêtes (LIST_FILES et/ou GET_FILE, protocole binaire)
+# sur une nouvelle connexion à chaque fois ; on mesure la latence complète de chaque
+# requête (connexion -> dernier octet reçu) et le débit agrégé.
+
+# Exécuter une requête ; renvoie (latence en s, octets reçus) ou None en cas d'échec
+async def one_request(host, port, command, timeout):
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return None
+    try:
+        writer.write(pack_request(command))
+        await writer.drain()
+        header = await asyncio.wait_for(reader.readexactly(RESPONSE_HEADER.size), timeout)
+        magic, _, status, _, size, meta_len = RESPONSE_HEADER.unpack(header)
+        if magic != MAGIC or status != STATUS_OK:
+            return None
+        await asyncio.wait_for(reader.readexactly(meta_len), timeout)
+        received = 0
+        while received < size:
+            data = await asyncio.wait_for(reader.read(min(1 << 20, size - received)), timeout)
+            if not data:
+                return None
+            received += len(data)
+        return time.perf_counter() - start, received
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+        return None
+    finally:
+        writer.close()
+
+async def client(host, port, commands, timeout, results):
+    for command in commands:
+        results.append((command.split(" ", 1)[0], await one_request(host, port, command, timeout)))
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def run_load(host, port, clients, requests, command_mix, timeout):
+    results = []
+    plan = []
+    for i in range(clients):
+        plan.append([command_mix[(i + j) % len(command_mix)] for j in range(requests)])
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, commands, timeout, results) for commands in plan))
+    return results, time.perf_counter() - start
+
+def report(results, elapsed):
+    ok = [r for _, r in results if r is not None]
+    failed = len(results) - len(ok)
+    total_bytes = sum(size for _, size in ok)
+    print(f"Requêtes: {len(results)} | réussies: {len(ok)} | échecs: {failed} | durée: {elapsed:.2f} s")
+    print(f"Débit agrégé: {total_bytes / elapsed / (1024 * 1024):.1f} Mo/s | {len(ok) / elapsed:.0f} req/s")
+    for command in sorted({name for name, _ in results}):
+        latencies = [r[0] * 1000 for name, r in results if name == command and r is not None]
+        if latencies:
+            print(f"  {command:<10} p50: {statistics.median(latencies):7.2f} ms | "
+                  f"p99: {percentile(latencies, 99):7.2f} ms | max: {max(latencies):7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge du serveur P2P")
+    parser.add_argument("--mode", choices=["threaded", "asyncio"], default="asyncio",
+                        help="mode du serveur local démarré pour le test")
+    parser.add_argument("--host", help="cibler une instance existante au lieu d'en démarrer une")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=5, help="requêtes par client")
+    parser.add_argument("--file-size-kb", type=int, default=1024)
+    parser.add_argument("--files", type=int, default=50, help="nombre de fichiers partagés")
+    parser.add_argument("--command", choices=["list", "get", "mixed"], default="mixed")
+    parser.add_argument("--timeout", type=float, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.host:
+            host, port = args.host, args.port
+            names = ["bench.bin"]
+        else:
+            names = [f"file{i}.bin" for i in range(args.files)]
+            data = os.urandom(args.file_size_kb * 1024)
+            for name in names:
+                with open(os.path.join(tmp, name), "wb") as f:
+                    f.write(data)
+            host = "127.0.0.1"
+            port = args.port or 5900
+            config = {"host": host, "port": port, "shared_dir": tmp, "server_mode": args.mode,
+                      "backlog": max(128, args.clients)}
+            server = create_server(config)
+            server.start()
+            time.sleep(0.3)
+        gets = [f"GET_FILE {name}" for name in names]
+        mix = {"list": ["LIST_FILES"], "get": gets, "mixed": ["LIST_FILES"] + gets}[args.command]
+        print(f"Serveur {host}:{port} | {args.clients} clients x {args.requests} requêtes ({args.command})")
+        results, elapsed = asyncio.run(run_load(host, port, args.clients, args.requests, mix, args.timeout))
+        report(results, elapsed)
+        if not args.host and hasattr(server, "stop"):
+            server.stop()
+            server.join(5)
+
+if __name__ == "__main__":
+    main()
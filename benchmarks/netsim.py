@@ -0,0 +1,124 @@
+import collections
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from p2p_shaping import TokenBucket
+
+# Simulation d'un lien réseau pour les benchmarks
+#
+# LinkProxy est un proxy TCP local placé devant un serveur : chaque sens ajoute une
+# latence fixe (délai de livraison de chaque bloc) et, si rate est donné, un débit
+# maximal partagé par toutes les connexions du proxy (un seul lien). Les données en
+# transit sont bornées (produit débit x latence, au moins MIN_IN_FLIGHT octets) :
+# l'émetteur est ralenti comme par une fenêtre TCP.
+
+PROXY_CHUNK = 16384
+LINK_BURST = 4 * PROXY_CHUNK
+MIN_IN_FLIGHT = 4 * 1024 * 1024
+
+class LinkProxy:
+    def __init__(self, listen_port, target, rate=None, latency=0.0):
+        self.target = target
+        self.rate = rate
+        self.latency = latency
+        # Un seau par sens : montée (client -> serveur) et descente ; rafale minimale
+        self.buckets = (TokenBucket(rate, LINK_BURST), TokenBucket(rate, LINK_BURST)) if rate else (None, None)
+        self.in_flight = max(MIN_IN_FLIGHT, int((rate or 0) * latency * 2))
+        self.sock = socket.create_server(("127.0.0.1", listen_port))
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            try:
+                upstream = socket.create_connection(self.target)
+            except OSError:
+                client.close()
+                continue
+            for s in (client, upstream):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            Direction(self, client, upstream, self.buckets[0]).start()
+            Direction(self, upstream, client, self.buckets[1]).start()
+
+    def close(self):
+        self.sock.close()
+
+# Un sens d'une connexion : un thread lit la source et date les blocs, un autre les
+# livre à la destination après la latence et au débit du lien
+class Direction:
+    def __init__(self, proxy, source, dest, bucket):
+        self.proxy = proxy
+        self.source = source
+        self.dest = dest
+        self.bucket = bucket
+        self.pending = collections.deque()
+        self.pending_bytes = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self.read_loop, daemon=True).start()
+        threading.Thread(target=self.write_loop, daemon=True).start()
+
+    def read_loop(self):
+        try:
+            while True:
+                data = self.source.recv(PROXY_CHUNK)
+                if not data:
+                    break
+                with self.cond:
+                    while self.pending_bytes >= self.proxy.in_flight and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    self.pending.append((time.monotonic() + self.proxy.latency, data))
+                    self.pending_bytes += len(data)
+                    self.cond.notify_all()
+        except OSError:
+            pass
+        with self.cond:
+            # Fin de flux, livrée après les données en attente
+            self.pending.append((time.monotonic() + self.proxy.latency, None))
+            self.cond.notify_all()
+
+    def write_loop(self):
+        try:
+            while True:
+                with self.cond:
+                    while not self.pending:
+                        self.cond.wait()
+                    due, data = self.pending.popleft()
+                    if data is not None:
+                        self.pending_bytes -= len(data)
+                    self.cond.notify_all()
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if data is None:
+                    break
+                if self.bucket is not None:
+                    delay = self.bucket.reserve(len(data))
+                    if delay > 0:
+                        time.sleep(delay)
+                self.dest.sendall(data)
+        except OSError:
+            pass
+        finally:
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+            for s in (self.source, self.dest):
+                try:
+                    s.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.source.close()
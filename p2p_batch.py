@@ -0,0 +1,137 @@
+import os
+import struct
+import tarfile
+from p2p_protocol import ProtocolError
+from p2p_transfer import PART_SUFFIX, resolve_shared_path
+
+# Transfert groupé de plusieurs fichiers dans un seul flux (commande GET_MANY)
+#
+# Deux formats de flux :
+# - "frames" (par défaut) : pour chaque fichier, un en-tête ENTRY_HEADER (longueur du
+#   nom, taille), le nom relatif en UTF-8 puis le contenu ;
+# - "tar" : archive tar (format PAX) lisible par n'importe quel outil tar.
+# Le client dépaquette le flux au fur et à mesure de sa réception, sans fichier
+# intermédiaire ; chaque fichier passe par un .part renommé une fois complet.
+FORMAT_FRAMES = "frames"
+FORMAT_TAR = "tar"
+FORMATS = (FORMAT_FRAMES, FORMAT_TAR)
+
+ENTRY_HEADER = struct.Struct("!HQ")
+TAR_BLOCK = 512
+TAR_TRAILER = b"\0" * (2 * TAR_BLOCK)
+
+# Taille maximale de la liste de noms envoyée avec GET_MANY
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+
+def is_pattern(name):
+    return any(c in name for c in "*?[")
+
+# En-tête d'un fichier dans le flux, et bourrage à ajouter après son contenu
+def entry_header(name, size, mtime, archive_format=FORMAT_FRAMES):
+    if archive_format == FORMAT_TAR:
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(mtime)
+        info.mode = 0o644
+        return info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8"), b"\0" * (-size % TAR_BLOCK)
+    encoded = name.encode()
+    return ENTRY_HEADER.pack(len(encoded), size) + encoded, b""
+
+def stream_trailer(archive_format=FORMAT_FRAMES):
+    return TAR_TRAILER if archive_format == FORMAT_TAR else b""
+
+# Lecteur du corps d'une réponse : ne lit jamais au-delà de ses size octets, pour que
+# la connexion reste utilisable (connexion persistante)
+class BodyReader:
+    def __init__(self, sock, size, pending=b"", progress_callback=None, buffer_size=1024 * 1024, on_data=None):
+        self.sock = sock
+        self.remaining = size - len(pending)
+        self.size = size
+        self.buffer = bytearray(pending)
+        self.position = 0
+        self.received = len(pending)
+        self.progress_callback = progress_callback
+        self.buffer_size = buffer_size
+        self.on_data = on_data
+
+    def _fill(self):
+        if self.remaining <= 0:
+            return False
+        part = self.sock.recv(min(self.buffer_size, self.remaining))
+        if not part:
+            raise ProtocolError(f"Transfert incomplet: {self.size - self.remaining}/{self.size} octets reçus")
+        del self.buffer[:self.position]
+        self.position = 0
+        self.buffer += part
+        self.remaining -= len(part)
+        self.received += len(part)
+        if self.on_data:
+            self.on_data(len(part))
+        if self.progress_callback:
+            self.progress_callback(self.received, self.size)
+        return True
+
+    # Lire jusqu'à n octets (moins seulement à la fin du corps)
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = len(self.buffer) - self.position + self.remaining
+        while len(self.buffer) - self.position < n and self._fill():
+            pass
+        data = bytes(self.buffer[self.position:self.position + n])
+        self.position += len(data)
+        return data
+
+    def read_exact(self, n):
+        data = self.read(n)
+        if len(data) != n:
+            raise ProtocolError("Flux groupé tronqué")
+        return data
+
+    @property
+    def finished(self):
+        return self.remaining <= 0 and self.position >= len(self.buffer)
+
+# Écrire count octets lus dans reader vers le fichier name de dest_dir (via un .part)
+def _write_entry(reader, dest_dir, name, count, chunk_size):
+    local_path = resolve_shared_path(dest_dir, name)
+    if local_path is None:
+        raise ProtocolError(f"Nom de fichier invalide dans le flux: {name}")
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    part_path = local_path + PART_SUFFIX
+    try:
+        with open(part_path, "wb") as f:
+            while count > 0:
+                data = reader.read(min(chunk_size, count))
+                if not data:
+                    raise ProtocolError(f"Fichier tronqué dans le flux: {name}")
+                f.write(data)
+                count -= len(data)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, local_path)
+
+# Dépaqueter un flux "frames" ; renvoie la liste des (nom, taille) reçus
+def unpack_frames(reader, dest_dir, chunk_size):
+    received = []
+    while not reader.finished:
+        name_length, size = ENTRY_HEADER.unpack(reader.read_exact(ENTRY_HEADER.size))
+        name = reader.read_exact(name_length).decode()
+        _write_entry(reader, dest_dir, name, size, chunk_size)
+        received.append((name, size))
+    return received
+
+# Dépaqueter un flux tar (lecture séquentielle, sans retour en arrière)
+def unpack_tar(reader, dest_dir, chunk_size):
+    received = []
+    with tarfile.open(fileobj=reader, mode="r|") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            _write_entry(archive.extractfile(member), dest_dir, member.name, member.size, chunk_size)
+            received.append((member.name, member.size))
+    # Fin d'archive : vider le reste du corps (bourrage)
+    while reader.read(chunk_size):
+        pass
+    return received
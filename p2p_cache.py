@@ -0,0 +1,209 @@
+import collections
+import os
+import threading
+from p2p_metrics import metrics
+from p2p_transfer import pread
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_FILE_CACHE_SIZE = 1024 * 1024 * 1024
+DEFAULT_FILE_CACHE_ENTRIES = 256
+# Lecture anticipée demandée au noyau pour un fichier froid (début de la plage servie)
+READAHEAD_SIZE = 16 * 1024 * 1024
+
+# Indications de lecture pour un fichier froid : lecture séquentielle (fenêtre de
+# lecture anticipée agrandie) et chargement du début de la plage demandée
+def advise_sequential(fd, offset=0, count=None):
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        length = READAHEAD_SIZE if count is None else min(count, READAHEAD_SIZE)
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+
+# Fichier du cache : ouvert une fois, son descripteur est partagé par tous les envois
+class CachedFile:
+    def __init__(self, path, st, f):
+        self.path = path
+        self.key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        self.size = st.st_size
+        self.file = f
+        self.fd = f.fileno()
+        self.refs = 0
+        self.evicted = False
+
+    def close(self):
+        self.file.close()
+
+# Lecture d'un fichier du cache par une requête : objet fichier en lecture dont la
+# position est propre à la requête ; les lectures sont positionnelles (pread) sur le
+# descripteur partagé. close() rend le fichier au cache.
+class CachedReader:
+    mode = "rb"
+
+    def __init__(self, cache, entry):
+        self.cache = cache
+        self.entry = entry
+        self.name = entry.path
+        self.pos = 0
+        self.closed = False
+
+    def fileno(self):
+        return self.entry.fd
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.pos
+        elif whence == os.SEEK_END:
+            offset += self.entry.size
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def read(self, size=-1):
+        end = self.entry.size if size is None or size < 0 else min(self.entry.size, self.pos + size)
+        data = pread(self.entry.fd, end - self.pos, self.pos) if end > self.pos else b""
+        self.pos += len(data)
+        return data
+
+    def readinto(self, buf):
+        n = max(0, min(len(buf), self.entry.size - self.pos))
+        if not n:
+            return 0
+        if hasattr(os, "preadv"):
+            n = os.preadv(self.entry.fd, [memoryview(buf)[:n]], self.pos)
+        else:
+            data = pread(self.entry.fd, n, self.pos)
+            n = len(data)
+            buf[:n] = data
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.cache.release(self.entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Cache des fichiers servis (fichiers chauds)
+#
+# Un fichier demandé par plusieurs pairs n'est ouvert qu'une fois : toutes les
+# requêtes lisent le même descripteur (sendfile, ou lectures positionnelles en mode
+# bufferisé), donc les mêmes pages du cache du noyau, sans ouverture ni indications
+# de lecture par requête. Les lectures ne projettent pas le fichier en mémoire : un
+# fichier tronqué sur place pendant un envoi donne une lecture courte (requête en
+# erreur), et non un SIGBUS qui arrêterait le serveur. Les fichiers sont évincés du
+# moins récemment servi au plus récent au-delà de file_cache_size octets ou de
+# DEFAULT_FILE_CACHE_ENTRIES fichiers ; un fichier évincé reste utilisable par les
+# envois en cours. Chaque ouverture compare la taille, la date et l'inode du fichier
+# à ceux du fichier ouvert : un fichier modifié ou remplacé est rouvert. Un fichier
+# ouvert pour la première fois (froid) reçoit les indications posix_fadvise de
+# lecture séquentielle. Un fichier vide ou plus grand que le cache est ouvert
+# normalement.
+class FileCache:
+    def __init__(self, max_bytes=DEFAULT_FILE_CACHE_SIZE, max_entries=DEFAULT_FILE_CACHE_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(int(config.get("file_cache_size", DEFAULT_FILE_CACHE_SIZE)),
+                   int(config.get("file_cache_entries", DEFAULT_FILE_CACHE_ENTRIES)))
+
+    # Ouvrir un fichier à servir ([offset, offset + count) : plage qui sera lue) ;
+    # renvoie un objet fichier en lecture binaire, à fermer après l'envoi
+    def open(self, path, offset=0, count=None):
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime_ns, st.st_ino)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.key == key:
+                self.entries.move_to_end(path)
+                entry.refs += 1
+                self.hits += 1
+                metrics.add("p2p_file_cache_requests_total", result="hit")
+                return CachedReader(self, entry)
+            if entry is not None:
+                self._remove(entry)
+                metrics.add("p2p_file_cache_invalidations_total")
+        f = open(path, "rb")
+        advise_sequential(f.fileno(), offset, count)
+        if not 0 < st.st_size <= self.max_bytes:
+            metrics.add("p2p_file_cache_requests_total", result="bypass")
+            return f
+        try:
+            entry = CachedFile(path, os.fstat(f.fileno()), f)
+        except OSError:
+            metrics.add("p2p_file_cache_requests_total", result="bypass")
+            return f
+        with self.lock:
+            current = self.entries.get(path)
+            if current is not None and current.key == entry.key:
+                # Ouvert entre-temps par une autre requête
+                current.refs += 1
+                self.hits += 1
+                metrics.add("p2p_file_cache_requests_total", result="hit")
+                duplicate, entry = entry, current
+            else:
+                duplicate = None
+                if current is not None:
+                    self._remove(current)
+                entry.refs = 1
+                self.entries[path] = entry
+                self.total += entry.size
+                self.misses += 1
+                metrics.add("p2p_file_cache_requests_total", result="miss")
+                self._evict()
+        if duplicate is not None:
+            duplicate.close()
+        return CachedReader(self, entry)
+
+    def release(self, entry):
+        with self.lock:
+            entry.refs -= 1
+            close = entry.evicted and entry.refs == 0
+        if close:
+            entry.close()
+
+    # Oublier un fichier (supprimé ou modifié) ; il reste lisible par les envois en cours
+    def invalidate(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self._remove(entry)
+                metrics.add("p2p_file_cache_invalidations_total")
+
+    def _remove(self, entry):
+        del self.entries[entry.path]
+        self.total -= entry.size
+        entry.evicted = True
+        if entry.refs == 0:
+            entry.close()
+
+    def _evict(self):
+        while self.entries and (self.total > self.max_bytes or len(self.entries) > self.max_entries):
+            _, entry = next(iter(self.entries.items()))
+            self._remove(entry)
+            metrics.add("p2p_file_cache_evictions_total")
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else None
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "hit_ratio": self.hit_ratio()}
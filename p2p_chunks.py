@@ -0,0 +1,118 @@
+import hashlib
+import os
+
+# Découpage des fichiers en blocs de taille fixe identifiés par leur SHA-256
+#
+# Un fichier est décrit par son manifeste : la liste des empreintes de ses blocs et
+# la racine de l'arbre de Merkle construit sur ces empreintes. La racine identifie
+# le contenu du fichier ; chaque bloc reçu est vérifié contre son empreinte.
+DEFAULT_DEDUP_CHUNK_SIZE = 1024 * 1024
+DIGEST_SIZE = 32
+
+def get_dedup_chunk_size(config):
+    return int(config.get("dedup_chunk_size", DEFAULT_DEDUP_CHUNK_SIZE))
+
+# Racine de Merkle (hex) d'une liste d'empreintes binaires
+def merkle_root(digests):
+    level = list(digests) or [hashlib.sha256(b"").digest()]
+    while len(level) > 1:
+        next_level = []
+        for i in range(0, len(level), 2):
+            if i + 1 < len(level):
+                next_level.append(hashlib.sha256(level[i] + level[i + 1]).digest())
+            else:
+                # Nœud impair : remonté tel quel au niveau supérieur
+                next_level.append(level[i])
+        level = next_level
+    return level[0].hex()
+
+# Lire un fichier une seule fois : SHA-256 complet (hex) et empreintes de ses blocs
+def hash_chunks(path, chunk_size=DEFAULT_DEDUP_CHUNK_SIZE):
+    whole = hashlib.sha256()
+    digests = []
+    buf = memoryview(bytearray(chunk_size))
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            # readinto peut renvoyer un bloc incomplet avant la fin du fichier
+            while n < chunk_size:
+                more = f.readinto(buf[n:])
+                if not more:
+                    break
+                n += more
+            whole.update(buf[:n])
+            digests.append(hashlib.sha256(buf[:n]).digest())
+    return whole.hexdigest(), digests
+
+# Manifeste d'un fichier : taille, taille de bloc et empreintes des blocs
+class Manifest:
+    def __init__(self, size, chunk_size, digests):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.digests = digests
+        self.root = merkle_root(digests)
+
+    # Position et longueur du bloc i
+    def chunk_range(self, i):
+        offset = i * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def pack_digests(self):
+        return b"".join(self.digests)
+
+    @classmethod
+    def unpack(cls, size, chunk_size, body):
+        if len(body) % DIGEST_SIZE:
+            raise ValueError("Manifeste invalide")
+        digests = [body[i:i + DIGEST_SIZE] for i in range(0, len(body), DIGEST_SIZE)]
+        expected = (size + chunk_size - 1) // chunk_size if chunk_size else 0
+        if len(digests) != expected:
+            raise ValueError("Nombre de blocs incohérent avec la taille du fichier")
+        return cls(size, chunk_size, digests)
+
+# Blocs disponibles localement, retrouvés par leur empreinte
+#
+# Les blocs proviennent de l'index du dossier partagé (tous les fichiers déjà hachés
+# avec la même taille de bloc) et des fichiers ajoutés explicitement (ancienne version
+# du fichier, téléchargement partiel). Chaque bloc est revérifié au moment de sa lecture.
+class LocalChunks:
+    def __init__(self, chunk_size, index=None):
+        self.chunk_size = chunk_size
+        self.index = index if index is not None and index.chunk_size == chunk_size else None
+        self.known = {}
+
+    # Hacher un fichier local et mémoriser la position de ses blocs
+    def add_file(self, path):
+        try:
+            _, digests = hash_chunks(path, self.chunk_size)
+        except OSError:
+            return
+        size = os.path.getsize(path)
+        for i, digest in enumerate(digests):
+            offset = i * self.chunk_size
+            self.known.setdefault(digest, (path, offset, min(self.chunk_size, size - offset)))
+
+    # Emplacement (chemin, offset, longueur) d'un bloc, ou None
+    def find(self, digest):
+        location = self.known.get(digest)
+        if location is None and self.index is not None:
+            location = self.index.find_chunk(digest)
+        return location
+
+    # Lire un bloc local et vérifier son empreinte ; None s'il a changé entre-temps
+    def read(self, digest):
+        location = self.find(digest)
+        if location is None:
+            return None
+        path, offset, length = location
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+        except OSError:
+            return None
+        if len(data) != length or hashlib.sha256(data).digest() != digest:
+            return None
+        return data
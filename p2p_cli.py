@@ -1,252 +1,195 @@
-import socket
-import threading
-import os
+import argparse
 import json
-import struct
+import sys
 import time
+from p2p_control import (
+    CONFIG_FILE, DONE, FAILED, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NAMES, QUEUED, STATE_NAMES, ControlError,
+    DaemonClient, attach, control_path, load_config
+)
 
-# Fichier de configuration et paramètres du multicast
-CONFIG_FILE = "config.json"
-MULTICAST_GROUP = '224.1.1.1'
-MULTICAST_PORT = 9999
-HOSTS_FILE = os.path.join(os.path.dirname(__file__), "p2p_hosts.txt")
+# La CLI est un client du démon du pair (p2p_daemon.py), lancé au besoin en
+# arrière-plan : le serveur, la découverte et la file des téléchargements continuent
+# après la sortie de la CLI. Seul le module de contrôle est importé au démarrage ; la
+# configuration n'est lue qu'au lancement d'une commande (connect).
+config = None
+# Client du démon (ouvert par connect)
+client = None
 
-# Charger la configuration (dossier partagé, port, etc.)
-def load_config():
-    with open(CONFIG_FILE, 'r') as f:
-        return json.load(f)
-
-config = load_config()
-shared_dir = config["shared_dir"]
-
-# Résoudre un nom d'hôte en IP (pour supporter les noms d'ordinateur)
-def resolve_host(host):
-    # Résolution via p2p_hosts.txt
-    if os.path.exists(HOSTS_FILE):
-        with open(HOSTS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) >= 2 and parts[1] == host:
-                    return parts[0]
-    # Fallback DNS
-    try:
-        return socket.gethostbyname(host)
-    except Exception:
-        return host
+# Pairs actuellement vivants (instantané, sans attente réseau)
+def known_peers():
+    return client.call("peers")
 
 # Lister les fichiers du dossier partagé local
 def list_files():
+    return client.call("local_files")
+
+# Récupérer la liste des fichiers d'un pair distant (liste déjà reçue réutilisée par
+# le démon tant que l'empreinte de son index, annoncée lors de la découverte, n'a pas
+# changé)
+def get_remote_files(host):
     try:
-        return os.listdir(shared_dir)
-    except FileNotFoundError:
+        return [name for batch in client.stream("remote_files", host=host) for name in batch]
+    except ControlError as e:
+        print(f"[!] Erreur récupération liste distante: {e}")
         return []
 
-# Obtenir l'adresse IP locale de la machine
-def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(('10.255.255.255', 1))
-        IP = s.getsockname()[0]
-    except Exception:
-        IP = '127.0.0.1'
-    finally:
-        s.close()
-    return IP
+# Mettre un fichier en file de téléchargement depuis un pair distant
+# (les autres pairs possédant le même fichier servent de sources supplémentaires ;
+# une copie locale existante est mise à jour par synchronisation différentielle)
+def download_file(host, filename, peers=(), port=None):
+    item = client.call("download", host=host, name=filename, port=port, holders=list(peers))
+    print(f"[+] '{filename}' ajouté à la file des téléchargements (n° {item['id']}).")
 
-# Serveur pair-à-pair : répond aux requêtes des autres pairs
-class PeerServer(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        self.host = config["host"]
-        self.port = config["port"]
+# Traduire une saisie de l'utilisateur en liste de fichiers : numéros ("1,3-5"),
+# "*" pour tous les fichiers, ou motif glob transmis tel quel au pair ("*.txt")
+def parse_selection(text, files):
+    if text == "*":
+        return list(files)
+    if any(c in text for c in "*?["):
+        return [text]
+    selected = []
+    for part in text.split(","):
+        start, _, end = part.strip().partition("-")
+        for i in range(int(start), int(end or start) + 1):
+            selected.append(files[i - 1])
+    if not selected:
+        raise ValueError("Sélection vide")
+    return selected
 
-    def run(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.bind((self.host, self.port))
-        s.listen(5)
-        print(f"[+] Serveur P2P en écoute sur {self.host}:{self.port}")
-        while True:
-            conn, addr = s.accept()
-            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+# Mettre en file plusieurs fichiers (ou motifs) d'un pair, transférés en un seul
+# flux (GET_MANY)
+def download_many(host, names):
+    item = client.call("enqueue", host=host, names=names)
+    print(f"[+] {len(names)} élément(s) de {host} ajouté(s) à la file des téléchargements (n° {item['id']}).")
 
-    # Gérer une connexion entrante (liste ou téléchargement de fichier)
-    def handle_client(self, conn, addr):
-        try:
-            request = conn.recv(1024).decode()
-            if request.startswith("GET_FILE "):
-                filename = request.split(" ", 1)[1].strip()
-                filepath = os.path.join(shared_dir, filename)
-                if os.path.exists(filepath):
-                    conn.send(b"OK\n")
-                    with open(filepath, "rb") as f:
-                        while True:
-                            chunk = f.read(4096)
-                            if not chunk:
-                                break
-                            conn.sendall(chunk)
-                else:
-                    conn.send(b"ERROR: File not found\n")
-            elif request.startswith("LIST_FILES"):
-                files = list_files()
-                response = "\n".join(files) + "\n"
-                conn.sendall(response.encode())
-            else:
-                conn.send(b"ERROR: Invalid command\n")
-        except Exception as e:
-            print(f"[!] Erreur avec {addr}: {e}")
-        finally:
-            conn.close()
+# Mettre en file les mêmes fichiers ou motifs chez plusieurs pairs à la fois : un lot
+# par pair, servis en parallèle par les workers de la file
+def download_from_peers(hosts, names):
+    items = client.call("enqueue_many", hosts=hosts, names=names)
+    print(f"[+] {len(items)} lot(s) ajouté(s) à la file des téléchargements.")
 
-# Thread pour répondre aux requêtes de découverte multicast
-class MulticastResponder(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        self.group = MULTICAST_GROUP
-        self.port = MULTICAST_PORT
+# Diffuser un fichier partagé à tous les récepteurs multicast (une seule émission,
+# blocs perdus réparés) ; rate en octets/s (débit initial, ajusté selon les pertes)
+def multicast_file(name, rate=None, receivers=0):
+    report = None
+    for report in client.stream("multicast", name=name, rate=rate, receivers=receivers):
+        done = report["done"]
+        print(f"  {report['elapsed']:.1f} s | {len(report['receivers'])} récepteur(s), {done} terminé(s) | "
+              f"{report['rate'] / 1024 / 1024:.1f} Mo/s | réparations "
+              f"{report['sent']['repair_multicast']} multicast, {report['sent']['repair_unicast']} unicast")
+    if report is None:
+        return
+    for address, receiver in report["receivers"].items():
+        state = "terminé" if receiver["done"] else receiver["error"] or f"{receiver['received']}/{report['blocks']} blocs"
+        print(f"  {address}: {state} (pertes max {receiver['max_loss'] * 100:.1f}%)")
+    print(f"[+] {name} diffusé à {report['done']} récepteur(s) en {report['elapsed']:.1f} s "
+          f"({report['bytes_sent']} octets émis pour {report['size']} octets).")
 
-    def run(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            sock.bind((self.group, self.port))
-        except OSError:
-            sock.bind(('', self.port))
-        group_bin = socket.inet_aton(self.group)
-        mreq = group_bin + socket.inet_aton('0.0.0.0')
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+# Répliquer des fichiers (noms, motifs ou dossiers partagés) vers plusieurs pairs en
+# chaîne ou en arbre : chaque pair écrit le fichier en le retransmettant aux suivants
+def push_files(names, hosts, fanout=None):
+    for report in client.stream("push", names=names, hosts=hosts, fanout=fanout):
+        print(f"[+] {report['name']} ({report['size']} octets) en {report['seconds']:.2f} s")
+        print_push_report(report, 1)
 
-        while True:
-            data, addr = sock.recvfrom(1024)
-            if data.decode() == "DISCOVER_P2P":
-                hostname = socket.gethostname()
-                ip = get_local_ip()
-                sock.sendto(f"{hostname}|{ip}".encode(), addr)
+def print_push_report(report, depth):
+    for child in report["children"]:
+        label = f"{'  ' * depth}{child['host']}:{child['port']}"
+        if child["ok"]:
+            rate = f"{child['rate'] / 1024 / 1024:.1f} Mo/s" if child.get("rate") else "-"
+            print(f"{label} : {rate}{' (rattaché)' if child['rerouted'] else ''}")
+        else:
+            print(f"{label} : ERREUR {child['error']}")
+        print_push_report(child, depth + 1)
 
-# Découverte des pairs sur le réseau local via multicast
-def send_discovery(timeout=2):
-    discovered = []
-    known_hosts = {}
-    # Charger les hosts connus
-    if os.path.exists(HOSTS_FILE):
-        with open(HOSTS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) >= 2:
-                    known_hosts[parts[1]] = parts[0]
-    # Découverte multicast
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.settimeout(timeout)
-    ttl = struct.pack('b', 1)
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-    sock.sendto(b"DISCOVER_P2P", (MULTICAST_GROUP, MULTICAST_PORT))
-    new_hosts = {}
-    try:
-        while True:
-            data, addr = sock.recvfrom(1024)
-            try:
-                hostname, ip = data.decode().split("|")
-            except Exception:
-                continue
-            if hostname not in discovered:
-                discovered.append(hostname)
-            if hostname not in known_hosts or known_hosts[hostname] != ip:
-                new_hosts[hostname] = ip
-    except socket.timeout:
-        pass
-    sock.close()
-    # Mise à jour du fichier hosts si besoin
-    if new_hosts:
-        known_hosts.update(new_hosts)
-        with open(HOSTS_FILE, "w") as f:
-            for h, ip in known_hosts.items():
-                f.write(f"{ip} {h}\n")
-    return discovered
+# Événement du démon : fin d'un téléchargement de la file, réception multicast, ou
+# arrêt du démon
+def on_daemon_event(event):
+    if event["event"] == "stopped":
+        print("\n[!] Le démon s'est arrêté.")
+        return
+    if event["event"] == "multicast":
+        transfer = event["transfer"]
+        if transfer["done"]:
+            print(f"\n[OK] {transfer['name']} reçu par multicast de {transfer['sender']}.")
+        else:
+            print(f"\n[ERREUR] Réception multicast de {transfer['name']}: {transfer['error']}")
+        return
+    if event["event"] != "download":
+        return
+    item = event["item"]
+    if item["state"] == DONE:
+        print(f"\n[OK] {item['message']}")
+    elif item["state"] == FAILED:
+        print(f"\n[ERREUR] Téléchargement de {item['label']}: {item['error']}")
+    elif item["state"] == QUEUED and item["error"]:
+        print(f"\n[!] {item['label']}: {item['error']} (nouvel essai prévu)")
 
-# Récupérer la liste des fichiers d'un pair distant
-def get_remote_files(host, port):
-    try:
-        ip = resolve_host(host)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(5)
-        s.connect((ip, int(port)))
-        s.sendall(b"LIST_FILES")
-        response = b""
-        while True:
-            part = s.recv(4096)
-            if not part:
-                break
-            response += part
-        s.close()
-        files = response.decode(errors="ignore").strip().split("\n")
-        return files if files != [''] else []
-    except Exception as e:
-        print(f"[!] Erreur récupération liste distante: {e}")
-        return []
+# Ligne d'état d'un élément de la file
+def format_item(item):
+    progress = ""
+    if item["size"]:
+        progress = f" {item['received'] * 100 / item['size']:.0f}%"
+    elif item["received"]:
+        progress = f" {item['received']/1024:.1f} Ko"
+    if item["speed"]:
+        progress += f" ({item['speed']/1024:.1f} Ko/s)"
+    detail = item["message"] if item["state"] == DONE else item["error"] or ""
+    return (f"  {item['id']}. [{STATE_NAMES[item['state']]}] {item['label']} | priorité "
+            f"{PRIORITY_NAMES.get(item['priority'], item['priority'])}{progress}"
+            f"{' | ' + detail if detail else ''}")
 
-# Télécharger un fichier depuis un pair distant
-def download_file(host, port, filename):
-    s = None
-    try:
-        ip = resolve_host(host)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ip, int(port)))
-        s.sendall(f"GET_FILE {filename}".encode())
-        response = b""
-        # Lire la réponse d'en-tête ("OK\n" ou "ERROR...")
-        while not response.endswith(b"\n"):
-            chunk = s.recv(1)
-            if not chunk:
-                break
-            response += chunk
-        if response.startswith(b"OK"):
-            local_path = os.path.join(shared_dir, filename)
-            print(f"Téléchargement de '{filename}' en cours...")
-            with open(local_path, "wb") as f:
-                leftover = response[len(b"OK\n"):]
-                total_bytes = 0
-                if leftover:
-                    f.write(leftover)
-                    total_bytes += len(leftover)
-                start_time = time.time()
-                last_time = start_time
-                last_bytes = 0
-                while True:
-                    data = s.recv(4096)
-                    if not data:
-                        break
-                    f.write(data)
-                    total_bytes += len(data)
-                    # Affichage de la progression et vitesse
-                    now = time.time()
-                    if now - last_time > 0.5:  # Mise à jour toutes les 0.5s
-                        speed = (total_bytes - last_bytes) / (now - last_time) / 1024  # Ko/s
-                        print(f"\rReçu: {total_bytes/1024:.1f} Ko | Vitesse: {speed:.1f} Ko/s", end="")
-                        last_time = now
-                        last_bytes = total_bytes
-                # Affichage final
-                elapsed = time.time() - start_time
-                avg_speed = (total_bytes / 1024) / elapsed if elapsed > 0 else 0
-                print(f"\rReçu: {total_bytes/1024:.1f} Ko | Vitesse moyenne: {avg_speed:.1f} Ko/s")
-            print(f"[OK] Fichier '{filename}' téléchargé avec succès.")
-        else:
-            print("[ERREUR]", response.decode(errors="ignore").strip())
-    except Exception as e:
-        print(f"[ERREUR] Téléchargement: {e}")
-    finally:
-        if s:
-            s.close()
+# Afficher la file des téléchargements et agir sur ses éléments
+def manage_downloads():
+    while True:
+        items = client.call("downloads")
+        if not items:
+            print("File des téléchargements vide.")
+            return
+        print("File des téléchargements:")
+        for item in items:
+            print(format_item(item))
+        action = input("Action (p N: pause, r N: reprendre, a N: annuler, h N / b N: priorité haute / "
+                       "basse, c: retirer les terminés, Entrée: retour): ").strip().split()
+        if not action:
+            return
+        command = action[0].lower()
+        if command == "c":
+            client.call("clear_finished")
+            continue
+        try:
+            item_id = int(action[1])
+        except (IndexError, ValueError):
+            print("Action invalide.")
+            continue
+        actions = {
+            "p": lambda i: client.call("pause", item_id=i),
+            "r": lambda i: client.call("resume", item_id=i),
+            "a": lambda i: client.call("cancel", item_id=i),
+            "h": lambda i: client.call("set_priority", item_id=i, priority=PRIORITY_HIGH),
+            "b": lambda i: client.call("set_priority", item_id=i, priority=PRIORITY_LOW),
+        }
+        if command not in actions or not actions[command](item_id):
+            print("Action impossible pour cet élément.")
+
+# Rechercher un fichier chez tous les pairs connus ; les résultats s'affichent au fur
+# et à mesure des réponses. Renvoie la liste numérotée des (hôte, port, fichier)
+def search_files(pattern):
+    results = []
+    for host, port, files, error in client.stream("search", pattern=pattern):
+        if error:
+            print(f"[!] {host}: {error}")
+            continue
+        for entry in files:
+            results.append((host, port, entry))
+            size = f" ({entry['size']/1024:.1f} Ko)" if entry.get("size") is not None else ""
+            print(f"  {len(results)}. {entry['name']}{size} — {host}")
+    return results
 
 # Menu principal CLI
 def main_cli():
-    os.makedirs(shared_dir, exist_ok=True)
-    PeerServer().start()
-    MulticastResponder().start()
+    connect()
+    unsubscribe = client.subscribe(on_daemon_event)
 
     print("=== P2P File Share CLI ===")
     while True:
@@ -254,11 +197,15 @@ def main_cli():
         print("2. Lister mes fichiers partagés")
         print("3. Lister les fichiers d'un pair")
         print("4. Télécharger un fichier depuis un pair")
-        print("5. Quitter")
+        print("5. Synchroniser un fichier local depuis un pair")
+        print("6. Rechercher un fichier sur le réseau")
+        print("7. Télécharger depuis plusieurs pairs")
+        print("8. File des téléchargements")
+        print("9. Quitter")
         choice = input("Choix: ").strip()
         if choice == "1":
-            # Découverte des pairs sur le réseau
-            peers = send_discovery()
+            # Pairs découverts en arrière-plan (une nouvelle requête est aussi envoyée)
+            peers = client.call("peers", refresh=True)
             if not peers:
                 print("Aucun pair trouvé.")
             else:
@@ -273,7 +220,7 @@ def main_cli():
                 print("  -", f)
         elif choice == "3":
             # Lister les fichiers d'un pair distant
-            peers = send_discovery()
+            peers = known_peers()
             if not peers:
                 print("Aucun pair trouvé.")
                 continue
@@ -286,13 +233,13 @@ def main_cli():
             except:
                 print("Sélection invalide.")
                 continue
-            files = get_remote_files(host, config["port"])
+            files = get_remote_files(host)
             print(f"Fichiers partagés par {host}:")
             for f in files:
                 print("  -", f)
         elif choice == "4":
             # Télécharger un fichier depuis un pair distant
-            peers = send_discovery()
+            peers = known_peers()
             if not peers:
                 print("Aucun pair trouvé.")
                 continue
@@ -305,26 +252,197 @@ def main_cli():
             except:
                 print("Sélection invalide.")
                 continue
-            files = get_remote_files(host, config["port"])
+            files = get_remote_files(host)
             if not files:
                 print("Aucun fichier à télécharger.")
                 continue
             for i, f in enumerate(files):
                 print(f"  {i+1}. {f}")
-            fidx = input("Numéro du fichier à télécharger: ").strip()
+            selection = input("Numéro(s) du/des fichier(s) à télécharger (ex: 2, 1,3-5, * ou *.txt): ").strip()
+            try:
+                selected = parse_selection(selection, files)
+            except:
+                print("Sélection invalide.")
+                continue
+            if len(selected) == 1 and selected[0] in files:
+                download_file(host, selected[0], peers)
+            else:
+                download_many(host, selected)
+        elif choice == "5":
+            # Synchroniser un fichier local avec la version d'un pair (delta)
+            peers = known_peers()
+            if not peers:
+                print("Aucun pair trouvé.")
+                continue
+            for i, host in enumerate(peers):
+                print(f"  {i+1}. {host}")
+            idx = input("Numéro du pair: ").strip()
+            try:
+                idx = int(idx) - 1
+                host = peers[idx]
+            except:
+                print("Sélection invalide.")
+                continue
+            remote = set(get_remote_files(host))
+            files = [f for f in list_files() if f in remote]
+            if not files:
+                print("Aucun fichier local partagé par ce pair.")
+                continue
+            for i, f in enumerate(files):
+                print(f"  {i+1}. {f}")
+            fidx = input("Numéro du fichier à synchroniser: ").strip()
             try:
                 fidx = int(fidx) - 1
                 filename = files[fidx]
             except:
                 print("Sélection invalide.")
                 continue
-            download_file(host, config["port"], filename)
-        elif choice == "5":
-            # Quitter le programme
+            # Mise à jour différentielle (ou téléchargement complet si le pair ne
+            # supporte pas DELTA) assurée par la file
+            download_file(host, filename, peers)
+        elif choice == "6":
+            # Recherche sur tous les pairs, puis téléchargement éventuel d'un résultat
+            pattern = input("Nom ou motif recherché (ex: rapport, *.pdf): ").strip()
+            if not pattern:
+                continue
+            if not known_peers():
+                print("Aucun pair trouvé.")
+                continue
+            start_time = time.time()
+            results = search_files(pattern)
+            print(f"{len(results)} résultat(s) en {time.time() - start_time:.2f} s.")
+            if not results:
+                continue
+            idx = input("Numéro du fichier à télécharger (Entrée pour aucun): ").strip()
+            if not idx:
+                continue
+            try:
+                host, port, entry = results[int(idx) - 1]
+            except:
+                print("Sélection invalide.")
+                continue
+            # Les autres pairs qui ont le même fichier servent de sources supplémentaires
+            holders = [h for h, _, e in results if e["name"] == entry["name"]]
+            download_file(host, entry["name"], holders, port)
+        elif choice == "7":
+            # Mêmes fichiers ou motifs chez plusieurs pairs, téléchargés en parallèle
+            peers = known_peers()
+            if not peers:
+                print("Aucun pair trouvé.")
+                continue
+            for i, host in enumerate(peers):
+                print(f"  {i+1}. {host}")
+            selection = input("Numéros des pairs (ex: 1,3-4 ou *): ").strip()
+            try:
+                hosts = parse_selection(selection, peers)
+            except:
+                print("Sélection invalide.")
+                continue
+            names = [n.strip() for n in input("Fichiers, motifs ou dossiers (séparés par des virgules): ").split(",")]
+            names = [n for n in names if n]
+            if not names:
+                print("Sélection invalide.")
+                continue
+            download_from_peers(hosts, names)
+        elif choice == "8":
+            manage_downloads()
+        elif choice == "9":
+            # Quitter la CLI : le démon continue de partager et de télécharger
+            unsubscribe()
+            client.close()
+            if isinstance(client, DaemonClient):
+                print("Le démon continue en arrière-plan (python p2p_cli.py stop pour l'arrêter).")
             print("Bye!")
             break
         else:
             print("Choix invalide.")
 
+# Charger la configuration et se connecter au démon (lancé s'il ne tourne pas)
+def connect(spawn=True):
+    global config, client
+    config = load_config()
+    client = attach(config, spawn=spawn, config_file=CONFIG_FILE)
+
+# Commandes courtes : une opération du démon, sans menu
+def run_command(args):
+    global config, client
+    if args.command == "daemon":
+        # Démon au premier plan (import différé du serveur)
+        from p2p_daemon import main as daemon_main
+        daemon_main(["--config", CONFIG_FILE])
+        return 0
+    if args.command in ("status", "stop"):
+        # Sans démon actif, rien à afficher ni à arrêter : aucun démon n'est lancé
+        config = load_config()
+        client = DaemonClient(control_path(config))
+        if not client.ping():
+            print("Aucun démon actif.")
+            return 1
+        if args.command == "stop":
+            client.call("shutdown")
+            print("Arrêt du démon demandé.")
+        else:
+            print(json.dumps(client.call("status"), indent=2, ensure_ascii=False))
+        return 0
+    connect()
+    try:
+        if args.command == "peers":
+            for host in client.call("peers", refresh=args.refresh):
+                print(host)
+        elif args.command == "files":
+            for name in get_remote_files(args.host):
+                print(name)
+        elif args.command == "search":
+            print(f"{len(search_files(args.pattern))} résultat(s).")
+        elif args.command == "get":
+            if len(args.names) == 1 and args.names[0] in get_remote_files(args.host):
+                download_file(args.host, args.names[0], known_peers())
+            else:
+                download_many(args.host, args.names)
+        elif args.command == "downloads":
+            for item in client.call("downloads"):
+                print(format_item(item))
+        elif args.command == "push":
+            push_files(args.names, args.to, args.fanout)
+        elif args.command == "multicast":
+            rate = int(args.rate * 1024 * 1024) if args.rate else None
+            multicast_file(args.name, rate, args.receivers)
+    except ControlError as e:
+        print(f"[!] {e}")
+        return 1
+    finally:
+        client.close()
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="P2P File Share (menu interactif sans commande)")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("daemon", help="exécuter le démon du pair au premier plan")
+    commands.add_parser("status", help="état du démon")
+    commands.add_parser("stop", help="arrêter le démon")
+    peers = commands.add_parser("peers", help="pairs vivants")
+    peers.add_argument("--refresh", action="store_true", help="interroger aussi tout le groupe")
+    files = commands.add_parser("files", help="fichiers d'un pair")
+    files.add_argument("host")
+    search = commands.add_parser("search", help="rechercher un fichier sur le réseau")
+    search.add_argument("pattern")
+    get = commands.add_parser("get", help="mettre des fichiers ou motifs d'un pair en file")
+    get.add_argument("host")
+    get.add_argument("names", nargs="+")
+    commands.add_parser("downloads", help="file des téléchargements")
+    push = commands.add_parser("push", help="répliquer des fichiers vers plusieurs pairs (chaîne ou arbre)")
+    push.add_argument("names", nargs="+")
+    push.add_argument("--to", nargs="+", required=True, metavar="PAIR", help="pairs destinataires")
+    push.add_argument("--fanout", type=int, help="enfants par pair (1 : chaîne)")
+    multicast = commands.add_parser("multicast", help="diffuser un fichier partagé à tous les récepteurs multicast")
+    multicast.add_argument("name")
+    multicast.add_argument("--rate", type=float, help="débit initial (Mo/s)")
+    multicast.add_argument("--receivers", type=int, default=0, help="récepteurs attendus avant l'envoi")
+    args = parser.parse_args()
+    if args.command is None:
+        main_cli()
+        return 0
+    return run_command(args)
+
 if __name__ == "__main__":
-    main_cli()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
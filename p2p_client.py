@@ -0,0 +1,870 @@
+import hashlib
+import json
+import os
+import select
+import socket
+import threading
+import time
+import urllib.parse
+from p2p_batch import FORMAT_FRAMES, FORMAT_TAR, BodyReader, unpack_frames, unpack_tar
+from p2p_chunks import Manifest
+from p2p_compress import FRAME_HEADER, accept_flags, make_decompressor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from p2p_delta import (
+    COPY_OP, LITERAL_OP, MAX_SIGNATURE_SIZE, OP_COPY, file_signature, get_delta_block_size, signature_size
+)
+from p2p_index import name_matcher
+from p2p_metrics import metrics
+from p2p_peers import registry
+from p2p_protocol import (
+    KEEPALIVE_VERSION, MAGIC, STATUS_INVALID, STATUS_OK, STATUS_NOT_FOUND, STATUS_ERROR, ProtocolError,
+    error_message, pack_request, read_response, recv_exact, recv_prefix
+)
+from p2p_shaping import BandwidthShaper
+from p2p_transfer import (
+    PART_SUFFIX, configure_socket, get_chunk_size, preallocate, pwrite, resolve_shared_path, set_nodelay
+)
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_POOL_MAX_IDLE = 8
+DEFAULT_POOL_IDLE_TIMEOUT = 20
+DEFAULT_PIPELINE_WINDOW = 16
+DEFAULT_SEARCH_TIMEOUT = 3
+DEFAULT_SEARCH_CACHE_TTL = 10
+DEFAULT_LIST_PAGE_SIZE = 1000
+
+# Pairs ayant répondu en protocole texte : on ne leur envoie plus de requête binaire
+_legacy_peers = set()
+
+# Résoudre un nom d'hôte en IP (pour supporter les noms d'ordinateur)
+#
+# Résolution en mémoire (fichier hosts chargé une fois, DNS en cache) : voir p2p_peers.
+def resolve_host(host):
+    return registry.resolve(host)
+
+# Connexions persistantes inutilisées, par pair (hôte, port)
+#
+# Une connexion n'est rendue au pool qu'une fois sa dernière réponse entièrement lue.
+# Les connexions inutilisées depuis plus de idle_timeout secondes sont fermées par un
+# thread de nettoyage (le pair les ferme de son côté après son propre idle_timeout,
+# qui doit rester plus long) ; une connexion fermée entre-temps par le pair est
+# détectée à sa reprise et remplacée.
+class ConnectionPool:
+    def __init__(self, max_idle=DEFAULT_POOL_MAX_IDLE, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def configure(self, config):
+        self.max_idle = int(config.get("pool_max_idle", DEFAULT_POOL_MAX_IDLE))
+        self.idle_timeout = float(config.get("pool_idle_timeout", DEFAULT_POOL_IDLE_TIMEOUT))
+
+    # Connexion inutilisée vers peer, ou None
+    def acquire(self, peer):
+        while True:
+            with self.lock:
+                connections = self.idle.get(peer)
+                if not connections:
+                    return None
+                sock, _ = connections.pop()
+            if _is_reusable(sock):
+                return sock
+            sock.close()
+
+    def release(self, peer, sock):
+        with self.lock:
+            connections = self.idle.setdefault(peer, [])
+            if len(connections) < self.max_idle:
+                connections.append((sock, time.monotonic()))
+                sock = None
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self._reap_loop, daemon=True)
+                self.reaper.start()
+        if sock is not None:
+            sock.close()
+
+    # Fermer les connexions inutilisées depuis plus de idle_timeout secondes
+    def evict_idle(self):
+        limit = time.monotonic() - self.idle_timeout
+        expired = []
+        with self.lock:
+            for peer, connections in list(self.idle.items()):
+                expired += [sock for sock, last_used in connections if last_used < limit]
+                connections[:] = [(sock, last_used) for sock, last_used in connections if last_used >= limit]
+                if not connections:
+                    del self.idle[peer]
+        for sock in expired:
+            sock.close()
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 2))
+            self.evict_idle()
+
+    def close_all(self):
+        with self.lock:
+            connections = [sock for entries in self.idle.values() for sock, _ in entries]
+            self.idle = {}
+        for sock in connections:
+            sock.close()
+
+_pool = ConnectionPool()
+
+# Débit de réception : plafonds max_download_rate / max_peer_download_rate (octets/s),
+# partagés par tous les téléchargements du processus
+_download_shaper = BandwidthShaper()
+
+# Fonction appelée après chaque bloc de données reçu d'un pair : octets reçus (mesures)
+# puis attente de la limitation de débit si un plafond est configuré
+def _receive_hook(ip):
+    limited = _download_shaper.limited
+    def on_data(n):
+        metrics.add("p2p_bytes_received_total", n, peer=ip)
+        if limited:
+            _download_shaper.wait(ip, n)
+    return on_data
+
+# Une connexion inutilisée ne doit rien avoir à lire : des données ou une fin de flux
+# signifient que le pair l'a fermée (ou que le flux est désynchronisé)
+def _is_reusable(sock):
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+# Réponse à une commande : la socket est positionnée au début du corps
+#
+# size vaut None pour un ancien pair (protocole texte) : le corps se termine alors
+# à la fermeture de la connexion et sa longueur ne peut pas être vérifiée.
+# release(sock) rend la connexion réutilisable (connexion persistante) : close() ne
+# l'appelle que si le corps a été entièrement lu, et ferme la connexion sinon.
+# Un corps compressé (meta "encoding") arrive en trames décompressées à la volée ;
+# size reste la taille décompressée et wire_bytes compte les octets reçus.
+# on_data(n) (mesures et limitation du débit de réception) est appelé après chaque bloc reçu
+# par les lectures de données (copy_to, write_at) ; les lectures de métadonnées
+# (read_body, iter_body) ne sont jamais ralenties.
+class Response:
+    def __init__(self, sock, status, size, meta, pending=b"", version=None, release=None, on_data=None):
+        self.sock = sock
+        self.status = status
+        self.size = size
+        self.meta = meta
+        self.pending = pending
+        self.version = version
+        self.release = release
+        self.complete = size == 0 and not meta.get("encoding")
+        self.wire_bytes = 0
+        self.closed = False
+        self.on_data = on_data
+
+    @property
+    def ok(self):
+        return self.status == STATUS_OK
+
+    @property
+    def error(self):
+        return error_message(self.status, self.meta)
+
+    @property
+    def encoding(self):
+        return self.meta.get("encoding")
+
+    def _recv_exact(self, n):
+        data, self.pending = self.pending[:n], self.pending[n:]
+        if len(data) < n:
+            data += recv_exact(self.sock, n - len(data))
+        self.wire_bytes += n
+        return data
+
+    # Blocs décompressés d'un corps compressé, jusqu'à la trame vide finale
+    def _decoded_chunks(self, on_data=None):
+        decompressor = make_decompressor(self.encoding)
+        total = 0
+        while True:
+            length, = FRAME_HEADER.unpack(self._recv_exact(FRAME_HEADER.size))
+            if not length:
+                break
+            frame = self._recv_exact(length)
+            if on_data:
+                on_data(FRAME_HEADER.size + length)
+            data = decompressor.decompress(frame)
+            total += len(data)
+            if total > self.size:
+                raise ProtocolError("Corps compressé plus long que annoncé")
+            if data:
+                yield data
+        if total != self.size:
+            raise ProtocolError(f"Transfert incomplet: {total}/{self.size} octets décompressés")
+        self.complete = True
+
+    # Copier le corps dans un fichier en vérifiant la longueur reçue
+    def copy_to(self, f, chunk_size, progress_callback=None):
+        total = 0
+        if self.encoding:
+            for data in self._decoded_chunks(self.on_data):
+                f.write(data)
+                total += len(data)
+                if progress_callback:
+                    progress_callback(total, self.size)
+            return total
+        if self.pending:
+            f.write(self.pending)
+            total += len(self.pending)
+        buf = memoryview(bytearray(chunk_size))
+        while self.size is None or total < self.size:
+            want = chunk_size if self.size is None else min(chunk_size, self.size - total)
+            n = self.sock.recv_into(buf[:want])
+            if not n:
+                break
+            f.write(buf[:n])
+            total += n
+            if self.on_data:
+                self.on_data(n)
+            if progress_callback:
+                progress_callback(total, self.size)
+        if self.size is not None and total != self.size:
+            raise ProtocolError(f"Transfert incomplet: {total}/{self.size} octets reçus")
+        self.complete = True
+        return total
+
+    # Écrire le corps en place dans fd à partir de offset (os.pwrite)
+    #
+    # progress_callback(n) reçoit le nombre d'octets de chaque bloc écrit.
+    def write_at(self, fd, offset, chunk_size, progress_callback=None):
+        total = 0
+        if self.encoding:
+            for data in self._decoded_chunks(self.on_data):
+                pwrite(fd, data, offset + total)
+                total += len(data)
+                if progress_callback:
+                    progress_callback(len(data))
+            return total
+        if self.pending:
+            pwrite(fd, self.pending, offset)
+            total += len(self.pending)
+            if progress_callback:
+                progress_callback(len(self.pending))
+        buf = memoryview(bytearray(chunk_size))
+        while self.size is None or total < self.size:
+            want = chunk_size if self.size is None else min(chunk_size, self.size - total)
+            n = self.sock.recv_into(buf[:want])
+            if not n:
+                break
+            pwrite(fd, buf[:n], offset + total)
+            total += n
+            if self.on_data:
+                self.on_data(n)
+            if progress_callback:
+                progress_callback(n)
+        if self.size is not None and total != self.size:
+            raise ProtocolError(f"Transfert incomplet: {total}/{self.size} octets reçus")
+        self.complete = True
+        return total
+
+    # Parcourir le corps par blocs, au fur et à mesure de sa réception
+    def iter_body(self, chunk_size=65536):
+        if self.encoding:
+            yield from self._decoded_chunks()
+            return
+        total = len(self.pending)
+        if self.pending:
+            yield self.pending
+        while self.size is None or total < self.size:
+            part = self.sock.recv(chunk_size if self.size is None else min(chunk_size, self.size - total))
+            if not part:
+                break
+            total += len(part)
+            if total == self.size:
+                self.complete = True
+            yield part
+        if self.size is not None and total != self.size:
+            raise ProtocolError(f"Réponse incomplète: {total}/{self.size} octets reçus")
+        self.complete = True
+
+    # Lire le corps entier en mémoire
+    def read_body(self, chunk_size=65536):
+        if self.encoding:
+            return b"".join(self._decoded_chunks())
+        parts = [self.pending]
+        total = len(self.pending)
+        while self.size is None or total < self.size:
+            part = self.sock.recv(chunk_size if self.size is None else min(chunk_size, self.size - total))
+            if not part:
+                break
+            parts.append(part)
+            total += len(part)
+        if self.size is not None and total != self.size:
+            raise ProtocolError(f"Réponse incomplète: {total}/{self.size} octets reçus")
+        self.complete = True
+        return b"".join(parts)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        release, self.release = self.release, None
+        if release is not None and self.complete and self.size is not None:
+            release(self.sock)
+        else:
+            self.sock.close()
+
+def connect(ip, port, config, timeout=None):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    configure_socket(s, config)
+    set_nodelay(s)
+    if timeout:
+        s.settimeout(timeout)
+    try:
+        # Durée d'établissement de la connexion : un aller-retour (RTT du pair)
+        start = time.perf_counter()
+        s.connect((ip, int(port)))
+        registry.record_rtt(ip, time.perf_counter() - start)
+    except Exception:
+        s.close()
+        raise
+    return s
+
+# Lire la ligne d'en-tête de l'ancien protocole ("OK\n" ou "ERROR: ...\n")
+def _read_legacy_header(s, chunk_size):
+    data = b""
+    while b"\n" not in data:
+        part = s.recv(chunk_size)
+        if not part:
+            break
+        data += part
+    line, _, pending = data.partition(b"\n")
+    if line.startswith(b"OK"):
+        return STATUS_OK, {}, pending
+    message = line.decode(errors="ignore").strip()
+    if message.startswith("ERROR:"):
+        message = message[len("ERROR:"):].strip()
+    status = STATUS_NOT_FOUND if message == "File not found" else STATUS_ERROR
+    return status, {"error": message or "Réponse vide"}, b""
+
+# Envoyer une commande à un pair et lire l'en-tête de la réponse
+#
+# Le protocole binaire est tenté en premier ; si le pair répond en texte (ancienne
+# version), la commande est renvoyée en texte sur une nouvelle connexion.
+# legacy_header indique si l'ancienne réponse commence par une ligne "OK"/"ERROR".
+# body est envoyé juste après une requête binaire (jamais à un ancien pair) ; une
+# erreur d'envoi est ignorée, la réponse du pair en donnant la raison.
+# flags est l'octet d'options de la requête binaire (compressions acceptées).
+# La réponse reçoit la fonction appelée pour chaque bloc de données reçu du pair
+# (Response.on_data : octets reçus, et limitation si un débit maximal est configuré).
+#
+# Avec "keepalive" (activé par défaut), la connexion est prise dans le pool et y est
+# rendue à la fermeture de la réponse si le pair la garde ouverte (protocole v2).
+def send_command(host, port, command, config, timeout=None, legacy_header=True, body=b"", flags=0):
+    ip = resolve_host(host)
+    peer = (ip, int(port))
+    _download_shaper.configure(config, "download")
+    on_data = _receive_hook(ip)
+    if peer not in _legacy_peers:
+        keepalive = config.get("keepalive", True)
+        if keepalive:
+            _pool.configure(config)
+        s = _pool.acquire(peer) if keepalive else None
+        reused = s is not None
+        if reused:
+            s.settimeout(timeout)
+        else:
+            s = connect(ip, port, config, timeout)
+        try:
+            s.sendall(pack_request(command, flags=flags))
+            if body:
+                try:
+                    s.sendall(body)
+                except OSError:
+                    pass
+            head = recv_prefix(s, len(MAGIC))
+            if head == MAGIC:
+                version, status, size, meta = read_response(s, head)
+                release = None
+                if keepalive and version >= KEEPALIVE_VERSION:
+                    release = lambda sock: _pool.release(peer, sock)
+                return Response(s, status, size, meta, version=version, release=release, on_data=on_data)
+        except OSError:
+            s.close()
+            if reused:
+                # Connexion persistante fermée par le pair entre-temps : nouvel essai
+                return send_command(host, port, command, config, timeout, legacy_header, body, flags)
+            raise
+        except Exception:
+            s.close()
+            raise
+        s.close()
+        if reused:
+            return send_command(host, port, command, config, timeout, legacy_header, body, flags)
+        _legacy_peers.add(peer)
+    s = connect(ip, port, config, timeout)
+    try:
+        s.sendall(command.encode())
+        if legacy_header:
+            status, meta, pending = _read_legacy_header(s, get_chunk_size(config))
+        else:
+            status, meta, pending = STATUS_OK, {}, b""
+    except Exception:
+        s.close()
+        raise
+    return Response(s, status, None, meta, pending, on_data=on_data)
+
+# Lignes non vides du corps d'une réponse, décodées au fur et à mesure de la réception
+#
+# La réponse est fermée (et sa connexion rendue au pool) dès le corps entièrement lu,
+# avant que les dernières lignes ne soient traitées par l'appelant.
+def _iter_lines(response, chunk_size):
+    rest = b""
+    try:
+        for part in response.iter_body(chunk_size):
+            lines = (rest + part).split(b"\n")
+            rest = lines.pop()
+            if response.complete:
+                response.close()
+            for line in lines:
+                if line:
+                    yield line.decode(errors="ignore")
+    finally:
+        response.close()
+    if rest:
+        yield rest.decode(errors="ignore")
+
+# Récupérer la liste des fichiers d'un pair distant
+def fetch_file_list(host, port, config, timeout=5):
+    response = send_command(host, port, "LIST_FILES", config, timeout, legacy_header=False)
+    if not response.ok:
+        response.close()
+        raise ProtocolError(response.error)
+    return list(_iter_lines(response, get_chunk_size(config)))
+
+# Parcourir la liste des fichiers d'un pair page par page (LIST_PAGE), pour les très
+# grands dossiers partagés : générateur de dictionnaires {"name", "size", "mtime",
+# "sha256"} produits au fur et à mesure de la réception. Filtres : prefix, min_size,
+# max_size et since (date de modification minimale). Un pair sans LIST_PAGE est
+# listé en entier (noms seuls, seul le filtre prefix est alors appliqué).
+def iter_file_list(host, port, config, timeout=5, page_size=None, prefix="", min_size=None,
+                   max_size=None, since=None):
+    params = {"limit": page_size or int(config.get("list_page_size", DEFAULT_LIST_PAGE_SIZE))}
+    for key, value in (("prefix", prefix), ("min_size", min_size), ("max_size", max_size), ("since", since)):
+        if value:
+            params[key] = value
+    after = ""
+    chunk_size = get_chunk_size(config)
+    while True:
+        query = urllib.parse.urlencode(dict(params, after=after) if after else params)
+        response = send_command(host, port, f"LIST_PAGE {query}", config, timeout, legacy_header=False)
+        if not response.ok or response.size is None:
+            response.close()
+            if after or (response.size is not None and response.status != STATUS_INVALID):
+                raise ProtocolError(response.error)
+            for name in fetch_file_list(host, port, config, timeout):
+                if name.startswith(prefix):
+                    yield {"name": name}
+            return
+        cursor = response.meta.get("next")
+        for line in _iter_lines(response, chunk_size):
+            yield json.loads(line)
+        if not cursor:
+            return
+        after = cursor
+
+# Liste détaillée des fichiers d'un pair : dictionnaires {"name", "size", "mtime", "sha256"}
+# (seuls les noms sont connus pour un pair sans LIST_FILES_V2)
+def fetch_file_index(host, port, config, timeout=5):
+    response = send_command(host, port, "LIST_FILES_V2", config, timeout, legacy_header=False)
+    try:
+        if response.ok and response.size is not None:
+            return json.loads(response.read_body(get_chunk_size(config)).decode())["files"]
+    finally:
+        response.close()
+    return [{"name": name} for name in fetch_file_list(host, port, config, timeout)]
+
+# Rechercher un motif parmi les fichiers d'un pair : liste de dictionnaires comme
+# fetch_file_index. Un pair sans commande SEARCH est listé puis filtré localement.
+def search_peer(host, port, pattern, config, timeout=DEFAULT_SEARCH_TIMEOUT):
+    response = send_command(host, port, f"SEARCH {pattern}", config, timeout, legacy_header=False)
+    try:
+        if response.ok and response.size is not None:
+            return json.loads(response.read_body(get_chunk_size(config)).decode())["files"]
+        if response.size is not None and response.status != STATUS_INVALID:
+            raise ProtocolError(response.error)
+    finally:
+        response.close()
+    match = name_matcher(pattern)
+    return [{"name": name} for name in fetch_file_list(host, port, config, timeout) if match(name)]
+
+# Résultats récents : (hôte, port, motif) -> (expiration, résultats)
+_search_cache = {}
+_search_cache_lock = threading.Lock()
+
+# Rechercher un motif sur plusieurs pairs en parallèle
+#
+# peers est une liste de (hôte, port). Générateur de (hôte, port, fichiers, erreur),
+# produits dans l'ordre d'arrivée des réponses : la recherche dure environ le temps
+# de réponse du pair le plus lent, borné par "search_timeout" par pair. Les résultats
+# d'un pair sont gardés "search_cache_ttl" secondes.
+def search_network(peers, pattern, config):
+    timeout = float(config.get("search_timeout", DEFAULT_SEARCH_TIMEOUT))
+    ttl = float(config.get("search_cache_ttl", DEFAULT_SEARCH_CACHE_TTL))
+    now = time.monotonic()
+    pending = []
+    for host, port in peers:
+        with _search_cache_lock:
+            cached = _search_cache.get((host, port, pattern))
+        if cached is not None and cached[0] > now:
+            yield host, port, cached[1], None
+        else:
+            pending.append((host, port))
+    if not pending:
+        return
+    executor = ThreadPoolExecutor(max_workers=len(pending))
+    try:
+        futures = {executor.submit(search_peer, host, port, pattern, config, timeout): (host, port)
+                   for host, port in pending}
+        for future in as_completed(futures):
+            host, port = futures[future]
+            try:
+                files = future.result()
+            except Exception as e:
+                yield host, port, None, str(e)
+                continue
+            with _search_cache_lock:
+                _search_cache[(host, port, pattern)] = (time.monotonic() + ttl, files)
+            yield host, port, files, None
+    finally:
+        executor.shutdown(wait=False)
+        with _search_cache_lock:
+            limit = time.monotonic()
+            for key in [k for k, (expires, _) in _search_cache.items() if expires <= limit]:
+                del _search_cache[key]
+
+# Télécharger un fichier dans dest_dir ; renvoie le nombre d'octets reçus
+#
+# progress_callback(octets_reçus, taille_totale) est appelé à chaque bloc reçu
+# (taille_totale vaut None avec un ancien pair).
+def fetch_file(host, port, filename, dest_dir, config, progress_callback=None):
+    local_path = resolve_shared_path(dest_dir, filename)
+    if local_path is None:
+        raise ProtocolError(f"Nom de fichier invalide: {filename}")
+    response = send_command(host, port, f"GET_FILE {filename}", config, flags=accept_flags(config))
+    try:
+        return _save_response(response, local_path, config, progress_callback)
+    finally:
+        response.close()
+
+# Enregistrer le corps d'une réponse GET_FILE dans local_path
+def _save_response(response, local_path, config, progress_callback=None):
+    if not response.ok:
+        raise ProtocolError(response.error)
+    # Écriture dans un .part renommé seulement une fois le transfert complet,
+    # pour ne jamais laisser un fichier tronqué qui aurait l'air complet
+    part_path = local_path + PART_SUFFIX
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    try:
+        with open(part_path, "wb") as f:
+            if response.size:
+                preallocate(f.fileno(), response.size)
+            total = response.copy_to(f, get_chunk_size(config), progress_callback)
+    except Exception:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    os.replace(part_path, local_path)
+    return total
+
+# Exécuter plusieurs commandes sur une même connexion persistante (pipelining)
+#
+# Générateur de couples (commande, réponse), dans l'ordre des commandes. Jusqu'à
+# "pipeline_window" requêtes sont envoyées d'avance, si bien que le pair enchaîne
+# les réponses sans attendre un aller-retour par commande. Chaque réponse doit être
+# lue entièrement puis fermée avant de passer à la suivante. Avec un pair qui ne
+# garde pas les connexions ouvertes, les commandes sont envoyées une par une.
+# Comme avec send_command, les corps reçus sont comptés et soumis à la limitation du
+# débit de réception.
+def pipeline(host, port, commands, config, timeout=None):
+    commands = list(commands)
+    ip = resolve_host(host)
+    peer = (ip, int(port))
+    _download_shaper.configure(config, "download")
+    window = max(1, int(config.get("pipeline_window", DEFAULT_PIPELINE_WINDOW)))
+    done = 0
+    if commands and peer not in _legacy_peers and config.get("keepalive", True):
+        # La première réponse indique si le pair garde la connexion ouverte
+        response = send_command(host, port, commands[0], config, timeout)
+        keepalive = response.release is not None
+        yield commands[0], response
+        done = 1
+        sock = _pool.acquire(peer) if keepalive else None
+        if sock is not None:
+            sock.settimeout(timeout)
+            done = yield from _pipeline_on(sock, peer, commands, done, window, _receive_hook(ip))
+    for command in commands[done:]:
+        yield command, send_command(host, port, command, config, timeout)
+
+# Envoyer les commandes restantes sur sock ; renvoie le nombre de commandes traitées
+def _pipeline_on(sock, peer, commands, done, window, on_data=None):
+    sent = done
+    try:
+        while done < len(commands):
+            while sent < len(commands) and sent - done < window:
+                sock.sendall(pack_request(commands[sent]))
+                sent += 1
+            version, status, size, meta = read_response(sock)
+            response = Response(sock, status, size, meta, version=version, release=lambda s: None,
+                                on_data=on_data)
+            yield commands[done], response
+            done += 1
+            if not response.complete:
+                raise ProtocolError("Réponse non lue entièrement")
+    except (OSError, ProtocolError):
+        # Connexion perdue : les commandes sans réponse seront renvoyées une par une
+        sock.close()
+        return done
+    except GeneratorExit:
+        sock.close()
+        raise
+    _pool.release(peer, sock)
+    return done
+
+# Télécharger plusieurs fichiers d'un pair sur une seule connexion (pipelining)
+#
+# Renvoie une liste de (nom, octets reçus, erreur) ; une erreur sur un fichier
+# n'interrompt pas les suivants.
+def fetch_files(host, port, filenames, dest_dir, config, progress_callback=None):
+    results = []
+    valid = []
+    for filename in filenames:
+        local_path = resolve_shared_path(dest_dir, filename)
+        if local_path is None:
+            results.append((filename, 0, f"Nom de fichier invalide: {filename}"))
+        else:
+            valid.append((filename, local_path))
+    paths = dict(valid)
+    commands = [f"GET_FILE {filename}" for filename, _ in valid]
+    for command, response in pipeline(host, port, commands, config):
+        filename = command[len("GET_FILE "):]
+        try:
+            total = _save_response(response, paths[filename], config, progress_callback)
+            results.append((filename, total, None))
+        except (OSError, ProtocolError) as e:
+            results.append((filename, 0, str(e)))
+        finally:
+            response.close()
+    return results
+
+# Interroger un pair sur un fichier (taille, date) sans transférer de données
+def stat_remote_file(host, port, filename, config, timeout=5):
+    response = send_command(host, port, f"GET_RANGE {filename} 0 0", config, timeout)
+    try:
+        if not response.ok:
+            raise ProtocolError(response.error)
+        if response.size is None:
+            raise ProtocolError("Le pair ne supporte pas GET_RANGE")
+        return response.meta
+    finally:
+        response.close()
+
+# SHA-256 d'un fichier distant (None si le pair ne sait pas le calculer)
+def fetch_checksum(host, port, filename, config, timeout=None):
+    response = send_command(host, port, f"CHECKSUM {filename}", config, timeout)
+    try:
+        if not response.ok or response.size is None:
+            return None
+        return response.meta.get("sha256")
+    finally:
+        response.close()
+
+# Mesures d'un pair (commande STATS) : dictionnaire JSON, ou texte au format Prometheus
+# si prometheus est vrai ; None si le pair ne connaît pas la commande
+def fetch_stats(host, port, config, prometheus=False, timeout=5):
+    response = send_command(host, port, "STATS prometheus" if prometheus else "STATS", config, timeout)
+    try:
+        if not response.ok or response.size is None:
+            return None
+        body = response.read_body()
+        return body.decode() if prometheus else json.loads(body)
+    finally:
+        response.close()
+
+# Répartition du débit d'envoi d'un pair (commande BANDWIDTH), None s'il ne la connaît pas
+def fetch_bandwidth(host, port, config, timeout=5):
+    response = send_command(host, port, "BANDWIDTH", config, timeout)
+    try:
+        if not response.ok or response.size is None:
+            return None
+        return json.loads(response.read_body())
+    finally:
+        response.close()
+
+# Télécharger la plage [offset, offset + length) d'un fichier et l'écrire en place dans fd
+def fetch_range(host, port, filename, offset, length, fd, config, progress_callback=None):
+    response = send_command(host, port, f"GET_RANGE {filename} {offset} {length}", config,
+                            flags=accept_flags(config))
+    try:
+        if not response.ok:
+            raise ProtocolError(response.error)
+        if response.size is None:
+            raise ProtocolError("Le pair ne supporte pas GET_RANGE")
+        if response.size != length:
+            raise ProtocolError(f"Plage incomplète: {response.size}/{length} octets disponibles")
+        return response.write_at(fd, offset, get_chunk_size(config), progress_callback)
+    finally:
+        response.close()
+
+# Manifeste d'un fichier distant (empreintes de ses blocs), ou None si le pair ne le
+# fournit pas ; la racine de Merkle annoncée est vérifiée contre les empreintes reçues
+def fetch_manifest(host, port, filename, config, timeout=None):
+    response = send_command(host, port, f"MANIFEST {filename}", config, timeout)
+    try:
+        if not response.ok or response.size is None:
+            return None
+        meta = response.meta
+        body = response.read_body(get_chunk_size(config))
+    finally:
+        response.close()
+    try:
+        manifest = Manifest.unpack(meta["size"], meta["chunk_size"], body)
+    except (KeyError, ValueError) as e:
+        raise ProtocolError(f"Manifeste invalide: {e}")
+    if manifest.root != meta.get("root"):
+        raise ProtocolError("Racine de Merkle du manifeste invalide")
+    return manifest, meta
+
+# Télécharger un bloc par son empreinte et l'écrire en place dans fd après vérification
+def fetch_chunk(host, port, digest, offset, length, fd, config, timeout=None):
+    response = send_command(host, port, f"GET_CHUNK {digest.hex()}", config, timeout)
+    try:
+        if not response.ok:
+            raise ProtocolError(response.error)
+        if response.size != length:
+            raise ProtocolError(f"Bloc de taille inattendue: {response.size}/{length} octets")
+        data = response.read_body(get_chunk_size(config))
+    finally:
+        response.close()
+    if hashlib.sha256(data).digest() != digest:
+        raise ProtocolError(f"Bloc corrompu: {digest.hex()}")
+    pwrite(fd, data, offset)
+    return length
+
+# Mettre à jour la copie locale d'un fichier par synchronisation différentielle (DELTA)
+#
+# Seuls la signature de la copie locale et le delta renvoyé par le pair transitent sur
+# le réseau. Renvoie les statistiques du transfert ({"size", "sent", "received",
+# "literal", "copied"}) ou None s'il n'y a pas de copie locale, si sa signature
+# dépasserait MAX_SIGNATURE_SIZE ou si le pair ne supporte pas DELTA : l'appelant
+# télécharge alors le fichier en entier.
+def sync_file(host, port, filename, dest_dir, config, progress_callback=None):
+    local_path = resolve_shared_path(dest_dir, filename)
+    if local_path is None:
+        raise ProtocolError(f"Nom de fichier invalide: {filename}")
+    if not os.path.isfile(local_path):
+        return None
+    block_size = get_delta_block_size(config)
+    old_size = os.path.getsize(local_path)
+    if signature_size(old_size, block_size) > MAX_SIGNATURE_SIZE:
+        return None
+    signature = file_signature(local_path, block_size)
+    command = f"DELTA {filename} {old_size} {block_size}"
+    response = send_command(host, port, command, config, body=signature)
+    try:
+        if response.status == STATUS_NOT_FOUND:
+            raise ProtocolError(response.error)
+        if not response.ok or response.size is None:
+            return None
+        stats = {"size": response.meta["size"], "sent": len(pack_request(command)) + len(signature),
+                 "received": response.size, "literal": 0, "copied": 0}
+        part_path = local_path + PART_SUFFIX
+        try:
+            with open(local_path, "rb") as old, open(part_path, "wb") as f:
+                checksum = _apply_delta(response.sock, response.size, old, old_size, block_size, f,
+                                        get_chunk_size(config), stats, progress_callback, response.on_data)
+            response.complete = True
+            if os.path.getsize(part_path) != stats["size"]:
+                raise ProtocolError("Taille du fichier reconstruit invalide")
+            if response.meta.get("sha256") and checksum != response.meta["sha256"]:
+                raise ProtocolError("Somme de contrôle SHA-256 invalide")
+        except Exception:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        os.replace(part_path, local_path)
+        return stats
+    finally:
+        response.close()
+
+# Reconstruire le fichier dans f à partir de la copie locale old et du delta reçu
+# (size octets) ; renvoie le SHA-256 du résultat
+def _apply_delta(sock, size, old, old_size, block_size, f, chunk_size, stats, progress_callback, on_data=None):
+    checksum = hashlib.sha256()
+    remaining = size
+    written = 0
+    while remaining > 0:
+        op = recv_exact(sock, 1)
+        if op[0] == OP_COPY:
+            _, first, count = COPY_OP.unpack(op + recv_exact(sock, COPY_OP.size - 1))
+            remaining -= COPY_OP.size
+            start = first * block_size
+            end = min(old_size, (first + count) * block_size)
+            if start >= end:
+                raise ProtocolError("Référence de bloc invalide dans le delta")
+            old.seek(start)
+            length = end - start
+            while length > 0:
+                data = old.read(min(chunk_size, length))
+                if not data:
+                    raise ProtocolError("Copie locale modifiée pendant la synchronisation")
+                f.write(data)
+                checksum.update(data)
+                length -= len(data)
+            stats["copied"] += end - start
+            written += end - start
+        else:
+            _, length = LITERAL_OP.unpack(op + recv_exact(sock, LITERAL_OP.size - 1))
+            remaining -= LITERAL_OP.size + length
+            if remaining < 0:
+                raise ProtocolError("Delta invalide")
+            while length > 0:
+                data = sock.recv(min(chunk_size, length))
+                if not data:
+                    raise ProtocolError("Transfert incomplet")
+                f.write(data)
+                checksum.update(data)
+                length -= len(data)
+                stats["literal"] += len(data)
+                written += len(data)
+                if on_data:
+                    on_data(len(data))
+        if progress_callback:
+            progress_callback(written, stats["size"])
+    return checksum.hexdigest()
+
+# Télécharger en un seul flux (GET_MANY) une liste de noms, de motifs glob ou de
+# dossiers, dépaquetés dans dest_dir au fur et à mesure de la réception
+#
+# Renvoie une liste de (nom, octets reçus, erreur) comme fetch_files ; None si le pair
+# ne supporte pas GET_MANY (l'appelant peut alors utiliser fetch_files).
+# progress_callback(octets_reçus, taille_totale) porte sur l'ensemble du flux.
+def fetch_many(host, port, names, dest_dir, config, progress_callback=None, archive=False):
+    body = "\n".join(names).encode()
+    archive_format = FORMAT_TAR if archive else FORMAT_FRAMES
+    response = send_command(host, port, f"GET_MANY {len(body)} {archive_format}", config, body=body)
+    try:
+        if not response.ok or response.size is None:
+            if response.status == STATUS_NOT_FOUND:
+                raise ProtocolError(response.error)
+            return None
+        chunk_size = get_chunk_size(config)
+        reader = BodyReader(response.sock, response.size, response.pending, progress_callback,
+                            on_data=response.on_data)
+        if archive:
+            received = unpack_tar(reader, dest_dir, chunk_size)
+        else:
+            received = unpack_frames(reader, dest_dir, chunk_size)
+        response.complete = True
+    finally:
+        response.close()
+    results = [(name, size, None) for name, size in received]
+    results += [(name, 0, "File not found") for name in response.meta.get("missing", [])]
+    return results
@@ -0,0 +1,156 @@
+import lzma
+import os
+import queue
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compression à la volée des transferts, négociée par requête
+#
+# Le client indique les algorithmes qu'il accepte dans l'octet "flags" de la requête
+# binaire ; le serveur choisit le premier de sa liste de préférence accepté par le
+# client, sauf si le fichier semble déjà compressé (extension, ou échantillon qui ne
+# se compresse pas). Un corps compressé est découpé en trames (longueur sur 4 octets
+# puis données) terminées par une trame vide ; l'en-tête de réponse garde la taille
+# décompressée et les métadonnées précisent l'algorithme ("encoding").
+ENCODING_ZLIB = 0x01
+ENCODING_LZMA = 0x02
+ENCODING_ZSTD = 0x04
+ENCODING_MASK = ENCODING_ZLIB | ENCODING_LZMA | ENCODING_ZSTD
+
+ENCODINGS = {"zlib": ENCODING_ZLIB, "lzma": ENCODING_LZMA, "zstd": ENCODING_ZSTD}
+DEFAULT_LEVELS = {"zlib": 3, "lzma": 1, "zstd": 3}
+# lzma compresse plus mais bien plus lentement : utilisé seulement si configuré
+DEFAULT_SERVER_ENCODINGS = ["zstd", "zlib"]
+DEFAULT_CLIENT_ENCODINGS = ["zstd", "zlib", "lzma"]
+
+FRAME_HEADER = struct.Struct("!I")
+# En dessous de cette taille, la compression ne vaut pas son coût
+MIN_COMPRESS_SIZE = 4096
+SAMPLE_SIZE = 64 * 1024
+# Rapport taille compressée / taille d'origine au-delà duquel on ne compresse pas
+MAX_SAMPLE_RATIO = 0.9
+# Trames compressées d'avance par le thread de compression
+PIPELINE_DEPTH = 4
+
+COMPRESSED_EXTENSIONS = {
+    ".7z", ".apk", ".avi", ".br", ".bz2", ".docx", ".flac", ".gif", ".gz", ".heic", ".jar",
+    ".jpeg", ".jpg", ".lz4", ".lzma", ".m4a", ".mkv", ".mov", ".mp3", ".mp4", ".odt", ".ogg",
+    ".png", ".pptx", ".rar", ".tgz", ".webm", ".webp", ".whl", ".xlsx", ".xz", ".zip", ".zst",
+}
+
+def available_encodings():
+    return [name for name in ENCODINGS if name != "zstd" or zstandard is not None]
+
+# Liste configurée (clé "compression") restreinte aux algorithmes disponibles ;
+# "compression": false désactive la compression
+def configured_encodings(config, default):
+    names = config.get("compression", default)
+    if names is True:
+        names = default
+    if not names:
+        return []
+    return [name for name in names if name in available_encodings()]
+
+# Octet flags d'une requête : algorithmes acceptés par le client
+def accept_flags(config):
+    flags = 0
+    for name in configured_encodings(config, DEFAULT_CLIENT_ENCODINGS):
+        flags |= ENCODINGS[name]
+    return flags
+
+def get_level(config, name):
+    levels = config.get("compression_levels", {})
+    return int(levels.get(name, DEFAULT_LEVELS[name]))
+
+def make_compressor(name, level):
+    if name == "zlib":
+        return zlib.compressobj(level)
+    if name == "lzma":
+        return lzma.LZMACompressor(preset=level)
+    return zstandard.ZstdCompressor(level=level).compressobj()
+
+def make_decompressor(name):
+    if name == "zlib":
+        return zlib.decompressobj()
+    if name == "lzma":
+        return lzma.LZMADecompressor()
+    if name == "zstd" and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Compression non supportée: {name}")
+
+# Le contenu semble-t-il déjà compressé ? (extension, puis essai sur un échantillon)
+def looks_compressed(filename, f, offset, count):
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    f.seek(offset)
+    sample = f.read(min(SAMPLE_SIZE, count))
+    if not sample:
+        return True
+    return len(zlib.compress(sample, 1)) > len(sample) * MAX_SAMPLE_RATIO
+
+# Algorithme à utiliser pour envoyer [offset, offset + count) de f, ou None
+def choose_encoding(flags, config, filename, f, offset, count):
+    if not flags & ENCODING_MASK or count < MIN_COMPRESS_SIZE:
+        return None
+    for name in configured_encodings(config, DEFAULT_SERVER_ENCODINGS):
+        if flags & ENCODINGS[name]:
+            return None if looks_compressed(filename, f, offset, count) else name
+    return None
+
+# Trames compressées de [offset, offset + count) de f, trame vide finale comprise
+#
+# La lecture et la compression se font dans un thread dédié (zlib, lzma et zstd
+# relâchent le GIL) qui prépare jusqu'à PIPELINE_DEPTH trames d'avance : la
+# compression d'un bloc se fait pendant l'envoi du précédent.
+def compressed_frames(f, offset, count, name, level, chunk_size):
+    frames = queue.Queue(maxsize=PIPELINE_DEPTH)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            compressor = make_compressor(name, level)
+            remaining = count
+            f.seek(offset)
+            while remaining > 0:
+                data = f.read(min(chunk_size, remaining))
+                if not data:
+                    raise OSError("Fichier tronqué pendant la compression")
+                remaining -= len(data)
+                compressed = compressor.compress(data)
+                if compressed:
+                    put(FRAME_HEADER.pack(len(compressed)) + compressed)
+            tail = compressor.flush()
+            if tail:
+                put(FRAME_HEADER.pack(len(tail)) + tail)
+            put(FRAME_HEADER.pack(0))
+            put(None)
+        except Exception as e:
+            put(e)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        worker.join()
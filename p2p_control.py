@@ -0,0 +1,233 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from p2p_paths import data_dir, runtime_dir
+
+# Client de l'API de contrôle du démon (p2p_daemon.py)
+#
+# Ce module n'importe que la bibliothèque standard (et p2p_paths) : une commande
+# courte de la CLI (état, pairs...) démarre sans charger le serveur, l'index ni le
+# client réseau.
+#
+# Les requêtes et réponses sont des objets JSON, un par ligne, sur un socket Unix
+# local. Chaque appel ouvre sa propre connexion (quelques dizaines de microsecondes) :
+# plusieurs threads d'une interface peuvent appeler le démon en même temps sans verrou.
+# Une opération longue (liste d'un pair, recherche) renvoie ses résultats au fur et à
+# mesure ({"partial": ...}) avant la réponse finale ({"ok": true, "result": ...}).
+
+# Fichier de configuration (relatif au dossier courant, comme le dossier partagé)
+CONFIG_FILE = "config.json"
+# Socket de contrôle (dans runtime_dir) et journal du démon (dans data_dir), sauf
+# control_socket / daemon_log dans config.json
+CONTROL_SOCKET_NAME = "p2p_daemon.sock"
+DAEMON_LOG_NAME = "p2p_daemon.log"
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "p2p_daemon.py")
+# Attente maximale du démarrage d'un démon lancé par un client (s)
+DAEMON_START_TIMEOUT = 15
+DAEMON_POLL_INTERVAL = 0.02
+# Taille maximale d'un message de contrôle
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+# Priorités : la plus petite valeur passe en premier
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_HIGH: "haute", PRIORITY_NORMAL: "normale", PRIORITY_LOW: "basse"}
+
+# États d'un élément de la file de téléchargement (p2p_queue.py)
+QUEUED = "queued"
+RUNNING = "running"
+PAUSED = "paused"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+STATE_NAMES = {QUEUED: "en attente", RUNNING: "en cours", PAUSED: "en pause", DONE: "terminé",
+               FAILED: "échec", CANCELLED: "annulé"}
+
+# Charger la configuration (dossier partagé, port, etc.)
+def load_config(path=CONFIG_FILE):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def control_path(config):
+    return config.get("control_socket") or os.path.join(runtime_dir(config), CONTROL_SOCKET_NAME)
+
+def daemon_log_path(config):
+    return config.get("daemon_log") or os.path.join(data_dir(config), DAEMON_LOG_NAME)
+
+# Erreur renvoyée par le démon, ou démon injoignable
+class ControlError(Exception):
+    pass
+
+def send_message(sock, message):
+    sock.sendall(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+
+# Message suivant d'un flux de lignes JSON, ou None en fin de connexion
+def read_message(stream):
+    line = stream.readline(MAX_MESSAGE_SIZE)
+    if not line:
+        return None
+    if not line.endswith(b"\n"):
+        raise ControlError("Message de contrôle trop long")
+    return json.loads(line)
+
+# Client du démon : call() renvoie le résultat d'une opération, stream() ses résultats
+# partiels au fur et à mesure, subscribe() reçoit les événements (pairs, téléchargements)
+class DaemonClient:
+    def __init__(self, path, timeout=None):
+        self.path = path
+        self.timeout = timeout
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise ControlError(f"Démon injoignable ({self.path}): {e}")
+        return sock
+
+    def _exchange(self, op, params):
+        sock = self._connect()
+        try:
+            send_message(sock, dict(params, op=op))
+            stream = sock.makefile("rb")
+            while True:
+                message = read_message(stream)
+                if message is None:
+                    raise ControlError("Connexion au démon interrompue")
+                if "partial" in message:
+                    yield True, message["partial"]
+                    continue
+                if not message.get("ok"):
+                    raise ControlError(message.get("error") or "Erreur du démon")
+                yield False, message.get("result")
+                return
+        finally:
+            sock.close()
+
+    def call(self, op, **params):
+        result = []
+        for partial, value in self._exchange(op, params):
+            if partial:
+                result.append(value)
+            else:
+                return result if value is None and result else value
+
+    def stream(self, op, **params):
+        for partial, value in self._exchange(op, params):
+            if partial:
+                yield value
+
+    # Le démon répond-il ?
+    def ping(self):
+        try:
+            self.call("ping")
+            return True
+        except (ControlError, OSError, ValueError):
+            return False
+
+    # Détacher le client (le démon continue de tourner)
+    def close(self):
+        pass
+
+    # Recevoir les événements du démon dans un thread : callback(événement) pour
+    # chacun ; on_close() est appelé si la connexion est perdue
+    def subscribe(self, callback, on_close=None):
+        sock = self._connect()
+        sock.settimeout(None)
+        send_message(sock, {"op": "subscribe"})
+
+        def run():
+            stream = sock.makefile("rb")
+            try:
+                while True:
+                    message = read_message(stream)
+                    if message is None:
+                        break
+                    if "event" in message:
+                        callback(message)
+            except (OSError, ValueError):
+                pass
+            finally:
+                sock.close()
+                if on_close is not None:
+                    on_close()
+        threading.Thread(target=run, daemon=True).start()
+        return lambda: _shutdown(sock)
+
+def _shutdown(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+
+# Client d'un démon exécuté dans le processus même (système sans sockets Unix, ou
+# démon impossible à lancer) : mêmes opérations, sans socket
+class LocalClient:
+    def __init__(self, daemon):
+        self.daemon = daemon
+
+    def call(self, op, **params):
+        result = self.daemon.handle(op, params)
+        if hasattr(result, "__next__"):
+            return list(result) or None
+        return result
+
+    def stream(self, op, **params):
+        result = self.daemon.handle(op, params)
+        if hasattr(result, "__next__"):
+            yield from result
+
+    def ping(self):
+        return True
+
+    # Le démon du processus s'arrête avec son client
+    def close(self):
+        self.daemon.stop()
+
+    def subscribe(self, callback, on_close=None):
+        return self.daemon.subscribe(callback)
+
+# Lancer le démon en arrière-plan (indépendant du terminal et du client) et attendre
+# qu'il réponde
+def spawn_daemon(config, config_file=CONFIG_FILE):
+    client = DaemonClient(control_path(config))
+    log_path = daemon_log_path(config)
+    with open(log_path, "ab") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-u", DAEMON_SCRIPT, "--config", os.path.abspath(config_file)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    deadline = time.monotonic() + DAEMON_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if client.ping():
+            return client
+        if process.poll() is not None:
+            raise ControlError(f"Le démon s'est arrêté au démarrage (voir {log_path})")
+        time.sleep(DAEMON_POLL_INTERVAL)
+    raise ControlError(f"Le démon ne répond pas (voir {log_path})")
+
+# Client du démon de ce pair : celui qui tourne déjà, sinon un démon lancé en
+# arrière-plan (spawn), sinon un démon exécuté dans ce processus (le partage s'arrête
+# alors avec le programme)
+def attach(config, spawn=True, config_file=CONFIG_FILE):
+    if hasattr(socket, "AF_UNIX"):
+        client = DaemonClient(control_path(config))
+        if client.ping():
+            return client
+        if spawn:
+            try:
+                return spawn_daemon(config, config_file)
+            except (ControlError, OSError) as e:
+                print(f"[!] {e} ; services démarrés dans ce processus.")
+    # Import différé : charge le serveur, l'index et le client réseau
+    from p2p_daemon import PeerDaemon
+    daemon = PeerDaemon(config)
+    daemon.start()
+    return LocalClient(daemon)
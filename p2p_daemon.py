@@ -0,0 +1,364 @@
+import argparse
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+from p2p_client import fetch_stats, iter_file_list, resolve_host, search_network
+from p2p_control import (
+    CONFIG_FILE, PRIORITY_NORMAL, ControlError, DaemonClient, control_path, load_config, read_message, send_message
+)
+from p2p_discovery import DiscoveryService
+from p2p_metrics import metrics
+from p2p_multicast import MulticastReceiver, MulticastSender
+from p2p_peers import registry
+from p2p_push import push_file
+from p2p_queue import DownloadManager
+from p2p_server import create_server
+from p2p_transfer import resolve_shared_path
+
+# Nombre de noms de fichiers par message lors d'une liste transmise au fil de l'eau
+STREAM_BATCH = 500
+# Événements gardés pour un abonné lent avant de le déconnecter
+SUBSCRIBER_BACKLOG = 1000
+
+# Démon du pair : serveur, découverte, index et file des téléchargements
+#
+# Le démon tourne indépendamment des interfaces : le partage continue quand la CLI ou
+# la GUI est fermée. Celles-ci sont des clients de son API de contrôle (socket Unix,
+# un objet JSON par ligne, voir p2p_control.py). Les opérations sont des méthodes
+# op_<nom> ; une opération qui renvoie un générateur transmet chaque valeur dès
+# qu'elle est prête. Les abonnés reçoivent les changements de la liste des pairs et
+# de la file des téléchargements ; chaque abonné a sa file d'attente : un client lent
+# ne bloque jamais les workers, et il est déconnecté s'il prend trop de retard.
+class PeerDaemon:
+    def __init__(self, config):
+        self.config = config
+        self.shared_dir = config["shared_dir"]
+        self.server = None
+        self.discovery = None
+        self.downloads = None
+        self.multicast = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.control_sock = None
+        self.path = None
+        self.stopping = False
+        self.stopped = threading.Event()
+        self.started = time.time()
+
+    def start(self):
+        registry.configure(self.config)
+        os.makedirs(self.shared_dir, exist_ok=True)
+        self.server = create_server(self.config)
+        self.server.start()
+        self.discovery = DiscoveryService(self.config, self.server)
+        self.discovery.add_listener(lambda peers: self.publish({"event": "peers", "peers": peers}))
+        self.discovery.start()
+        self.downloads = DownloadManager(self.config, self.shared_dir, self.server.index)
+        self.downloads.add_listener(lambda item: self.publish({"event": "download", "item": item}))
+        self.downloads.start()
+        if self.config.get("multicast_receive"):
+            self.multicast = MulticastReceiver(self.config, self.shared_dir)
+            self.multicast.add_listener(self._multicast_received)
+            self.multicast.start()
+
+    def _multicast_received(self, state):
+        if state["done"]:
+            self.server.index.update_file(state["name"])
+        self.publish({"event": "multicast", "transfer": state})
+
+    # Ouvrir le socket de contrôle (accessible au seul propriétaire) ; un socket
+    # laissé par un démon arrêté est remplacé, pas celui d'un démon actif
+    def listen(self, path=None):
+        path = path or control_path(self.config)
+        if os.path.exists(path):
+            if DaemonClient(path, timeout=1).ping():
+                raise ControlError(f"Un démon écoute déjà sur {path}")
+            os.unlink(path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+        os.chmod(path, 0o600)
+        sock.listen()
+        self.control_sock = sock
+        self.path = path
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        print(f"[+] Démon P2P : contrôle sur {path}")
+
+    def _accept_loop(self):
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.control_sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+    # Une connexion de contrôle : requêtes successives, ou abonnement aux événements
+    def _handle_connection(self, conn):
+        stream = conn.makefile("rb")
+        try:
+            while True:
+                try:
+                    request = read_message(stream)
+                except (ControlError, ValueError) as e:
+                    send_message(conn, {"ok": False, "error": f"Requête invalide: {e}"})
+                    return
+                if request is None:
+                    return
+                op = request.pop("op", None)
+                if op == "subscribe":
+                    self._serve_subscriber(conn)
+                    return
+                self._reply(conn, op, request)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _reply(self, conn, op, params):
+        try:
+            result = self.handle(op, params)
+            if hasattr(result, "__next__"):
+                for value in result:
+                    send_message(conn, {"partial": value})
+                result = None
+        except Exception as e:
+            # Erreur rapportée au client : le démon reste disponible
+            send_message(conn, {"ok": False, "error": str(e)})
+            return
+        send_message(conn, {"ok": True, "result": result})
+
+    def _serve_subscriber(self, conn):
+        events = queue.Queue(SUBSCRIBER_BACKLOG)
+
+        def put(event):
+            try:
+                events.put_nowait(event)
+            except queue.Full:
+                # Abonné trop lent : déconnecté (l'envoi en cours échoue)
+                unsubscribe()
+                try:
+                    conn.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        unsubscribe = self.subscribe(put)
+        try:
+            while True:
+                event = events.get()
+                send_message(conn, event)
+                if event["event"] == "stopped":
+                    break
+        finally:
+            unsubscribe()
+
+    # Recevoir les événements : callback(événement) est appelé depuis le thread qui
+    # produit l'événement ; renvoie la fonction de désabonnement
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+
+        def unsubscribe():
+            with self.lock:
+                if callback in self.subscribers:
+                    self.subscribers.remove(callback)
+        return unsubscribe
+
+    def publish(self, event):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"[!] Erreur de notification d'un abonné: {e}")
+
+    def handle(self, op, params):
+        handler = getattr(self, f"op_{op}", None) if isinstance(op, str) else None
+        if handler is None:
+            raise ControlError(f"Opération inconnue: {op}")
+        return handler(**params)
+
+    # --- Opérations ---
+    def op_ping(self):
+        return "pong"
+
+    def op_status(self):
+        return {"pid": os.getpid(), "uptime": round(time.time() - self.started, 3), "port": self.server.port,
+                "shared_dir": os.path.abspath(self.shared_dir), "peers": len(self.discovery.peers()),
+                "files": len(self.server.index.names()), "downloads": len(self.downloads.snapshot()),
+                "control": self.path}
+
+    # Pairs vivants (option refresh : interroger aussi tout le groupe)
+    def op_peers(self, refresh=False):
+        if refresh:
+            self.discovery.refresh()
+        return self.discovery.peers()
+
+    def op_peer_port(self, host):
+        return self.peer_port(host)
+
+    def op_local_files(self):
+        try:
+            return os.listdir(self.shared_dir)
+        except FileNotFoundError:
+            return []
+
+    # Liste des fichiers d'un pair, par lots de noms au fil de la réception (liste
+    # déjà reçue réutilisée tant que l'empreinte de l'index du pair n'a pas changé)
+    def op_remote_files(self, host, port=None):
+        cached = self.discovery.cached_files(host)
+        if cached is not None:
+            for i in range(0, len(cached), STREAM_BATCH):
+                yield cached[i:i + STREAM_BATCH]
+            return
+        files = []
+        for entry in iter_file_list(host, port or self.peer_port(host), self.config):
+            files.append(entry["name"])
+            if len(files) % STREAM_BATCH == 0:
+                yield files[-STREAM_BATCH:]
+        if len(files) % STREAM_BATCH:
+            yield files[-(len(files) % STREAM_BATCH):]
+        self.discovery.store_files(host, files)
+
+    # Recherche chez tous les pairs vivants : (hôte, port, fichiers, erreur) par pair
+    def op_search(self, pattern):
+        peers = [(host, self.peer_port(host)) for host in self.discovery.peers()]
+        for host, port, files, error in search_network(peers, pattern, self.config):
+            yield [host, port, files, error]
+
+    # Mettre un fichier en file : les autres pairs (holders) qui l'ont peut-être et
+    # ne sont pas saturés servent de sources supplémentaires
+    def op_download(self, host, name, port=None, holders=(), priority=PRIORITY_NORMAL):
+        sources = [(host, port or self.peer_port(host))]
+        sources += [(peer, self.peer_port(peer)) for peer in holders
+                    if peer != host and self.discovery.may_serve(peer, name)]
+        return self.downloads.enqueue(sources, name, priority)
+
+    # Lot de fichiers ou motifs d'un pair (GET_MANY), ou d'un coup chez plusieurs pairs
+    def op_enqueue(self, host, names, port=None, priority=PRIORITY_NORMAL):
+        return self.downloads.enqueue([(host, port or self.peer_port(host))], names, priority)
+
+    def op_enqueue_many(self, hosts, names, priority=PRIORITY_NORMAL):
+        return self.downloads.enqueue_many([([(host, self.peer_port(host))], names) for host in hosts], priority)
+
+    def op_downloads(self):
+        return self.downloads.snapshot()
+
+    def op_pause(self, item_id):
+        return self.downloads.pause(item_id)
+
+    def op_resume(self, item_id):
+        return self.downloads.resume(item_id)
+
+    def op_cancel(self, item_id):
+        return self.downloads.cancel(item_id)
+
+    def op_set_priority(self, item_id, priority):
+        return self.downloads.set_priority(item_id, priority)
+
+    def op_clear_finished(self):
+        return self.downloads.clear_finished()
+
+    # Diffuser un fichier partagé à tous les récepteurs multicast du réseau : états
+    # successifs de la diffusion, le dernier étant le rapport final
+    def op_multicast(self, name, rate=None, receivers=0):
+        path = resolve_shared_path(self.shared_dir, name)
+        if path is None or not os.path.isfile(path):
+            raise ControlError(f"Fichier introuvable: {name}")
+        sender = MulticastSender(self.config, path, name, rate, receivers)
+        states = queue.Queue()
+
+        def run():
+            try:
+                sender.run(states.put)
+            except Exception as e:
+                states.put({"error": str(e)})
+            states.put(None)
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                state = states.get()
+                if state is None:
+                    return
+                if "error" in state and "name" not in state:
+                    raise ControlError(state["error"])
+                yield state
+        finally:
+            # Client parti : diffusion interrompue
+            sender.stop()
+
+    # Réceptions multicast en cours et récentes
+    def op_multicast_received(self):
+        return self.multicast.snapshot() if self.multicast is not None else []
+
+    # Répliquer des fichiers, motifs ou dossiers partagés vers plusieurs pairs en
+    # chaîne (fanout 1) ou en arbre : rapport de chaque fichier, dans l'ordre
+    def op_push(self, names, hosts, fanout=None):
+        files, missing = self.server.select_files(names)
+        if missing:
+            raise ControlError(f"Introuvable(s): {', '.join(missing)}")
+        targets = list(dict.fromkeys((resolve_host(host), self.peer_port(host)) for host in hosts))
+        for name in files:
+            path = resolve_shared_path(self.shared_dir, name)
+            st = os.stat(path)
+            yield push_file(targets, path, name, self.config, fanout, self.server.file_checksum(path, st, name),
+                            self.server.shaper)
+
+    # Mesures du démon (ou d'un pair distant)
+    def op_stats(self, host=None, port=None):
+        if host is None:
+            return metrics.snapshot()
+        return fetch_stats(host, port or self.peer_port(host), self.config)
+
+    def op_shutdown(self):
+        threading.Thread(target=self.stop, daemon=True).start()
+        return True
+
+    def peer_port(self, host):
+        return self.discovery.port_of(host, self.config["port"])
+
+    # Arrêter le démon : les téléchargements en cours reprendront au prochain démarrage
+    def stop(self):
+        with self.lock:
+            if self.stopping:
+                return
+            self.stopping = True
+        if self.control_sock is not None:
+            self.control_sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+        self.downloads.stop()
+        self.discovery.stop()
+        if self.multicast is not None:
+            self.multicast.stop()
+        self.publish({"event": "stopped"})
+        self.stopped.set()
+
+    def wait(self):
+        self.stopped.wait()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Démon du pair P2P (serveur, découverte, téléchargements)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="fichier de configuration")
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+    if DaemonClient(control_path(config), timeout=1).ping():
+        print(f"[!] Un démon écoute déjà sur {control_path(config)}")
+        raise SystemExit(1)
+    daemon = PeerDaemon(config)
+    daemon.start()
+    try:
+        daemon.listen()
+    except (ControlError, OSError) as e:
+        print(f"[!] {e}")
+        daemon.stop()
+        raise SystemExit(1)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: threading.Thread(target=daemon.stop, daemon=True).start())
+    daemon.wait()
+
+if __name__ == "__main__":
+    main()
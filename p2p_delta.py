@@ -0,0 +1,262 @@
+import hashlib
+import os
+import struct
+import zlib
+from p2p_protocol import ProtocolError
+from p2p_transfer import pread
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Synchronisation différentielle (algorithme de rsync)
+#
+# Le client envoie la signature de sa copie locale : pour chaque bloc de taille fixe,
+# une somme faible (Adler-32, calculable en glissant d'un octet) et une empreinte
+# forte (BLAKE2b tronquée à 16 octets). Le serveur parcourt sa version du fichier,
+# repère les blocs que le client possède déjà, à n'importe quel décalage, et renvoie
+# un delta : des références à ces blocs et les seules données littérales manquantes.
+DEFAULT_DELTA_BLOCK_SIZE = 32 * 1024
+MIN_DELTA_BLOCK_SIZE = 512
+MAX_DELTA_BLOCK_SIZE = 16 * 1024 * 1024
+STRONG_SIZE = 16
+ADLER_MOD = 65521
+
+# Signature d'un bloc : somme faible | empreinte forte
+SIGNATURE_ENTRY = struct.Struct("!I16s")
+# Taille maximale de la signature d'une requête DELTA (1,6 million de blocs : plus de
+# 50 Go avec les blocs par défaut) ; au-delà, le fichier est téléchargé en entier
+MAX_SIGNATURE_SIZE = 32 * 1024 * 1024
+
+# Opérations du delta : copie de blocs de la copie locale, ou données littérales
+OP_COPY = 0
+OP_LITERAL = 1
+COPY_OP = struct.Struct("!BII")      # OP_COPY | premier bloc | nombre de blocs
+LITERAL_OP = struct.Struct("!BQ")    # OP_LITERAL | longueur, suivi des données
+
+# Nombre maximal d'offsets dont la somme faible est calculée d'un coup (recherche vectorisée)
+SEARCH_WINDOW = 1024 * 1024
+# Taille des lectures du fichier servi (FileView)
+READ_WINDOW = 4 * 1024 * 1024
+
+def get_delta_block_size(config):
+    return int(config.get("delta_block_size", DEFAULT_DELTA_BLOCK_SIZE))
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+# Nombre de blocs d'un fichier de taille size
+def block_count(size, block_size):
+    return (size + block_size - 1) // block_size
+
+# Taille de la signature d'un fichier de taille size
+def signature_size(size, block_size):
+    return block_count(size, block_size) * SIGNATURE_ENTRY.size
+
+# Signature d'un fichier local (une entrée SIGNATURE_ENTRY par bloc)
+def file_signature(path, block_size):
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            parts.append(SIGNATURE_ENTRY.pack(zlib.adler32(block), strong_hash(block)))
+    return b"".join(parts)
+
+# Fichier servi vu comme un objet indexable en lecture seule (longueur, tranches et
+# octets, comme bytes), lu par fenêtres de READ_WINDOW octets (pread). Le fichier
+# n'est pas projeté en mémoire : s'il est tronqué pendant le calcul du delta, la
+# lecture courte lève ProtocolError au lieu d'arrêter le serveur (SIGBUS).
+class FileView:
+    def __init__(self, f):
+        self.fd = f.fileno()
+        self.size = os.fstat(self.fd).st_size
+        self.start = 0
+        self.window = b""
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(self.size)
+            stop = max(start, stop)
+        else:
+            start = key + self.size if key < 0 else key
+            if not 0 <= start < self.size:
+                raise IndexError("Position hors du fichier")
+            stop = start + 1
+        if start < self.start or stop > self.start + len(self.window):
+            self._fill(start, stop - start)
+        offset = start - self.start
+        if isinstance(key, slice):
+            return self.window[offset:offset + stop - start]
+        return self.window[offset]
+
+    def _fill(self, start, length):
+        length = min(max(length, READ_WINDOW), self.size - start)
+        data = pread(self.fd, length, start)
+        if len(data) != length:
+            raise ProtocolError("Fichier modifié pendant l'envoi")
+        self.start = start
+        self.window = data
+
+# Table des blocs connus du client, construite à partir de sa signature
+#
+# Seuls les blocs complets peuvent être retrouvés à un décalage quelconque ; le
+# dernier bloc, plus court, n'est comparé qu'à la fin du fichier.
+class SignatureTable:
+    def __init__(self, signature, block_size, old_size):
+        if len(signature) != block_count(old_size, block_size) * SIGNATURE_ENTRY.size:
+            raise ValueError("Signature incohérente avec la taille du fichier")
+        self.block_size = block_size
+        self.weak = {}
+        self.tail = None
+        entries = list(SIGNATURE_ENTRY.iter_unpack(signature))
+        tail_length = old_size % block_size
+        if tail_length:
+            self.tail = (len(entries) - 1, tail_length) + entries.pop()
+        for i, (weak, strong) in enumerate(entries):
+            self.weak.setdefault(weak, {}).setdefault(strong, i)
+        self.weak_array = numpy.array(sorted(self.weak), dtype=numpy.int64) if numpy is not None else None
+
+    # Numéro du bloc identique à data (de somme faible weak), ou None
+    def match(self, weak, data):
+        strongs = self.weak.get(weak)
+        if strongs is None:
+            return None
+        return strongs.get(strong_hash(data))
+
+    def match_tail(self, data):
+        if self.tail is None:
+            return None
+        index, length, weak, strong = self.tail
+        if len(data) == length and zlib.adler32(data) == weak and strong_hash(data) == strong:
+            return index
+        return None
+
+# Premier offset >= start où commence un bloc connu : (offset, numéro du bloc) ou None
+#
+# Avec numpy, les sommes faibles de SEARCH_WINDOW offsets consécutifs sont calculées
+# ensemble par sommes cumulées ; sinon la somme glisse octet par octet en Python.
+def find_next_match(data, start, table):
+    if numpy is not None:
+        return _find_next_match_vectorized(data, start, table)
+    return _find_next_match_rolling(data, start, table)
+
+def _find_next_match_rolling(data, start, table):
+    n = table.block_size
+    last = len(data) - n
+    if start > last:
+        return None
+    weak = zlib.adler32(data[start:start + n])
+    a, b = weak & 0xFFFF, weak >> 16
+    known = table.weak
+    q = start
+    while True:
+        if weak in known:
+            index = table.match(weak, data[q:q + n])
+            if index is not None:
+                return q, index
+        if q >= last:
+            return None
+        out, inn = data[q], data[q + n]
+        a = (a - out + inn) % ADLER_MOD
+        b = (b - n * out + a - 1) % ADLER_MOD
+        weak = (b << 16) | a
+        q += 1
+
+def _find_next_match_vectorized(data, start, table):
+    n = table.block_size
+    last = len(data) - n
+    if not table.weak:
+        return None
+    # Fenêtre d'abord courte (le bloc suivant est souvent proche), puis élargie
+    window_size = 2 * n
+    while start <= last:
+        count = min(window_size, last - start + 1)
+        window_size = min(SEARCH_WINDOW, window_size * 4)
+        x = numpy.frombuffer(data[start:start + count + n - 1], dtype=numpy.uint8).astype(numpy.int64)
+        sums = numpy.concatenate(([0], numpy.cumsum(x)))
+        weighted = numpy.concatenate(([0], numpy.cumsum(x * numpy.arange(len(x), dtype=numpy.int64))))
+        k = numpy.arange(count, dtype=numpy.int64)
+        window = sums[k + n] - sums[k]
+        a = (1 + window) % ADLER_MOD
+        # somme des (n - j) * x[k + j] pour j dans [0, n)
+        b = (n + (n + k) * window - (weighted[k + n] - weighted[k])) % ADLER_MOD
+        weak = (b << 16) | a
+        for offset in numpy.nonzero(numpy.isin(weak, table.weak_array))[0]:
+            q = start + int(offset)
+            index = table.match(int(weak[offset]), data[q:q + n])
+            if index is not None:
+                return q, index
+        start += count
+    return None
+
+# Calculer le delta de data (nouvelle version) par rapport à la signature du client
+#
+# Renvoie la liste des opérations : (OP_COPY, premier bloc, nombre de blocs) ou
+# (OP_LITERAL, offset dans data, longueur). Le cas courant d'une modification sur
+# place est traité sans recherche glissante : après un bloc différent, le bloc
+# suivant est d'abord comparé à sa position attendue.
+def compute_delta(data, table):
+    ops = []
+    n = table.block_size
+    size = len(data)
+
+    def copy(index):
+        if ops and ops[-1][0] == OP_COPY and ops[-1][1] + ops[-1][2] == index:
+            ops[-1] = (OP_COPY, ops[-1][1], ops[-1][2] + 1)
+        else:
+            ops.append((OP_COPY, index, 1))
+
+    def literal(start, end):
+        if end <= start:
+            return
+        if ops and ops[-1][0] == OP_LITERAL and ops[-1][1] + ops[-1][2] == start:
+            ops[-1] = (OP_LITERAL, ops[-1][1], end - ops[-1][1])
+        else:
+            ops.append((OP_LITERAL, start, end - start))
+
+    pos = 0
+    while pos + n <= size:
+        block = data[pos:pos + n]
+        index = table.match(zlib.adler32(block), block)
+        if index is not None:
+            copy(index)
+            pos += n
+            continue
+        following = data[pos + n:pos + 2 * n]
+        if len(following) == n and table.match(zlib.adler32(following), following) is not None:
+            literal(pos, pos + n)
+            pos += n
+            continue
+        found = find_next_match(data, pos + 1, table)
+        if found is None:
+            break
+        literal(pos, found[0])
+        copy(found[1])
+        pos = found[0] + n
+    # Dernier bloc (plus court) de la copie locale, comparé à la fin du fichier
+    tail_length = table.tail[1] if table.tail else 0
+    if tail_length and size - pos >= tail_length and table.match_tail(data[size - tail_length:size]) is not None:
+        literal(pos, size - tail_length)
+        copy(table.tail[0])
+    else:
+        literal(pos, size)
+    return ops
+
+# Taille du delta encodé (en-têtes des opérations et données littérales)
+def delta_size(ops):
+    total = 0
+    for op in ops:
+        if op[0] == OP_COPY:
+            total += COPY_OP.size
+        else:
+            total += LITERAL_OP.size + op[2]
+    return total
+
+def literal_bytes(ops):
+    return sum(op[2] for op in ops if op[0] == OP_LITERAL)
@@ -0,0 +1,280 @@
+import base64
+import select
+import socket
+import struct
+import threading
+import time
+from p2p_bloom import BloomFilter
+from p2p_peers import registry
+from p2p_protocol import PROTOCOL_VERSION
+
+MULTICAST_GROUP = '224.1.1.1'
+MULTICAST_PORT = 9999
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_DISCOVERY_INTERVAL = 2
+DEFAULT_DISCOVERY_MISSES = 3
+
+# Messages multicast :
+# - "DISCOVER_P2P" : requête d'un pair (ancien ou nouveau), réponse "<nom>|<ip>" ;
+# - "ANNOUNCE_P2P|<nom>|<ip>|<port>|<version>|<charge>|<places>|<empreinte>|<bloom>" :
+#   battement de cœur envoyé périodiquement au groupe, avec le port d'écoute, la
+#   version du protocole, les requêtes en cours, les transferts encore possibles,
+#   l'empreinte de l'index partagé et le filtre de Bloom de ses noms (base64) ;
+#   les champs après l'IP sont facultatifs ;
+# - "BYE_P2P|<nom>|<ip>" : départ d'un pair.
+DISCOVER = "DISCOVER_P2P"
+ANNOUNCE = "ANNOUNCE_P2P"
+BYE = "BYE_P2P"
+MAX_MESSAGE_SIZE = 4096
+
+# Obtenir l'adresse IP locale de la machine
+def get_local_ip():
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('10.255.255.255', 1))
+        IP = s.getsockname()[0]
+    except Exception:
+        IP = '127.0.0.1'
+    finally:
+        s.close()
+    return IP
+
+# Informations annoncées par un pair (None pour un champ inconnu : ancien pair)
+class PeerInfo:
+    def __init__(self, ip, port=None, version=None, load=None, slots=None, digest=None, bloom=None):
+        self.ip = ip
+        self.port = port
+        self.version = version
+        self.load = load
+        self.slots = slots
+        self.digest = digest
+        self.bloom = bloom
+
+    @classmethod
+    def parse(cls, fields):
+        ip, extra = fields[0], fields[1:]
+        try:
+            port, version, load, slots = (int(v) for v in extra[:4])
+        except ValueError:
+            return cls(ip)
+        digest = extra[4] if len(extra) > 4 and extra[4] else None
+        bloom = None
+        if len(extra) > 5 and extra[5]:
+            try:
+                bloom = BloomFilter.from_bytes(base64.b64decode(extra[5]))
+            except ValueError:
+                pass
+        return cls(ip, port, version, load, slots, digest, bloom)
+
+    # Le pair partage-t-il peut-être ce fichier ? (True si on ne le sait pas)
+    def may_have(self, filename):
+        return self.bloom is None or filename in self.bloom
+
+    # Le pair peut-il encore accepter un transfert ? (True si on ne le sait pas)
+    def has_slots(self):
+        return self.slots is None or self.slots > 0
+
+# Service de découverte en arrière-plan
+#
+# Le thread répond aux requêtes DISCOVER_P2P (comme l'ancien MulticastResponder),
+# annonce ce pair au groupe toutes les discovery_interval secondes et tient à jour
+# l'ensemble des pairs vivants à partir des annonces reçues. Les anciens pairs, qui
+# n'annoncent rien, sont interrogés par une requête DISCOVER_P2P avant d'expirer.
+# Un pair est retiré après discovery_misses battements manqués (ou à son départ).
+# peers() renvoie instantanément l'état courant ; les fonctions ajoutées par
+# add_listener sont appelées (depuis le thread du service) à chaque changement.
+# server (facultatif) est le serveur local, dont l'annonce décrit la charge et l'index.
+class DiscoveryService(threading.Thread):
+    def __init__(self, config, server=None):
+        super().__init__(daemon=True)
+        self.interval = float(config.get("discovery_interval", DEFAULT_DISCOVERY_INTERVAL))
+        self.misses = int(config.get("discovery_misses", DEFAULT_DISCOVERY_MISSES))
+        self.server = server
+        # Port du groupe multicast et nom annoncé (un autre port isole un groupe de
+        # pairs, par exemple pour les benchmarks)
+        self.group_port = int(config.get("discovery_port", MULTICAST_PORT))
+        self.hostname = config.get("peer_name") or socket.gethostname()
+        self.ip = get_local_ip()
+        self.alive = {}
+        self.info = {}
+        # Listes de fichiers déjà reçues : pair -> (empreinte de l'index, liste)
+        self.listings = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.query_sent = None
+        self.listen_sock = self._listen_socket()
+        self.send_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.send_sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, struct.pack('b', 1))
+
+    def _listen_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind((MULTICAST_GROUP, self.group_port))
+        except OSError:
+            sock.bind(('', self.group_port))
+        mreq = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton('0.0.0.0')
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        return sock
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    # Noms des pairs vivants (instantané, sans attente réseau)
+    def peers(self):
+        with self.lock:
+            return sorted(self.alive)
+
+    # Informations annoncées par un pair vivant, ou None
+    def peer_info(self, hostname):
+        with self.lock:
+            return self.info.get(hostname) if hostname in self.alive else None
+
+    # Port d'écoute annoncé par le pair (default pour un ancien pair)
+    def port_of(self, hostname, default):
+        info = self.peer_info(hostname)
+        return info.port if info is not None and info.port else default
+
+    # Le pair peut-il servir ce fichier ? (d'après son filtre de Bloom et sa charge)
+    def may_serve(self, hostname, filename):
+        info = self.peer_info(hostname)
+        return info is None or (info.may_have(filename) and info.has_slots())
+
+    # Liste des fichiers d'un pair : redemandée (fetch()) seulement si l'empreinte de
+    # son index a changé depuis la dernière fois
+    def remote_files(self, hostname, fetch):
+        files = self.cached_files(hostname)
+        if files is None:
+            files = fetch()
+            self.store_files(hostname, files)
+        return files
+
+    # Liste déjà reçue d'un pair si son index n'a pas changé depuis, sinon None
+    def cached_files(self, hostname):
+        info = self.peer_info(hostname)
+        cached = self.listings.get(hostname)
+        if info is not None and info.digest is not None and cached is not None and cached[0] == info.digest:
+            return cached[1]
+        return None
+
+    def store_files(self, hostname, files):
+        info = self.peer_info(hostname)
+        if info is not None and info.digest is not None and files:
+            self.listings[hostname] = (info.digest, files)
+
+    # Annonce de ce pair (état courant du serveur local)
+    def announcement(self):
+        fields = [ANNOUNCE, self.hostname, self.ip]
+        if self.server is not None:
+            load, slots = self.server.load()
+            bloom = base64.b64encode(self.server.index.bloom()).decode()
+            fields += [self.server.port, PROTOCOL_VERSION, load, slots, self.server.index.digest(), bloom]
+        return "|".join(str(field) for field in fields)
+
+    # Interroger tout le groupe (réponse des anciens pairs comprise) sans attendre
+    def refresh(self):
+        self._send(DISCOVER)
+        self.query_sent = time.perf_counter()
+
+    def _send(self, message):
+        try:
+            self.send_sock.sendto(message.encode(), (MULTICAST_GROUP, self.group_port))
+        except OSError as e:
+            print(f"[!] Envoi multicast impossible: {e}")
+
+    def _beat(self, hostname, info, rtt=None):
+        registry.seen(hostname, info.ip, rtt)
+        with self.lock:
+            added = hostname not in self.alive
+            self.alive[hostname] = time.monotonic()
+            # Une réponse à DISCOVER_P2P ne contient que l'IP : garder les détails connus
+            known = self.info.get(hostname)
+            if info.port is not None or known is None or known.ip != info.ip:
+                self.info[hostname] = info
+        if added:
+            self._notify()
+
+    def _remove(self, hostnames):
+        with self.lock:
+            removed = [h for h in hostnames if self.alive.pop(h, None) is not None]
+            for h in removed:
+                self.info.pop(h, None)
+                self.listings.pop(h, None)
+        if removed:
+            self._notify()
+
+    def _notify(self):
+        peers = self.peers()
+        for callback in self.listeners:
+            try:
+                callback(peers)
+            except Exception as e:
+                print(f"[!] Erreur de notification de découverte: {e}")
+
+    def _expire(self):
+        limit = time.monotonic() - self.interval * self.misses
+        with self.lock:
+            dead = [h for h, last in self.alive.items() if last < limit]
+        self._remove(dead)
+
+    def _handle_group(self):
+        data, addr = self.listen_sock.recvfrom(MAX_MESSAGE_SIZE)
+        message = data.decode(errors="ignore")
+        if message == DISCOVER:
+            # Réponse au format historique, au seul demandeur : l'annonce détaillée
+            # (port, charge, index) lui parvient avec le battement suivant, sans
+            # multiplier les envois au groupe à chaque requête
+            self.listen_sock.sendto(f"{self.hostname}|{self.ip}".encode(), addr)
+            return
+        fields = message.split("|")
+        if len(fields) < 3 or not fields[1] or not fields[2]:
+            return
+        if fields[0] == ANNOUNCE:
+            self._beat(fields[1], PeerInfo.parse(fields[2:]))
+        elif fields[0] == BYE:
+            self._remove([fields[1]])
+
+    def _handle_reply(self):
+        data, _ = self.send_sock.recvfrom(MAX_MESSAGE_SIZE)
+        try:
+            hostname, ip = data.decode().split("|")
+        except ValueError:
+            return
+        rtt = time.perf_counter() - self.query_sent if self.query_sent else None
+        self._beat(hostname, PeerInfo(ip), rtt)
+
+    def run(self):
+        self.running.set()
+        self.refresh()
+        ticks = 0
+        next_tick = time.monotonic()
+        while self.running.is_set():
+            now = time.monotonic()
+            if now >= next_tick:
+                self._send(self.announcement())
+                ticks += 1
+                # Les anciens pairs n'annoncent rien : les interroger avant qu'ils n'expirent
+                if ticks % max(1, self.misses - 1) == 0:
+                    self.refresh()
+                self._expire()
+                next_tick = now + self.interval
+            try:
+                readable, _, _ = select.select([self.listen_sock, self.send_sock], [], [],
+                                               max(0.0, next_tick - time.monotonic()))
+                if self.listen_sock in readable:
+                    self._handle_group()
+                if self.send_sock in readable:
+                    self._handle_reply()
+            except (OSError, ValueError):
+                if self.running.is_set():
+                    time.sleep(self.interval)
+
+    def stop(self):
+        if not self.running.is_set():
+            return
+        self.running.clear()
+        self._send(f"{BYE}|{self.hostname}|{self.ip}")
+        self.listen_sock.close()
+        self.send_sock.close()
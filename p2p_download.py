@@ -0,0 +1,455 @@
+import json
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from p2p_chunks import LocalChunks, hash_chunks
+from p2p_client import fetch_checksum, fetch_chunk, fetch_file, fetch_manifest, fetch_range, stat_remote_file
+from p2p_protocol import ProtocolError
+from p2p_transfer import (
+    JOURNAL_SUFFIX, PART_SUFFIX, get_chunk_size, preallocate, pwrite, resolve_shared_path, sha256_file
+)
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_PARALLEL_CONNECTIONS = 4
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+# Nombre d'essais d'un segment, et d'échecs tolérés par pair avant de l'écarter
+MAX_SEGMENT_ATTEMPTS = 3
+MAX_SOURCE_ERRORS = 2
+
+# Téléchargement interrompu à la demande (pause, annulation) : levée par la fonction
+# de progression, elle arrête toutes les connexions sans compter comme une erreur de
+# pair ; le .part et son journal sont conservés
+class DownloadInterrupted(Exception):
+    pass
+
+# Découper [0, size) en segments (offset, longueur)
+def split_segments(size, segment_size):
+    return [(offset, min(segment_size, size - offset)) for offset in range(0, size, segment_size)]
+
+# Journal d'un téléchargement partiel : plages d'octets déjà écrites dans le fichier .part
+#
+# L'identité (taille et date du fichier source) permet de détecter que le fichier
+# distant a changé depuis le téléchargement interrompu : le journal est alors ignoré.
+# Les plages ne sont pas synchronisées sur disque à chaque écriture ; la vérification
+# finale de la somme de contrôle détecte un .part corrompu après un arrêt brutal.
+class PartJournal:
+    def __init__(self, path, identity, ranges=None):
+        self.path = path
+        self.identity = identity
+        self.ranges = ranges or []
+
+    @classmethod
+    def load(cls, path, identity):
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("identity") == identity:
+                return cls(path, identity, [tuple(r) for r in data.get("ranges", [])])
+        except (OSError, ValueError):
+            pass
+        return cls(path, identity)
+
+    # Ajouter la plage [start, end) en fusionnant les plages contiguës
+    def add(self, start, end):
+        if end <= start:
+            return
+        merged = []
+        for s, e in sorted(self.ranges + [(start, end)]):
+            if merged and s <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+            else:
+                merged.append((s, e))
+        self.ranges = merged
+
+    # Plages restant à télécharger dans [0, size)
+    def missing(self, size):
+        gaps = []
+        position = 0
+        for s, e in self.ranges:
+            if s > position:
+                gaps.append((position, s))
+            position = max(position, e)
+        if position < size:
+            gaps.append((position, size))
+        return gaps
+
+    def completed(self):
+        return sum(e - s for s, e in self.ranges)
+
+    # Écriture atomique du journal (fichier temporaire puis renommage)
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"identity": self.identity, "ranges": self.ranges}, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# Interroger un pair ; renvoie ses métadonnées ou None s'il n'a pas le fichier
+def _probe(source, filename, config):
+    host, port = source
+    try:
+        return stat_remote_file(host, port, filename, config)
+    except Exception:
+        return None
+
+# Téléchargement d'un fichier par segments sur plusieurs connexions et plusieurs pairs
+#
+# Les sources sont des couples (hôte, port) ; la première est le pair choisi par
+# l'utilisateur et fait foi pour la taille du fichier. Les autres ne sont utilisées
+# que si elles possèdent un fichier de même nom et de même taille. Chaque connexion
+# prend le segment suivant dans une file commune, si bien que les pairs les plus
+# rapides servent plus de segments. Les segments sont écrits en place (os.pwrite)
+# dans un fichier .part pré-dimensionné, accompagné d'un journal des plages reçues :
+# un téléchargement interrompu reprend là où il s'était arrêté. Le fichier n'est
+# renommé à sa place définitive qu'une fois sa taille et son SHA-256 vérifiés.
+class ParallelDownload:
+    def __init__(self, sources, filename, dest_dir, config, progress_callback=None):
+        self.filename = filename
+        self.dest_dir = dest_dir
+        self.config = config
+        self.progress_callback = progress_callback
+        self.candidates = list(dict.fromkeys(sources))
+        self.sources = []
+        self.size = None
+        self.mtime = None
+        self.checksum = None
+        self.journal = None
+        self.resumed = 0
+        self.connections = 0
+        self.received = 0
+        self.lock = threading.Lock()
+        self.segments = queue.Queue()
+        self.remaining = 0
+        self.error = None
+        self.source_errors = {}
+
+    # Sélectionner les pairs possédant le fichier (sondés en parallèle)
+    def find_sources(self):
+        with ThreadPoolExecutor(max_workers=len(self.candidates)) as pool:
+            results = list(pool.map(lambda src: _probe(src, self.filename, self.config), self.candidates))
+        found = [(src, meta) for src, meta in zip(self.candidates, results) if meta is not None]
+        if not found:
+            return
+        self.size = found[0][1]["size"]
+        self.mtime = found[0][1].get("mtime")
+        self.sources = [src for src, meta in found if meta["size"] == self.size]
+
+    # Lancer (ou reprendre) le téléchargement ; renvoie le nombre d'octets du fichier
+    def run(self):
+        local_path = resolve_shared_path(self.dest_dir, self.filename)
+        if local_path is None:
+            raise ProtocolError(f"Nom de fichier invalide: {self.filename}")
+        part_path = local_path + PART_SUFFIX
+        self.find_sources()
+        if not self.sources:
+            # Aucun pair ne supporte GET_RANGE : téléchargement classique depuis le pair choisi
+            PartJournal(local_path + JOURNAL_SUFFIX, None).remove()
+            host, port = self.candidates[0]
+            self.sources = [self.candidates[0]]
+            self.connections = 1
+            return fetch_file(host, port, self.filename, self.dest_dir, self.config, self.progress_callback)
+
+        # Somme de contrôle demandée en parallèle du transfert (calcul long côté serveur)
+        checksum_thread = threading.Thread(target=self._fetch_checksum, daemon=True)
+        checksum_thread.start()
+
+        self.journal = PartJournal.load(local_path + JOURNAL_SUFFIX, {"size": self.size, "mtime": self.mtime})
+        if not os.path.exists(part_path):
+            self.journal.ranges = []
+        self.resumed = self.received = self.journal.completed()
+
+        segment_size = int(self.config.get("segment_size", DEFAULT_SEGMENT_SIZE))
+        segments = []
+        for start, end in self.journal.missing(self.size):
+            segments += [(start + offset, length) for offset, length in split_segments(end - start, segment_size)]
+        for offset, length in segments:
+            self.segments.put((offset, length, 0))
+        self.remaining = len(segments)
+        max_connections = int(self.config.get("parallel_connections", DEFAULT_PARALLEL_CONNECTIONS))
+        self.connections = max(1, min(max_connections, len(segments)))
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0)
+        if not self.journal.ranges:
+            flags |= os.O_TRUNC
+        fd = os.open(part_path, flags, 0o644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                preallocate(fd, self.size)
+            workers = [threading.Thread(target=self._worker, args=(i, fd), daemon=True)
+                       for i in range(self.connections)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        finally:
+            os.close(fd)
+        if isinstance(self.error, DownloadInterrupted):
+            raise self.error
+        if self.error is not None:
+            # Le .part et son journal sont conservés pour une reprise ultérieure
+            raise ProtocolError(f"Téléchargement interrompu: {self.error}")
+
+        checksum_thread.join()
+        self.verify(part_path)
+        os.replace(part_path, local_path)
+        self.journal.remove()
+        return self.size
+
+    def _fetch_checksum(self):
+        host, port = self.sources[0]
+        try:
+            self.checksum = fetch_checksum(host, port, self.filename, self.config)
+        except Exception:
+            self.checksum = None
+
+    # Vérifier la taille et la somme de contrôle du .part avant de le mettre en place
+    def verify(self, part_path):
+        actual_size = os.path.getsize(part_path)
+        error = None
+        if actual_size != self.size:
+            error = f"Taille invalide: {actual_size}/{self.size} octets"
+        elif self.checksum and sha256_file(part_path, get_chunk_size(self.config)) != self.checksum:
+            error = "Somme de contrôle SHA-256 invalide"
+        if error:
+            os.remove(part_path)
+            self.journal.remove()
+            raise ProtocolError(error)
+
+    # Enregistrer une plage écrite dans le journal
+    def _record(self, start, end):
+        with self.lock:
+            self.journal.add(start, end)
+            self.journal.save()
+
+    def _add_progress(self, n):
+        with self.lock:
+            self.received += n
+            if self.progress_callback:
+                try:
+                    self.progress_callback(self.received, self.size)
+                except DownloadInterrupted as e:
+                    self.error = e
+                    raise
+
+    # Source attribuée à une connexion (réparties en tourniquet parmi les pairs valides)
+    def _pick_source(self, index):
+        with self.lock:
+            if not self.sources:
+                return None
+            return self.sources[index % len(self.sources)]
+
+    def _source_failed(self, source, error):
+        with self.lock:
+            self.source_errors[source] = self.source_errors.get(source, 0) + 1
+            if self.source_errors[source] >= MAX_SOURCE_ERRORS and source in self.sources:
+                self.sources.remove(source)
+            if not self.sources:
+                self.error = error
+
+    def _worker(self, index, fd):
+        while self.error is None and self.remaining > 0:
+            try:
+                offset, length, attempts = self.segments.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            source = self._pick_source(index)
+            if source is None:
+                return
+            written = [0]
+
+            def on_bytes(n):
+                written[0] += n
+                self._add_progress(n)
+
+            host, port = source
+            try:
+                fetch_range(host, port, self.filename, offset, length, fd, self.config, on_bytes)
+            except Exception as e:
+                # Garder la partie déjà écrite et remettre le reste du segment dans la file
+                self._record(offset, offset + written[0])
+                if isinstance(e, DownloadInterrupted):
+                    return
+                self._source_failed(source, e)
+                if attempts + 1 >= MAX_SEGMENT_ATTEMPTS:
+                    with self.lock:
+                        self.error = e
+                    return
+                self.segments.put((offset + written[0], length - written[0], attempts + 1))
+                continue
+            self._record(offset, offset + length)
+            with self.lock:
+                self.remaining -= 1
+
+# Manifeste d'un pair, ou None s'il n'a pas le fichier ou ne supporte pas MANIFEST
+def _probe_manifest(source, filename, config):
+    host, port = source
+    try:
+        return fetch_manifest(host, port, filename, config, timeout=5)
+    except Exception:
+        return None
+
+# Téléchargement par blocs adressés par leur contenu (voir p2p_chunks)
+#
+# Le manifeste du fichier est demandé au pair choisi ; seuls les pairs annonçant la
+# même racine de Merkle servent de sources. Les blocs déjà présents localement (dans
+# le .part d'un essai précédent, l'ancienne version du fichier ou tout autre fichier
+# de l'index partagé) sont recopiés sans passer par le réseau ; les autres sont
+# demandés par GET_CHUNK et vérifiés un à un avant d'être écrits. Sans manifeste, ou
+# si aucun bloc n'est disponible localement, le téléchargement se fait par segments
+# (ParallelDownload), plus efficace pour une copie complète.
+class ChunkedDownload(ParallelDownload):
+    def __init__(self, sources, filename, dest_dir, config, progress_callback=None, local_index=None):
+        super().__init__(sources, filename, dest_dir, config, progress_callback)
+        self.local_index = local_index
+        self.manifest = None
+
+    def find_sources(self):
+        with ThreadPoolExecutor(max_workers=len(self.candidates)) as pool:
+            results = list(pool.map(lambda src: _probe_manifest(src, self.filename, self.config), self.candidates))
+        if results[0] is None:
+            return
+        self.manifest, meta = results[0]
+        self.size = self.manifest.size
+        self.mtime = meta.get("mtime")
+        self.sources = [src for src, r in zip(self.candidates, results)
+                        if r is not None and r[0].root == self.manifest.root]
+
+    # Blocs du .part d'un essai précédent déjà à leur place : numéros des blocs
+    # identiques au manifeste (appelé avant la création du .part : un nouveau
+    # téléchargement ne relit pas un fichier vide)
+    def _blocks_in_place(self, part_path):
+        if not os.path.exists(part_path):
+            return set()
+        try:
+            _, digests = hash_chunks(part_path, self.manifest.chunk_size)
+        except OSError:
+            return set()
+        return {i for i, digest in enumerate(digests[:len(self.manifest.digests)])
+                if digest == self.manifest.digests[i] and self.manifest.chunk_range(i)[1] > 0}
+
+    # Recopier les blocs disponibles localement (hors in_place, déjà dans le .part) ;
+    # renvoie les blocs restant à télécharger
+    def _copy_local(self, fd, local_path, in_place):
+        local = LocalChunks(self.manifest.chunk_size, self.local_index)
+        if os.path.isfile(local_path):
+            local.add_file(local_path)
+        missing = []
+        for i, digest in enumerate(self.manifest.digests):
+            offset, length = self.manifest.chunk_range(i)
+            if i in in_place:
+                self.resumed += length
+                continue
+            data = local.read(digest)
+            if data is None:
+                missing.append((i, 0))
+                continue
+            pwrite(fd, data, offset)
+            self.resumed += length
+        return missing
+
+    def run(self):
+        local_path = resolve_shared_path(self.dest_dir, self.filename)
+        if local_path is None:
+            raise ProtocolError(f"Nom de fichier invalide: {self.filename}")
+        part_path = local_path + PART_SUFFIX
+        self.find_sources()
+        if self.manifest is None or not self.sources:
+            return self._fallback()
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        in_place = self._blocks_in_place(part_path)
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            missing = self._copy_local(fd, local_path, in_place)
+            if len(missing) == len(self.manifest.digests) and missing:
+                # Rien à réutiliser : transfert classique par segments
+                os.close(fd)
+                fd = None
+                return self._fallback()
+            self.received = self.resumed
+            for item in missing:
+                self.segments.put(item)
+            self.remaining = len(missing)
+            max_connections = int(self.config.get("parallel_connections", DEFAULT_PARALLEL_CONNECTIONS))
+            self.connections = max(1, min(max_connections, len(missing)))
+            workers = [threading.Thread(target=self._worker, args=(i, fd), daemon=True)
+                       for i in range(self.connections if missing else 0)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        finally:
+            if fd is not None:
+                os.close(fd)
+        if isinstance(self.error, DownloadInterrupted):
+            raise self.error
+        if self.error is not None:
+            # Le .part est conservé : ses blocs valides seront réutilisés à la reprise
+            raise ProtocolError(f"Téléchargement interrompu: {self.error}")
+        # Chaque bloc a été vérifié : la taille suffit à valider le fichier assemblé
+        actual_size = os.path.getsize(part_path)
+        if actual_size != self.size:
+            os.remove(part_path)
+            raise ProtocolError(f"Taille invalide: {actual_size}/{self.size} octets")
+        os.replace(part_path, local_path)
+        PartJournal(local_path + JOURNAL_SUFFIX, None).remove()
+        return self.size
+
+    # Déléguer à ParallelDownload et reprendre ses statistiques
+    def _fallback(self):
+        download = ParallelDownload(self.candidates, self.filename, self.dest_dir, self.config,
+                                    self.progress_callback)
+        try:
+            return download.run()
+        finally:
+            self.sources = download.sources
+            self.size = download.size
+            self.resumed = download.resumed
+            self.connections = download.connections
+            self.received = download.received
+
+    def _worker(self, index, fd):
+        while self.error is None and self.remaining > 0:
+            try:
+                i, attempts = self.segments.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # Un autre pair à chaque nouvel essai du même bloc
+            source = self._pick_source(index + attempts)
+            if source is None:
+                return
+            offset, length = self.manifest.chunk_range(i)
+            host, port = source
+            try:
+                fetch_chunk(host, port, self.manifest.digests[i], offset, length, fd, self.config)
+            except Exception as e:
+                self._source_failed(source, e)
+                if attempts + 1 >= MAX_SEGMENT_ATTEMPTS:
+                    with self.lock:
+                        self.error = e
+                    return
+                self.segments.put((i, attempts + 1))
+                continue
+            with self.lock:
+                self.remaining -= 1
+            try:
+                self._add_progress(length)
+            except DownloadInterrupted:
+                return
+
+# Choisir le mode de téléchargement selon la configuration ("dedup_transfers")
+def create_download(sources, filename, dest_dir, config, progress_callback=None, local_index=None):
+    if config.get("dedup_transfers", True):
+        return ChunkedDownload(sources, filename, dest_dir, config, progress_callback, local_index)
+    return ParallelDownload(sources, filename, dest_dir, config, progress_callback)
+
+# Télécharger un fichier depuis une ou plusieurs sources (hôte, port)
+def parallel_download(sources, filename, dest_dir, config, progress_callback=None, local_index=None):
+    return create_download(sources, filename, dest_dir, config, progress_callback, local_index).run()
@@ -1,255 +1,230 @@
-import socket
 import threading
-import os
-import json
-import struct
-import time
+import types
+from p2p_control import DONE, PRIORITY_HIGH, PRIORITY_NAMES, RUNNING, STATE_NAMES, ControlError, attach, load_config
 from PySide6.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton,
-    QLabel, QProgressBar, QMessageBox, QTextEdit
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLabel, QProgressBar,
+    QMessageBox, QTextEdit, QAbstractItemView, QLineEdit, QListView, QTableWidget, QTableWidgetItem,
+    QHeaderView
 )
-from PySide6.QtCore import Qt, QThread, Signal
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QObject, QRunnable, QThreadPool, QTimer, Signal
 
 # --- CONFIGURATION ---
-CONFIG_FILE = "config.json"
-MULTICAST_GROUP = '224.1.1.1'
-MULTICAST_PORT = 9999
-HOSTS_FILE = os.path.join(os.path.dirname(__file__), "p2p_hosts.txt")
-
-def load_config():
-    with open(CONFIG_FILE, 'r') as f:
-        return json.load(f)
-
-config = load_config()
-shared_dir = config["shared_dir"]
-
-# --- P2P BACKEND ---
+# La GUI est un client du démon du pair (p2p_daemon.py), lancé au besoin en
+# arrière-plan : le partage continue après la fermeture de la fenêtre. La
+# configuration n'est lue qu'au lancement (main).
+config = None
+# Client du démon
+client = None
+
+# Threads des opérations réseau de l'interface (listes, recherche)
+BACKGROUND_THREADS = 4
+# Attente maximale des opérations réseau en cours à la fermeture (ms)
+SHUTDOWN_WAIT_MS = 3000
+# Intervalle de rafraîchissement de la file des téléchargements (ms)
+DOWNLOADS_REFRESH_MS = 200
+
+# --- P2P BACKEND (démon) ---
 def list_files():
-    try:
-        return os.listdir(shared_dir)
-    except FileNotFoundError:
-        return []
-
-def get_local_ip():
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(('10.255.255.255', 1))
-        IP = s.getsockname()[0]
-    except Exception:
-        IP = '127.0.0.1'
-    finally:
-        s.close()
-    return IP
-
-def resolve_host(host):
-    # Résolution via p2p_hosts.txt
-    if os.path.exists(HOSTS_FILE):
-        with open(HOSTS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) >= 2 and parts[1] == host:
-                    return parts[0]
-    # Fallback DNS
-    try:
-        return socket.gethostbyname(host)
-    except Exception:
-        return host
-
-class PeerServer(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        self.host = config["host"]
-        self.port = config["port"]
+    return client.call("local_files")
+
+# Liste d'un pair parcourue au fil de l'eau (par lots transmis par le démon, qui la
+# garde tant que l'index du pair ne change pas)
+def iter_remote_files(host):
+    for batch in client.stream("remote_files", host=host):
+        yield from batch
+
+# Recherche chez tous les pairs : (hôte, port, fichiers, erreur) au fil des réponses
+def search_peers(pattern):
+    return client.stream("search", pattern=pattern)
+
+# Lot suivant d'un générateur de lignes : (lignes, générateur épuisé)
+def next_batch(source, count):
+    batch = []
+    for row in source:
+        batch.append(row)
+        if len(batch) >= count:
+            return batch, False
+    return batch, True
+
+# --- OPERATIONS RESEAU EN ARRIERE-PLAN ---
+# Le thread de l'interface n'attend jamais le réseau : chaque opération s'exécute dans
+# le pool de threads de l'interface (QThreadPool) et ses résultats reviennent par
+# signal. Si la fonction renvoie un générateur, chaque valeur produite est transmise
+# dès qu'elle est prête (partial), puis done(None).
+class WorkerSignals(QObject):
+    partial = Signal(object)
+    done = Signal(object)
+    failed = Signal(str)
+    finished = Signal()
+
+class Worker(QRunnable):
+    def __init__(self, fn, *args):
+        super().__init__()
+        # Durée de vie gérée par BackgroundTasks (la référence Python est gardée)
+        self.setAutoDelete(False)
+        self.fn = fn
+        self.args = args
+        self.signals = WorkerSignals()
 
     def run(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.bind((self.host, self.port))
-        s.listen(5)
-        while True:
-            conn, addr = s.accept()
-            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
-
-    def handle_client(self, conn, addr):
         try:
-            request = conn.recv(1024).decode()
-            if request.startswith("GET_FILE "):
-                filename = request.split(" ", 1)[1].strip()
-                filepath = os.path.join(shared_dir, filename)
-                if os.path.exists(filepath):
-                    conn.send(b"OK\n")
-                    with open(filepath, "rb") as f:
-                        while True:
-                            chunk = f.read(4096)
-                            if not chunk:
-                                break
-                            conn.sendall(chunk)
-                else:
-                    conn.send(b"ERROR: File not found\n")
-            elif request.startswith("LIST_FILES"):
-                files = list_files()
-                response = "\n".join(files) + "\n"
-                conn.sendall(response.encode())
-            else:
-                conn.send(b"ERROR: Invalid command\n")
+            result = self.fn(*self.args)
+            if isinstance(result, types.GeneratorType):
+                for value in result:
+                    self.signals.partial.emit(value)
+                result = None
         except Exception as e:
-            print(f"[!] Erreur avec {addr}: {e}")
-        finally:
-            conn.close()
-
-class MulticastResponder(threading.Thread):
-    def __init__(self):
-        super().__init__(daemon=True)
-        self.group = MULTICAST_GROUP
-        self.port = MULTICAST_PORT
-
-    def run(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            sock.bind((self.group, self.port))
-        except OSError:
-            sock.bind(('', self.port))
-        group_bin = socket.inet_aton(self.group)
-        mreq = group_bin + socket.inet_aton('0.0.0.0')
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-        while True:
-            data, addr = sock.recvfrom(1024)
-            if data.decode() == "DISCOVER_P2P":
-                hostname = socket.gethostname()
-                ip = get_local_ip()
-                sock.sendto(f"{hostname}|{ip}".encode(), addr)
-
-def send_discovery(timeout=2):
-    discovered = set()
-    known_hosts = {}
-    # Charger les hosts connus
-    if os.path.exists(HOSTS_FILE):
-        with open(HOSTS_FILE, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                parts = line.split()
-                if len(parts) >= 2:
-                    known_hosts[parts[1]] = parts[0]
-    # Découverte multicast
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.settimeout(timeout)
-    ttl = struct.pack('b', 1)
-    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-    sock.sendto(b"DISCOVER_P2P", (MULTICAST_GROUP, MULTICAST_PORT))
-    new_hosts = {}
-    try:
-        while True:
-            data, addr = sock.recvfrom(1024)
-            try:
-                hostname, ip = data.decode().split("|")
-            except Exception:
-                continue
-            discovered.add(hostname)
-            if hostname not in known_hosts or known_hosts[hostname] != ip:
-                new_hosts[hostname] = ip
-    except socket.timeout:
-        pass
-    sock.close()
-    # Mise à jour du fichier hosts si besoin
-    if new_hosts:
-        known_hosts.update(new_hosts)
-        with open(HOSTS_FILE, "w") as f:
-            for h, ip in known_hosts.items():
-                f.write(f"{ip} {h}\n")
-    return sorted(discovered)
-
-def get_remote_files(host, port):
-    try:
-        ip = resolve_host(host)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.settimeout(5)
-        s.connect((ip, int(port)))
-        s.sendall(b"LIST_FILES")
-        response = b""
-        while True:
-            part = s.recv(4096)
-            if not part:
-                break
-            response += part
-        s.close()
-        files = response.decode(errors="ignore").strip().split("\n")
-        return files if files != [''] else []
-    except Exception as e:
-        return []
-
-def download_file(host, port, filename, progress_callback=None):
-    s = None
-    try:
-        ip = resolve_host(host)
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        s.connect((ip, int(port)))
-        s.sendall(f"GET_FILE {filename}".encode())
-        response = b""
-        while not response.endswith(b"\n"):
-            chunk = s.recv(1)
-            if not chunk:
-                break
-            response += chunk
-        if response.startswith(b"OK"):
-            local_path = os.path.join(shared_dir, filename)
-            with open(local_path, "wb") as f:
-                leftover = response[len(b"OK\n"):]
-                total_bytes = 0
-                if leftover:
-                    f.write(leftover)
-                    total_bytes += len(leftover)
-                start_time = time.time()
-                last_time = start_time
-                last_bytes = 0
-                while True:
-                    data = s.recv(4096)
-                    if not data:
-                        break
-                    f.write(data)
-                    total_bytes += len(data)
-                    if progress_callback:
-                        now = time.time()
-                        speed = (total_bytes - last_bytes) / (now - last_time) / 1024 if now - last_time > 0 else 0
-                        progress_callback(total_bytes, speed)
-                        last_time = now
-                        last_bytes = total_bytes
-            return True, f"Fichier '{filename}' téléchargé avec succès."
+            self.signals.failed.emit(str(e))
         else:
-            return False, response.decode(errors="ignore").strip()
-    except Exception as e:
-        return False, f"Erreur téléchargement: {e}"
-    finally:
-        if s:
-            s.close()
-
-# --- THREAD POUR LE TELECHARGEMENT AVEC SIGNALS ---
-class DownloadThread(QThread):
-    progress = Signal(int, float)  # bytes_received, speed
-    finished = Signal(bool, str)   # success, message
-
-    def __init__(self, host, port, filename):
+            self.signals.done.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+class BackgroundTasks:
+    def __init__(self, max_threads=BACKGROUND_THREADS):
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self.running = set()
+
+    # Lancer fn(*args) ; les fonctions partial, done et failed sont appelées dans le
+    # thread de l'interface
+    def start(self, fn, *args, partial=None, done=None, failed=None):
+        worker = Worker(fn, *args)
+        for signal, slot in ((worker.signals.partial, partial), (worker.signals.done, done),
+                             (worker.signals.failed, failed)):
+            if slot is not None:
+                signal.connect(slot)
+        worker.signals.finished.connect(lambda: self.running.discard(worker))
+        self.running.add(worker)
+        self.pool.start(worker)
+        return worker
+
+    # Abandonner les opérations pas encore commencées et attendre les autres
+    def shutdown(self, timeout_ms=SHUTDOWN_WAIT_MS):
+        self.pool.clear()
+        return self.pool.waitForDone(timeout_ms)
+
+# --- MODELE DE LA LISTE DES FICHIERS DISTANTS ---
+# Les lignes (texte affiché, données) sont tirées d'un générateur par lots, à mesure
+# que la vue en a besoin (défilement) : une liste de 100 000 fichiers ne crée pas
+# 100 000 éléments graphiques d'un coup. Chaque lot est lu en arrière-plan (le
+# générateur attend le réseau) ; les lots d'une source remplacée entre-temps sont
+# ignorés.
+class RemoteFilesModel(QAbstractListModel):
+    FETCH_BATCH = 500
+    exhausted = Signal(int)  # nombre total de lignes
+    failed = Signal(str)
+
+    def __init__(self, tasks):
         super().__init__()
-        self.host = host
-        self.port = port
-        self.filename = filename
-
-    def run(self):
-        def cb(bytes_received, speed):
-            self.progress.emit(bytes_received, speed)
-        success, msg = download_file(self.host, self.port, self.filename, cb)
-        self.finished.emit(success, msg)
+        self.tasks = tasks
+        self.rows = []
+        self.source = None
+        self.loading = False
+        self.generation = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        text, payload = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return text
+        if role == Qt.UserRole:
+            return payload
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.source is not None and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.source is None or self.loading:
+            return
+        self.loading = True
+        generation = self.generation
+        self.tasks.start(next_batch, self.source, self.FETCH_BATCH,
+                         done=lambda result: self.on_batch(generation, *result),
+                         failed=lambda error: self.on_batch_failed(generation, error))
+
+    def on_batch(self, generation, batch, finished):
+        if generation != self.generation:
+            return
+        self.loading = False
+        if finished:
+            self.source = None
+        self.append(batch)
+        if finished:
+            self.exhausted.emit(len(self.rows))
+
+    def on_batch_failed(self, generation, error):
+        if generation != self.generation:
+            return
+        self.loading = False
+        self.source = None
+        self.failed.emit(error)
+
+    # Nouvelle source de lignes (générateur de (texte, données)) ; None pour vider
+    def set_source(self, source):
+        self.beginResetModel()
+        self.generation += 1
+        self.rows = []
+        self.source = source
+        self.loading = False
+        self.endResetModel()
+
+    def append(self, rows):
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def payload(self, row):
+        return self.rows[row][1]
+
+# --- ETATS DE LA FILE DES TELECHARGEMENTS ---
+# Les workers de la file appellent ses fonctions depuis leur thread, plusieurs fois
+# par seconde et par téléchargement : seul le dernier état de chaque élément est
+# gardé, et l'interface les relève à intervalle fixe (aucun signal par bloc reçu).
+class DownloadUpdates:
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        with self.lock:
+            self.pending[item["id"]] = item
+
+    def take(self):
+        with self.lock:
+            items, self.pending = self.pending, {}
+        return sorted(items.values(), key=lambda item: item["id"])
+
+# Colonnes de la table des téléchargements
+DOWNLOAD_COLUMNS = ["Téléchargement", "État", "Progression", "Débit", "Priorité"]
+
+# Pourcentage reçu, ou None si la taille n'est pas encore connue
+def download_percent(item):
+    if item["state"] == DONE:
+        return 100
+    if not item["size"]:
+        return None
+    return min(100, int(item["received"] * 100 / item["size"]))
+
+# --- EVENEMENTS DU DEMON ---
+# Les événements du démon arrivent dans le thread de l'abonnement : les signaux
+# transmettent la liste des pairs et l'arrêt du démon au thread de l'interface.
+class DaemonSignals(QObject):
+    peers_changed = Signal(list)
+    stopped = Signal()
 
 # --- INTERFACE PySide6 ---
 class P2PGuiQt(QWidget):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("P2P File Share")
-        self.setFixedSize(750, 420)
+        self.setFixedSize(900, 520)
 
         hbox = QHBoxLayout(self)
 
@@ -265,10 +240,22 @@ class P2PGuiQt(QWidget):
         # Colonne fichiers distants
         vbox_remote = QVBoxLayout()
         vbox_remote.addWidget(QLabel("Fichiers du pair sélectionné :"))
-        self.remote_files_list = QListWidget()
+        self.tasks = BackgroundTasks()
+        self.remote_model = RemoteFilesModel(self.tasks)
+        self.remote_files_list = QListView()
+        self.remote_files_list.setModel(self.remote_model)
+        self.remote_files_list.setUniformItemSizes(True)
+        self.remote_files_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
         vbox_remote.addWidget(self.remote_files_list)
         self.refresh_files_btn = QPushButton("Rafraîchir fichiers")
         vbox_remote.addWidget(self.refresh_files_btn)
+        search_box = QHBoxLayout()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Rechercher (nom ou motif)")
+        search_box.addWidget(self.search_edit)
+        self.search_btn = QPushButton("Rechercher")
+        search_box.addWidget(self.search_btn)
+        vbox_remote.addLayout(search_box)
         self.download_btn = QPushButton("Télécharger")
         vbox_remote.addWidget(self.download_btn)
         hbox.addLayout(vbox_remote)
@@ -289,6 +276,23 @@ class P2PGuiQt(QWidget):
         vbox_bottom.addWidget(self.progress)
         self.progress_label = QLabel("")
         vbox_bottom.addWidget(self.progress_label)
+        vbox_bottom.addWidget(QLabel("File des téléchargements :"))
+        self.downloads_table = QTableWidget(0, len(DOWNLOAD_COLUMNS))
+        self.downloads_table.setHorizontalHeaderLabels(DOWNLOAD_COLUMNS)
+        self.downloads_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.downloads_table.verticalHeader().setVisible(False)
+        self.downloads_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.downloads_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.downloads_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        vbox_bottom.addWidget(self.downloads_table)
+        queue_buttons = QHBoxLayout()
+        self.pause_btn = QPushButton("Pause")
+        self.resume_btn = QPushButton("Reprendre")
+        self.cancel_btn = QPushButton("Annuler")
+        self.priority_btn = QPushButton("Prioritaire")
+        for button in (self.pause_btn, self.resume_btn, self.cancel_btn, self.priority_btn):
+            queue_buttons.addWidget(button)
+        vbox_bottom.addLayout(queue_buttons)
         self.log_text = QTextEdit()
         self.log_text.setReadOnly(True)
         vbox_bottom.addWidget(self.log_text)
@@ -300,45 +304,93 @@ class P2PGuiQt(QWidget):
         self.refresh_files_btn.clicked.connect(self.refresh_remote_files)
         self.download_btn.clicked.connect(self.download_selected_file)
         self.refresh_local_btn.clicked.connect(self.refresh_local_files)
+        self.search_btn.clicked.connect(self.search_network)
+        self.remote_model.exhausted.connect(lambda count: self.log(f"{count} fichier(s) distant(s) listé(s)."))
+        self.remote_model.failed.connect(lambda error: self.log(f"[!] Erreur récupération liste distante: {error}"))
+        self.search_edit.returnPressed.connect(self.search_network)
+        self.searching = False
+        self.pause_btn.clicked.connect(lambda: self.control_download("pause"))
+        self.resume_btn.clicked.connect(lambda: self.control_download("resume"))
+        self.cancel_btn.clicked.connect(lambda: self.control_download("cancel"))
+        self.priority_btn.clicked.connect(lambda: self.control_download("set_priority", priority=PRIORITY_HIGH))
+        # Lignes de la file : numéro de l'élément -> (ligne, dernier état connu), et
+        # dernier état de chaque élément
+        self.download_rows = {}
+        self.download_items = {}
+
+        self.download_updates = DownloadUpdates()
+        self.downloads_timer = QTimer(self)
+        self.downloads_timer.timeout.connect(self.refresh_downloads)
+        self.downloads_timer.start(DOWNLOADS_REFRESH_MS)
+
+        self.daemon_signals = DaemonSignals()
+        self.daemon_signals.peers_changed.connect(self.update_peers)
+        self.daemon_signals.stopped.connect(lambda: self.log("[!] Le démon s'est arrêté."))
+        self.unsubscribe = client.subscribe(self.on_daemon_event)
+        for item in client.call("downloads"):
+            self.on_download_changed(item)
+        self.update_total_progress()
 
         # Init
         self.refresh_local_files()
-        self.refresh_peers()
+        self.update_peers(client.call("peers"))
 
     def log(self, msg):
         self.log_text.append(msg)
 
+    # Événement du démon (thread de l'abonnement)
+    def on_daemon_event(self, event):
+        if event["event"] == "download":
+            self.download_updates.put(event["item"])
+        elif event["event"] == "peers":
+            self.daemon_signals.peers_changed.emit(event["peers"])
+        elif event["event"] == "stopped":
+            self.daemon_signals.stopped.emit()
+
+    # Bouton "Découvrir pairs" : nouvelle requête, les réponses arrivent par signal
     def refresh_peers(self):
+        self.update_peers(client.call("peers", refresh=True))
+
+    # Mettre à jour la liste des pairs en gardant le pair sélectionné
+    def update_peers(self, peers):
+        current = self.get_selected_peer()
+        if [self.peers_list.item(i).text() for i in range(self.peers_list.count())] == peers:
+            return
+        self.peers_list.blockSignals(True)
         self.peers_list.clear()
-        peers = send_discovery()
         for host in peers:
             self.peers_list.addItem(host)
-        self.log(f"{len(peers)} pair(s) trouvé(s).")
-        if peers:
-            self.peers_list.setCurrentRow(0)
-            self.on_peer_select(0)
+        if current in peers:
+            # Même pair sélectionné : inutile de relister ses fichiers
+            self.peers_list.setCurrentRow(peers.index(current))
+        self.peers_list.blockSignals(False)
+        self.log(f"{len(peers)} pair(s) disponible(s).")
+        if current not in peers:
+            if peers:
+                self.peers_list.setCurrentRow(0)
+            else:
+                self.remote_model.set_source(None)
 
     def get_selected_peer(self):
         row = self.peers_list.currentRow()
         if row < 0:
-            return None, None
-        host = self.peers_list.item(row).text()
-        return host, config["port"]
+            return None
+        return self.peers_list.item(row).text()
 
     def refresh_remote_files(self):
-        self.remote_files_list.clear()
-        host, port = self.get_selected_peer()
-        if not host or not port:
+        host = self.get_selected_peer()
+        if not host:
+            self.remote_model.set_source(None)
             self.log("Aucun pair sélectionné.")
             return
-        files = get_remote_files(host, port)
-        for f in files:
-            self.remote_files_list.addItem(f)
-        self.log(f"{len(files)} fichier(s) distant(s) listé(s).")
+        self.remote_model.set_source((name, None) for name in iter_remote_files(host))
 
     def refresh_local_files(self):
+        self.tasks.start(list_files, done=self.show_local_files,
+                         failed=lambda error: self.log(f"[!] Erreur liste locale: {error}"))
+
+    def show_local_files(self, files):
         self.local_files_list.clear()
-        files = list_files()
         for f in files:
             self.local_files_list.addItem(f)
         self.log(f"{len(files)} fichier(s) local(aux) listé(s).")
@@ -346,41 +398,144 @@ class P2PGuiQt(QWidget):
     def on_peer_select(self, row):
         self.refresh_remote_files()
 
+    # Recherche chez tous les pairs : la liste des fichiers distants affiche les
+    # résultats (nom et pair) au fur et à mesure des réponses
+    def search_network(self):
+        pattern = self.search_edit.text().strip()
+        if not pattern or self.searching:
+            return
+        self.remote_model.set_source(None)
+        self.log(f"Recherche de '{pattern}' chez {self.peers_list.count()} pair(s)...")
+        self.searching = True
+        worker = self.tasks.start(search_peers, pattern, partial=self.on_search_result,
+                                  failed=lambda error: self.log(f"[!] Recherche: {error}"))
+        worker.signals.finished.connect(lambda: self.on_search_finished(pattern))
+
+    # Réponse d'un pair : (hôte, port, fichiers trouvés, erreur)
+    def on_search_result(self, result):
+        host, port, files, error = result
+        if error:
+            self.log(f"[!] {host}: {error}")
+            return
+        self.remote_model.append([(f"{entry['name']} — {host}", (host, port, entry["name"])) for entry in files])
+
+    def on_search_finished(self, pattern):
+        self.searching = False
+        self.log(f"{self.remote_model.rowCount()} résultat(s) pour '{pattern}'.")
+
+    # Mettre la sélection en file : un élément par pair (résultats de recherche de
+    # plusieurs pairs : un élément pour chacun, servis en parallèle)
     def download_selected_file(self):
-        host, port = self.get_selected_peer()
-        if not host or not port:
-            QMessageBox.warning(self, "Attention", "Sélectionnez un pair.")
+        rows = sorted(index.row() for index in self.remote_files_list.selectionModel().selectedRows())
+        selected = [self.remote_model.rows[row] for row in rows]
+        if selected and selected[0][1]:
+            # Résultats de recherche : les autres pairs qui ont le même fichier servent
+            # de sources supplémentaires
+            by_peer = {}
+            for _, (host, port, name) in selected:
+                by_peer.setdefault((host, port), []).append(name)
+            holders = {}
+            for _, payload in self.remote_model.rows:
+                if payload:
+                    holders.setdefault(payload[2], []).append(payload[0])
+            requests = [(host, port, names, holders) for (host, port), names in by_peer.items()]
+        else:
+            host = self.get_selected_peer()
+            if not host:
+                QMessageBox.warning(self, "Attention", "Sélectionnez un pair.")
+                return
+            port = None
+            filenames = [text for text, _ in selected]
+            peers = [self.peers_list.item(i).text() for i in range(self.peers_list.count())]
+            requests = [(host, port, filenames, {name: peers for name in filenames})] if filenames else []
+        if not requests:
+            QMessageBox.warning(self, "Attention", "Sélectionnez un ou plusieurs fichiers distants.")
             return
-        row = self.remote_files_list.currentRow()
-        if row < 0:
-            QMessageBox.warning(self, "Attention", "Sélectionnez un fichier distant.")
+        # Un fichier seul : téléchargement par segments depuis tous ses pairs ; plusieurs
+        # fichiers : un seul flux (GET_MANY) depuis le pair choisi
+        for host, port, filenames, holders in requests:
+            try:
+                if len(filenames) == 1:
+                    item = client.call("download", host=host, name=filenames[0], port=port,
+                                       holders=holders.get(filenames[0], []))
+                else:
+                    item = client.call("enqueue", host=host, names=filenames, port=port)
+            except ControlError as e:
+                self.log(f"[!] {e}")
+                continue
+            self.log(f"Ajouté à la file : {item['label']}")
+
+    # Appliquer une action de la file (opération du démon) à l'élément sélectionné
+    def control_download(self, op, **params):
+        row = self.downloads_table.currentRow()
+        item_id = next((i for i, (r, _) in self.download_rows.items() if r == row), None)
+        if item_id is None:
+            QMessageBox.warning(self, "Attention", "Sélectionnez un téléchargement.")
             return
-        filename = self.remote_files_list.item(row).text()
-        self.progress.setValue(0)
-        self.progress_label.setText("Téléchargement en cours...")
-        self.download_btn.setEnabled(False)
-        self.thread = DownloadThread(host, port, filename)
-        self.thread.progress.connect(self.on_progress)
-        self.thread.finished.connect(self.on_download_finished)
-        self.thread.start()
-
-    def on_progress(self, bytes_received, speed):
-        self.progress.setValue(min(100, int(bytes_received / 1024)))
-        self.progress_label.setText(f"{bytes_received/1024:.1f} Ko reçus | {speed:.1f} Ko/s")
-
-    def on_download_finished(self, success, msg):
-        self.progress_label.setText("")
-        self.progress.setValue(0)
-        self.download_btn.setEnabled(True)
-        self.log(msg)
-        if success:
-            self.refresh_local_files()
+        if not client.call(op, item_id=item_id, **params):
+            self.log("Action impossible pour ce téléchargement.")
 
-if __name__ == "__main__":
-    os.makedirs(shared_dir, exist_ok=True)
-    PeerServer().start()
-    MulticastResponder().start()
+    # Relevé périodique des changements de la file (dernier état de chaque élément)
+    def refresh_downloads(self):
+        items = self.download_updates.take()
+        if not items:
+            return
+        for item in items:
+            self.on_download_changed(item)
+        self.update_total_progress()
+
+    # Changement d'état d'un élément de la file : une ligne par élément, avec sa barre
+    # de progression (pourcentage de la taille connue, octets reçus sinon)
+    def on_download_changed(self, item):
+        row, previous = self.download_rows.get(item["id"], (None, None))
+        if row is None:
+            row = self.downloads_table.rowCount()
+            self.downloads_table.insertRow(row)
+            for column in (0, 1, 3, 4):
+                self.downloads_table.setItem(row, column, QTableWidgetItem())
+            bar = QProgressBar()
+            bar.setMaximum(100)
+            self.downloads_table.setCellWidget(row, 2, bar)
+        self.downloads_table.item(row, 0).setText(f"{item['id']}. {item['label']}")
+        self.downloads_table.item(row, 1).setText(STATE_NAMES[item["state"]])
+        speed = item["speed"] if item["state"] == RUNNING else 0
+        self.downloads_table.item(row, 3).setText(f"{speed/1024:.1f} Ko/s" if speed else "")
+        self.downloads_table.item(row, 4).setText(str(PRIORITY_NAMES.get(item["priority"], item["priority"])))
+        bar = self.downloads_table.cellWidget(row, 2)
+        percent = download_percent(item)
+        bar.setValue(percent or 0)
+        bar.setFormat("%p%" if percent is not None else f"{item['received']/1024:.1f} Ko")
+        self.download_rows[item["id"]] = (row, item["state"])
+        self.download_items[item["id"]] = item
+        if previous != item["state"]:
+            if item["state"] == DONE:
+                self.log(item["message"])
+                self.refresh_local_files()
+            elif item["error"] and previous == RUNNING:
+                self.log(f"[!] {item['label']}: {item['error']}")
+
+    # Barre de progression : ensemble des téléchargements en cours
+    def update_total_progress(self):
+        running = [item for item in self.download_items.values() if item["state"] == RUNNING]
+        received = sum(item["received"] for item in running)
+        size = sum(item["size"] or 0 for item in running)
+        speed = sum(item["speed"] for item in running)
+        self.progress.setValue(int(received * 100 / size) if size else 0)
+        self.progress_label.setText(
+            f"{len(running)} téléchargement(s) en cours | {received/1024:.1f} Ko | {speed/1024:.1f} Ko/s"
+            if running else "")
+
+def main():
+    global config, client
+    config = load_config()
+    client = attach(config)
     app = QApplication([])
     window = P2PGuiQt()
     window.show()
-    app.exec()
\ No newline at end of file
+    app.exec()
+    window.tasks.shutdown()
+    window.unsubscribe()
+    client.close()
+
+if __name__ == "__main__":
+    main()
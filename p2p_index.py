@@ -0,0 +1,375 @@
+import bisect
+import ctypes
+import ctypes.util
+import fnmatch
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from p2p_bloom import BloomFilter
+from p2p_chunks import Manifest, get_dedup_chunk_size, hash_chunks
+from p2p_transfer import is_partial_file
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_HASH_WORKERS = 2
+DEFAULT_POLL_INTERVAL = 5
+
+# Constantes inotify (linux/inotify.h)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE
+              | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Surveillance d'une arborescence via inotify (Linux uniquement, chargé par ctypes)
+class InotifyWatcher:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.watches = {}
+
+    @classmethod
+    def available(cls):
+        if not sys.platform.startswith("linux"):
+            return False
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"))
+            return hasattr(libc, "inotify_init1")
+        except OSError:
+            return False
+
+    def add_watch(self, path, rel_dir):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = rel_dir
+
+    # Lire le prochain lot d'événements : liste de (dossier relatif, nom, masque)
+    def read_events(self):
+        data = os.read(self.fd, 64 * 1024)
+        events = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            events.append((self.watches.get(wd), name, mask))
+        return events
+
+# Fonction de recherche d'un motif dans un nom relatif, sans tenir compte de la casse :
+# motif glob ("*.iso") comparé au chemin complet et au nom seul, sinon sous-chaîne
+def name_matcher(pattern):
+    pattern = pattern.lower()
+    if any(c in pattern for c in "*?["):
+        return lambda rel: (fnmatch.fnmatchcase(rel.lower(), pattern)
+                            or fnmatch.fnmatchcase(rel.rsplit("/", 1)[-1].lower(), pattern))
+    return lambda rel: pattern in rel.lower()
+
+# Index en mémoire du dossier partagé (sous-dossiers compris)
+#
+# Chaque fichier est décrit par sa taille, sa date de modification, son SHA-256 et
+# les empreintes de ses blocs (voir p2p_chunks).
+# L'index est construit une fois au démarrage puis tenu à jour de façon incrémentale :
+# par inotify quand il est disponible, sinon en comparant périodiquement les dates
+# de modification. Les sommes de contrôle sont calculées par un pool de threads en
+# arrière-plan (None tant qu'elles ne sont pas prêtes), si bien que l'ajout d'un gros
+# fichier ne retarde pas les réponses. Les corps des réponses LIST_FILES et
+# LIST_FILES_V2 sont mis en cache et reconstruits seulement après un changement.
+class SharedIndex:
+    def __init__(self, shared_dir, config):
+        self.shared_dir = os.path.abspath(shared_dir)
+        self.config = config
+        self.poll_interval = float(config.get("index_poll_interval", DEFAULT_POLL_INTERVAL))
+        self.use_inotify = bool(config.get("index_use_inotify", True)) and InotifyWatcher.available()
+        self.hasher = ThreadPoolExecutor(max_workers=int(config.get("index_hash_workers", DEFAULT_HASH_WORKERS)))
+        self.chunk_size = get_dedup_chunk_size(config)
+        self.lock = threading.Lock()
+        # Chemin relatif (séparateur "/") -> {"size", "mtime", "mtime_ns", "sha256", "chunks", "root"}
+        self.entries = {}
+        # Empreinte d'un bloc -> (chemin relatif, numéro du bloc) ; les entrées périmées
+        # sont ignorées à la lecture (voir find_chunk)
+        self.chunk_map = {}
+        self.generation = 0
+        self.cache = {}
+        # Noms triés (pagination), recalculés seulement quand des fichiers sont
+        # ajoutés ou supprimés
+        self.sorted_names = None
+        self.started = False
+
+    # Construire l'index puis lancer sa mise à jour en arrière-plan
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        os.makedirs(self.shared_dir, exist_ok=True)
+        watcher = InotifyWatcher() if self.use_inotify else None
+        self.scan(watcher=watcher)
+        target = self._inotify_loop if watcher else self._poll_loop
+        threading.Thread(target=target, args=(watcher,) if watcher else (), daemon=True).start()
+
+    def _abs(self, rel):
+        return os.path.join(self.shared_dir, *rel.split("/"))
+
+    # Parcourir l'arborescence (ou un sous-dossier) et synchroniser l'index
+    def scan(self, rel_dir="", watcher=None):
+        seen = set()
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            path = self._abs(current) if current else self.shared_dir
+            if watcher:
+                watcher.add_watch(path, current)
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        rel = f"{current}/{entry.name}" if current else entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(rel)
+                            elif entry.is_file() and not is_partial_file(entry.name):
+                                seen.add(rel)
+                                self._update(rel, entry.stat())
+                        except OSError:
+                            continue
+            except OSError:
+                continue
+        prefix = f"{rel_dir}/" if rel_dir else ""
+        with self.lock:
+            removed = [rel for rel in self.entries if rel.startswith(prefix) and rel not in seen]
+        for rel in removed:
+            self.remove(rel)
+
+    # Mettre à jour l'entrée d'un fichier ; le hachage est relancé si le fichier a changé
+    def _update(self, rel, st, schedule_hash=True):
+        with self.lock:
+            current = self.entries.get(rel)
+            if current and current["size"] == st.st_size and current["mtime_ns"] == st.st_mtime_ns:
+                return
+            self.entries[rel] = {"size": st.st_size, "mtime": st.st_mtime, "mtime_ns": st.st_mtime_ns,
+                                 "sha256": None, "chunks": None, "root": None}
+            if current is None:
+                self.sorted_names = None
+            self._changed()
+        if schedule_hash:
+            self.hasher.submit(self._hash, rel, st.st_size, st.st_mtime_ns)
+
+    def update_file(self, rel):
+        if is_partial_file(rel.rsplit("/", 1)[-1]):
+            return
+        try:
+            st = os.stat(self._abs(rel))
+        except OSError:
+            self.remove(rel)
+            return
+        if os.path.isfile(self._abs(rel)):
+            self._update(rel, st)
+
+    def remove(self, rel):
+        with self.lock:
+            if self.entries.pop(rel, None) is not None:
+                self.sorted_names = None
+                self._changed()
+
+    def remove_tree(self, rel_dir):
+        prefix = f"{rel_dir}/"
+        with self.lock:
+            for rel in [r for r in self.entries if r.startswith(prefix)]:
+                del self.entries[rel]
+            self.sorted_names = None
+            self._changed()
+
+    # À appeler avec le verrou : invalide les réponses mises en cache
+    def _changed(self):
+        self.generation += 1
+        self.cache = {}
+
+    # Calculer le SHA-256 et les empreintes des blocs d'un fichier (une seule lecture)
+    def _hash(self, rel, size, mtime_ns):
+        try:
+            checksum, digests = hash_chunks(self._abs(rel), self.chunk_size)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(rel)
+            # Le fichier a pu changer pendant le calcul : résultat ignoré dans ce cas
+            if entry and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+                entry["sha256"] = checksum
+                entry["chunks"] = digests
+                entry["root"] = Manifest(size, self.chunk_size, digests).root
+                for n, digest in enumerate(digests):
+                    self.chunk_map[digest] = (rel, n)
+                self._changed()
+        return checksum, digests
+
+    # Manifeste à jour d'un fichier indexé (calculé immédiatement s'il ne l'est pas encore)
+    # renvoie (manifeste, sha256, métadonnées) ou None
+    def manifest(self, rel):
+        path = self._abs(rel)
+        if not os.path.isfile(path) or is_partial_file(os.path.basename(path)):
+            return None
+        st = os.stat(path)
+        entry = self.get(rel)
+        if entry is None or not entry["chunks"] or (entry["size"], entry["mtime_ns"]) != (st.st_size, st.st_mtime_ns):
+            self._update(rel, st, schedule_hash=False)
+            result = self._hash(rel, st.st_size, st.st_mtime_ns)
+            if result is None:
+                return None
+            entry = self.get(rel)
+            if entry is None:
+                return None
+            entry["sha256"], entry["chunks"] = result
+        return Manifest(entry["size"], self.chunk_size, entry["chunks"]), entry["sha256"], entry
+
+    # Emplacement (chemin absolu, offset, longueur) d'un bloc partagé, ou None
+    def find_chunk(self, digest):
+        with self.lock:
+            location = self.chunk_map.get(digest)
+            if location is None:
+                return None
+            rel, n = location
+            entry = self.entries.get(rel)
+            if not entry or not entry["chunks"] or n >= len(entry["chunks"]) or entry["chunks"][n] != digest:
+                del self.chunk_map[digest]
+                return None
+            offset = n * self.chunk_size
+            return self._abs(rel), offset, min(self.chunk_size, entry["size"] - offset)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            self.scan()
+
+    def _inotify_loop(self, watcher):
+        while True:
+            try:
+                events = watcher.read_events()
+            except OSError:
+                time.sleep(self.poll_interval)
+                continue
+            for rel_dir, name, mask in events:
+                if mask & IN_Q_OVERFLOW:
+                    # Événements perdus : resynchronisation complète
+                    self.scan(watcher=watcher)
+                    continue
+                if rel_dir is None or not name:
+                    continue
+                rel = f"{rel_dir}/{name}" if rel_dir else name
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.scan(rel, watcher)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.remove_tree(rel)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.remove(rel)
+                else:
+                    self.update_file(rel)
+
+    # Métadonnées d'un fichier (copie) ou None s'il n'est pas indexé
+    def get(self, rel):
+        with self.lock:
+            entry = self.entries.get(rel)
+            return dict(entry) if entry else None
+
+    def names(self):
+        with self.lock:
+            return sorted(self.entries)
+
+    # Corps de réponse mis en cache pour la génération courante de l'index
+    def _cached(self, key, build):
+        with self.lock:
+            body = self.cache.get(key)
+            if body is None:
+                body = self.cache[key] = build()
+            return body
+
+    # Corps de LIST_FILES : un nom (relatif) par ligne
+    def list_body(self):
+        return self._cached("names", lambda: ("\n".join(sorted(self.entries)) + "\n").encode())
+
+    # Fichiers dont le nom correspond au motif (au plus limit) : liste de
+    # dictionnaires comme LIST_FILES_V2, et indicateur de résultats tronqués
+    def search(self, pattern, limit):
+        match = name_matcher(pattern)
+        with self.lock:
+            found = []
+            for rel in sorted(self.entries):
+                if match(rel):
+                    if len(found) == limit:
+                        return found, True
+                    e = self.entries[rel]
+                    found.append({"name": rel, "size": e["size"], "mtime": e["mtime"], "sha256": e["sha256"]})
+            return found, False
+
+    # Page de la liste des fichiers : au plus limit entrées dont le nom suit after
+    # (ordre alphabétique) et qui passent les filtres (préfixe du chemin, tailles
+    # minimale et maximale, date de modification minimale). Renvoie les entrées et le
+    # curseur de la page suivante (None à la fin de la liste)
+    def page(self, after="", limit=1000, prefix="", min_size=None, max_size=None, since=None):
+        found = []
+        with self.lock:
+            if self.sorted_names is None:
+                self.sorted_names = sorted(self.entries)
+            names = self.sorted_names
+            start = bisect.bisect_right(names, after) if after else 0
+            if prefix:
+                start = max(start, bisect.bisect_left(names, prefix))
+            for i in range(start, len(names)):
+                rel = names[i]
+                if prefix and not rel.startswith(prefix):
+                    return found, None
+                e = self.entries.get(rel)
+                if (e is None or (min_size is not None and e["size"] < min_size)
+                        or (max_size is not None and e["size"] > max_size)
+                        or (since is not None and e["mtime"] < since)):
+                    continue
+                found.append({"name": rel, "size": e["size"], "mtime": e["mtime"], "sha256": e["sha256"]})
+                if len(found) == limit:
+                    return found, rel
+        return found, None
+
+    # Empreinte courte du contenu de l'index (noms, tailles, dates) : change dès qu'un
+    # fichier est ajouté, supprimé ou modifié
+    def digest(self):
+        def build():
+            h = hashlib.blake2b(digest_size=8)
+            for rel, e in sorted(self.entries.items()):
+                h.update(f"{rel}\0{e['size']}\0{e['mtime_ns']}\n".encode())
+            return h.hexdigest()
+        return self._cached("digest", build)
+
+    # Filtre de Bloom des noms partagés (annoncé lors de la découverte)
+    def bloom(self):
+        def build():
+            bloom = BloomFilter()
+            for rel in self.entries:
+                bloom.add(rel)
+            return bloom.to_bytes()
+        return self._cached("bloom", build)
+
+    # Corps de LIST_FILES_V2 : document JSON avec les métadonnées de chaque fichier
+    def list_body_v2(self):
+        def build():
+            files = [{"name": rel, "size": e["size"], "mtime": e["mtime"], "sha256": e["sha256"], "root": e["root"]}
+                     for rel, e in sorted(self.entries.items())]
+            return json.dumps({"generation": self.generation, "files": files}).encode()
+        return self._cached("v2", build)
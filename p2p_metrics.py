@@ -0,0 +1,301 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_METRICS_HTTP_HOST = "127.0.0.1"
+# Bornes (en secondes) des histogrammes de latence
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+# Nombre de lignes des rapports de profilage
+REPORT_LINES = 30
+
+# Histogramme cumulatif (format Prometheus : nombre d'observations <= chaque borne)
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    # Nombres cumulés par borne, puis +Inf
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            result.append((bound, total))
+        result.append(("+Inf", self.count))
+        return result
+
+    # Quantile estimé (borne supérieure du premier intervalle qui l'atteint)
+    def quantile(self, q):
+        if not self.count:
+            return None
+        target = q * self.count
+        for bound, total in self.cumulative():
+            if total >= target:
+                return bound if bound != "+Inf" else self.buckets[-1]
+        return None
+
+    def to_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "p50": self.quantile(0.5),
+                "p99": self.quantile(0.99)}
+
+# Mesures du processus : compteurs et histogrammes étiquetés, jauges calculées
+#
+# Une mesure est identifiée par son nom et ses étiquettes (peer, command...) ; les
+# jauges sont des fonctions évaluées à la lecture (requêtes en cours...). Le coût
+# d'un ajout est celui d'un verrou et d'un accès à un dictionnaire : les points de
+# mesure des transferts sont appelés par bloc, jamais par octet.
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def add(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    # Jauge : fn() renvoie la valeur courante (remplace une jauge de même nom)
+    def gauge(self, name, fn):
+        with self.lock:
+            self.gauges[name] = fn
+
+    def _gauge_values(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+        values = {}
+        for name, fn in gauges.items():
+            try:
+                values[name] = fn()
+            except Exception:
+                values[name] = None
+        return values
+
+    # Toutes les mesures au format JSON (commande STATS)
+    def snapshot(self):
+        gauges = self._gauge_values()
+        with self.lock:
+            counters = {name: [dict(key, value=round(value, 6)) for key, value in series.items()]
+                        for name, series in self.counters.items()}
+            histograms = {name: [dict(key, **histogram.to_dict()) for key, histogram in series.items()]
+                          for name, series in self.histograms.items()}
+        return {"uptime": round(time.time() - self.started, 3), "gauges": gauges, "counters": counters,
+                "histograms": histograms}
+
+    # Toutes les mesures au format texte de Prometheus
+    def prometheus(self):
+        gauges = self._gauge_values()
+        lines = []
+        with self.lock:
+            for name, value in sorted(gauges.items()):
+                if value is None:
+                    continue
+                self._header(lines, name, "gauge")
+                lines.append(f"{name} {value}")
+            for name, series in sorted(self.counters.items()):
+                self._header(lines, name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                self._header(lines, name, "histogram")
+                for key, histogram in series.items():
+                    for bound, total in histogram.cumulative():
+                        lines.append(f"{name}_bucket{_labels(key + (('le', bound),))} {total}")
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self.help:
+            lines.append(f"# HELP {name} {self.help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+def _labels(key):
+    if not key:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in key) + "}"
+
+# Profilage à la demande (cProfile), activable et désactivable pendant l'exécution
+#
+# cProfile ne suit que le thread qui l'active : call() profile une requête dans son
+# thread, follow() profile en continu le thread qui l'appelle (boucle asyncio). Les
+# profils sont fusionnés dans un seul rapport. Sans profilage actif, call() se réduit
+# à un test.
+class RuntimeProfiler:
+    def __init__(self):
+        self.active = False
+        self.stats = None
+        self.thread_profiles = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.active = True
+            self.stats = None
+
+    # Arrêter le profilage ; renvoie le rapport
+    def stop(self):
+        self.active = False
+        return self.report()
+
+    def call(self, fn, *args):
+        if not self.active:
+            return fn(*args)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Autre profileur déjà actif dans ce thread
+            return fn(*args)
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+            self._merge(profile)
+
+    def follow(self):
+        thread_id = threading.get_ident()
+        profile = self.thread_profiles.get(thread_id)
+        if self.active and profile is None:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return
+            self.thread_profiles[thread_id] = profile
+        elif not self.active and profile is not None:
+            profile.disable()
+            del self.thread_profiles[thread_id]
+            self._merge(profile)
+
+    def _merge(self, profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+
+    # Fonctions les plus coûteuses (temps cumulé) ; le profil d'un thread suivi par
+    # follow() n'y figure qu'après son prochain appel
+    def report(self, limit=REPORT_LINES):
+        with self.lock:
+            if self.stats is None:
+                return "Aucun profil enregistré.\n"
+            out = io.StringIO()
+            self.stats.stream = out
+            self.stats.sort_stats("cumulative").print_stats(limit)
+            return out.getvalue()
+
+# Suivi des allocations mémoire (tracemalloc), activable pendant l'exécution
+class MemoryTracer:
+    def start(self, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def stop(self):
+        tracemalloc.stop()
+
+    # Lignes de code ayant alloué le plus de mémoire encore utilisée
+    def report(self, limit=REPORT_LINES):
+        if not tracemalloc.is_tracing():
+            return "tracemalloc inactif.\n"
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Mémoire suivie: {current/1024:.1f} Ko (pic {peak/1024:.1f} Ko)"]
+        for stat in tracemalloc.take_snapshot().statistics("lineno")[:limit]:
+            lines.append(str(stat))
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+profiler = RuntimeProfiler()
+memory_tracer = MemoryTracer()
+
+# Point d'accès HTTP local
+#
+# GET /metrics (texte Prometheus), GET /stats (JSON), GET /debug/profile et
+# GET /debug/tracemalloc (rapports) ; POST /debug/profile/start|stop et
+# /debug/tracemalloc/start|stop activent ou arrêtent le profilage. Il n'écoute que sur
+# metrics_http_host (boucle locale par défaut) : le profilage n'est pas exposé au réseau.
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        routes = {
+            "/metrics": lambda: (metrics.prometheus(), "text/plain; version=0.0.4"),
+            "/stats": lambda: (json.dumps(metrics.snapshot()), "application/json"),
+            "/debug/profile": lambda: (profiler.report(), "text/plain"),
+            "/debug/tracemalloc": lambda: (memory_tracer.report(), "text/plain"),
+        }
+        self._reply(routes)
+
+    def do_POST(self):
+        routes = {
+            "/debug/profile/start": lambda: (profiler.start() or "Profilage démarré.\n", "text/plain"),
+            "/debug/profile/stop": lambda: (profiler.stop(), "text/plain"),
+            "/debug/tracemalloc/start": lambda: (memory_tracer.start() or "tracemalloc démarré.\n", "text/plain"),
+            "/debug/tracemalloc/stop": lambda: (memory_tracer.stop() or "tracemalloc arrêté.\n", "text/plain"),
+        }
+        self._reply(routes)
+
+    def _reply(self, routes):
+        route = routes.get(self.path.split("?", 1)[0])
+        if route is None:
+            self.send_error(404)
+            return
+        body, content_type = route()
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Démarrer le point d'accès HTTP si metrics_http_port est configuré ; renvoie le
+# serveur HTTP (ou None)
+def start_http_endpoint(config):
+    port = int(config.get("metrics_http_port", 0) or 0)
+    if not port:
+        return None
+    host = config.get("metrics_http_host", DEFAULT_METRICS_HTTP_HOST)
+    try:
+        httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        print(f"[!] Point d'accès des mesures indisponible sur {host}:{port}: {e}")
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    print(f"[+] Mesures disponibles sur http://{host}:{port}/metrics")
+    return httpd
@@ -0,0 +1,610 @@
+import json
+import math
+import os
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from p2p_discovery import MULTICAST_GROUP
+from p2p_metrics import metrics
+from p2p_shaping import TokenBucket
+from p2p_transfer import PART_SUFFIX, preallocate, pwrite, resolve_shared_path, sha256_file
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_MULTICAST_DATA_PORT = 9998
+DEFAULT_MULTICAST_BLOCK_SIZE = 1400
+DEFAULT_MULTICAST_RATE = 4 * 1024 * 1024
+DEFAULT_MULTICAST_MAX_RATE = 100 * 1024 * 1024
+DEFAULT_MULTICAST_LOSS_THRESHOLD = 0.05
+DEFAULT_MULTICAST_JOIN_WAIT = 1.0
+DEFAULT_MULTICAST_TTL = 1
+# Contrôle du débit (AIMD) : réévalué toutes les RATE_INTERVAL secondes d'après les
+# pertes signalées par le récepteur le plus en difficulté
+MIN_RATE = 64 * 1024
+RATE_INTERVAL = 0.2
+RATE_DECREASE = 0.7
+RATE_INCREASE = 0.1
+# Lissage (moyenne exponentielle) des pertes signalées par chaque récepteur
+LOSS_SMOOTHING = 0.25
+PACING_BURST_BLOCKS = 16
+# Retours des récepteurs et réparations
+FEEDBACK_INTERVAL = 0.1
+ANNOUNCE_INTERVAL = 0.5
+END_INTERVAL = 0.2
+REPAIR_HOLDOFF = 0.2
+REPAIR_MULTICAST_MIN = 2
+NACK_SLACK = 32
+MAX_NACK_RANGES = 64
+MAX_NACK_BLOCKS = 2048
+# Attente des récepteurs annoncés (receivers), fin sans nouvelles des récepteurs,
+# abandon d'une réception sans paquet, conservation d'une réception terminée
+JOIN_TIMEOUT = 10.0
+LINGER_TIMEOUT = 3.0
+RECEIVE_TIMEOUT = 15.0
+DONE_LINGER = 30.0
+SOCKET_BUFFER = 4 * 1024 * 1024
+MAX_DATAGRAM = 65535
+PROGRESS_INTERVAL = 0.5
+
+# Datagrammes du canal de données : en-tête (MAGIC, type, session, numéro) puis
+# - ANNOUNCE (émetteur -> groupe) : description JSON du fichier (nom, taille, taille
+#   de bloc, nombre de blocs, SHA-256), répétée pendant toute la session ;
+# - DATA (émetteur -> groupe, ou -> un récepteur pour une réparation) : bloc numéro seq ;
+# - END (émetteur -> groupe) : tous les blocs ont été envoyés une fois ;
+# - FEEDBACK (récepteur -> émetteur) : JSON avec les blocs reçus, la perte mesurée
+#   depuis le retour précédent, les plages de blocs manquants (NACK) et la fin.
+MAGIC = b"P2PM"
+HEADER = struct.Struct("!4sBII")
+ANNOUNCE = 1
+DATA = 2
+END = 3
+FEEDBACK = 4
+
+# Sessions émises par ce processus -> fichier diffusé : un récepteur du processus
+# n'écrit pas sur le fichier qu'on lui diffuse
+local_sessions = {}
+
+def pack(kind, session, seq=0, payload=b""):
+    return HEADER.pack(MAGIC, kind, session, seq) + payload
+
+def unpack(datagram):
+    if len(datagram) < HEADER.size:
+        return None
+    magic, kind, session, seq = HEADER.unpack_from(datagram)
+    if magic != MAGIC:
+        return None
+    return kind, session, seq, memoryview(datagram)[HEADER.size:]
+
+def configure_multicast(sock, config):
+    interface = config.get("multicast_interface")
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                    struct.pack('b', int(config.get("multicast_ttl", DEFAULT_MULTICAST_TTL))))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    if interface:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+def set_buffers(sock):
+    for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, SOCKET_BUFFER)
+        except OSError:
+            pass
+
+# Plages [début, fin) des blocs absents de have avant limit (au plus MAX_NACK_RANGES
+# plages et MAX_NACK_BLOCKS blocs)
+def missing_ranges(have, limit):
+    ranges = []
+    total = 0
+    start = have.find(0, 0, limit)
+    while start != -1 and len(ranges) < MAX_NACK_RANGES and total < MAX_NACK_BLOCKS:
+        end = have.find(1, start, limit)
+        end = limit if end == -1 else end
+        end = min(end, start + MAX_NACK_BLOCKS - total)
+        ranges.append([start, end])
+        total += end - start
+        start = have.find(0, end, limit)
+    return ranges
+
+# État d'un récepteur vu par l'émetteur (d'après ses retours)
+class ReceiverState:
+    def __init__(self):
+        self.received = 0
+        self.loss = 0.0
+        self.max_loss = 0.0
+        self.loss_reported = False
+        self.done = False
+        self.error = None
+        self.last_seen = time.monotonic()
+
+# Diffusion d'un fichier à tous les récepteurs du groupe en une seule émission
+#
+# Chaque bloc est envoyé une fois au groupe multicast (data_port), à un débit régulé :
+# le débit augmente tant que les récepteurs ne signalent pas plus de
+# multicast_loss_threshold de pertes, et diminue (x RATE_DECREASE) dès que l'un
+# d'eux en signale davantage. Les blocs signalés manquants (NACK) sont renvoyés en
+# priorité : au groupe si plusieurs récepteurs les demandent, sinon au seul récepteur
+# concerné (unicast). Après le dernier bloc, END est répété jusqu'à ce que tous les
+# récepteurs connus aient terminé, ou qu'ils ne donnent plus de nouvelles.
+class MulticastSender:
+    def __init__(self, config, path, name=None, rate=None, receivers=0, timeout=None):
+        self.config = config
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.block_size = int(config.get("multicast_block_size", DEFAULT_MULTICAST_BLOCK_SIZE))
+        self.blocks = math.ceil(self.size / self.block_size)
+        self.group = (MULTICAST_GROUP, int(config.get("multicast_data_port", DEFAULT_MULTICAST_DATA_PORT)))
+        self.max_rate = float(config.get("multicast_max_rate", DEFAULT_MULTICAST_MAX_RATE))
+        self.rate = min(self.max_rate, float(rate or config.get("multicast_rate", DEFAULT_MULTICAST_RATE)))
+        self.loss_threshold = float(config.get("multicast_loss_threshold", DEFAULT_MULTICAST_LOSS_THRESHOLD))
+        self.join_wait = float(config.get("multicast_join_wait", DEFAULT_MULTICAST_JOIN_WAIT))
+        self.expected = receivers
+        self.timeout = timeout
+        self.session = random.getrandbits(32)
+        self.receivers = {}
+        # Réparations à envoyer : bloc -> récepteurs qui le demandent
+        self.pending = {}
+        self.last_repair = {}
+        self.counts = {"data": 0, "repair_multicast": 0, "repair_unicast": 0, "nacks": 0}
+        self.bucket = TokenBucket(self.rate, PACING_BURST_BLOCKS * self.block_size)
+        self.rate_checked = time.monotonic()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        configure_multicast(self.sock, config)
+        set_buffers(self.sock)
+        self.sock.bind(("", 0))
+        self.fd = None
+        self.announcement = None
+        self.sent_bytes = 0
+        self.started = None
+        self.progress = None
+        self.progress_sent = 0.0
+        self.stopped = threading.Event()
+
+    def description(self):
+        return json.dumps({"name": self.name, "size": self.size, "block_size": self.block_size,
+                           "blocks": self.blocks, "sha256": sha256_file(self.path)}).encode()
+
+    # Diffuser le fichier ; progress(état) est appelé toutes les PROGRESS_INTERVAL
+    # secondes. Renvoie le rapport final (voir report)
+    def run(self, progress=None):
+        self.progress = progress
+        self.started = time.monotonic()
+        local_sessions[self.session] = os.path.abspath(self.path)
+        self.announcement = pack(ANNOUNCE, self.session, 0, self.description())
+        self.fd = os.open(self.path, os.O_RDONLY)
+        try:
+            self._join()
+            next_announce = time.monotonic() + ANNOUNCE_INTERVAL
+            for seq in range(self.blocks):
+                if self._expired():
+                    break
+                while self.pending and not self._expired():
+                    self._send_repair()
+                self._send_block(seq, self.group)
+                self.counts["data"] += 1
+                if time.monotonic() >= next_announce:
+                    # Récepteurs arrivés en cours de route
+                    self.sock.sendto(self.announcement, self.group)
+                    next_announce = time.monotonic() + ANNOUNCE_INTERVAL
+            self._finish()
+        finally:
+            local_sessions.pop(self.session, None)
+            os.close(self.fd)
+            self.sock.close()
+        report = self.report()
+        for kind, count in self.counts.items():
+            metrics.add("p2p_multicast_packets_sent_total", count, kind=kind)
+        metrics.add("p2p_multicast_bytes_sent_total", self.sent_bytes)
+        if self.progress is not None:
+            self.progress(report)
+        return report
+
+    def stop(self):
+        self.stopped.set()
+
+    # Annoncer la session et attendre les premiers récepteurs
+    def _join(self):
+        deadline = time.monotonic() + self.join_wait
+        while not self._expired():
+            now = time.monotonic()
+            if now >= deadline and (len(self.receivers) >= self.expected or now >= deadline + JOIN_TIMEOUT):
+                return
+            self.sock.sendto(self.announcement, self.group)
+            self._wait(ANNOUNCE_INTERVAL / 5)
+
+    # Réparer jusqu'à ce que tous les récepteurs connus aient terminé
+    def _finish(self):
+        next_end = 0.0
+        last_news = time.monotonic()
+        while not self._expired():
+            active = [state for state in self.receivers.values() if not state.done and not state.error]
+            if self.receivers and not active and len(self.receivers) >= self.expected:
+                return
+            if self.pending:
+                self._send_repair()
+                continue
+            now = time.monotonic()
+            if now >= next_end:
+                self.sock.sendto(pack(END, self.session, self.blocks), self.group)
+                next_end = now + END_INTERVAL
+            latest = max((state.last_seen for state in self.receivers.values()), default=self.started)
+            last_news = max(last_news, latest)
+            if now - last_news > LINGER_TIMEOUT:
+                return
+            self._wait(next_end - now, repairs=True)
+
+    def _expired(self):
+        return self.stopped.is_set() or (self.timeout is not None and time.monotonic() - self.started > self.timeout)
+
+    def _send_block(self, seq, address):
+        data = os.pread(self.fd, self.block_size, seq * self.block_size)
+        delay = self.bucket.reserve(len(data) + HEADER.size)
+        if delay > 0:
+            self._wait(delay)
+        self.sock.sendto(pack(DATA, self.session, seq, data), address)
+        self.sent_bytes += len(data)
+        self._update_rate()
+
+    # Renvoyer le plus ancien bloc demandé : au groupe s'il manque à plusieurs
+    # récepteurs (ou à la plupart), sinon à chacun de ceux qui le demandent
+    def _send_repair(self):
+        seq = next(iter(self.pending))
+        addresses = self.pending.pop(seq)
+        self.last_repair[seq] = time.monotonic()
+        if len(addresses) >= REPAIR_MULTICAST_MIN or len(addresses) * 2 > len(self.receivers):
+            self._send_block(seq, self.group)
+            self.counts["repair_multicast"] += 1
+        else:
+            for address in addresses:
+                self._send_block(seq, address)
+                self.counts["repair_unicast"] += 1
+
+    # Attendre (pacing, END) en traitant les retours des récepteurs ; repairs :
+    # s'arrêter dès qu'un bloc est à réparer
+    def _wait(self, delay, repairs=False):
+        deadline = time.monotonic() + max(0.0, delay)
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                readable, _, _ = select.select([self.sock], [], [], timeout)
+            except (OSError, ValueError):
+                return
+            if readable:
+                self._receive_feedback()
+            if time.monotonic() >= deadline or (repairs and self.pending):
+                return
+
+    def _receive_feedback(self):
+        while True:
+            try:
+                datagram, address = self.sock.recvfrom(MAX_DATAGRAM, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            message = unpack(datagram)
+            if message is None or message[0] != FEEDBACK or message[1] != self.session:
+                continue
+            try:
+                feedback = json.loads(bytes(message[3]))
+            except ValueError:
+                continue
+            self._handle_feedback(address, feedback)
+
+    def _handle_feedback(self, address, feedback):
+        state = self.receivers.get(address)
+        if state is None:
+            state = self.receivers[address] = ReceiverState()
+        state.last_seen = time.monotonic()
+        state.received = int(feedback.get("received", 0))
+        state.done = bool(feedback.get("done"))
+        state.error = feedback.get("error")
+        if "loss" in feedback:
+            loss = float(feedback["loss"])
+            state.loss += LOSS_SMOOTHING * (loss - state.loss)
+            state.loss_reported = True
+            state.max_loss = max(state.max_loss, loss)
+        now = time.monotonic()
+        ranges = feedback.get("missing") or []
+        if ranges:
+            self.counts["nacks"] += 1
+        for start, end in ranges:
+            for seq in range(max(0, int(start)), min(self.blocks, int(end))):
+                if now - self.last_repair.get(seq, 0.0) >= REPAIR_HOLDOFF:
+                    self.pending.setdefault(seq, set()).add(address)
+        self._report_progress()
+
+    # AIMD : pertes au-delà du seuil chez un récepteur -> débit réduit, sinon augmenté
+    def _update_rate(self):
+        now = time.monotonic()
+        if now - self.rate_checked < RATE_INTERVAL:
+            return
+        self.rate_checked = now
+        reported = [state.loss for state in self.receivers.values() if state.loss_reported]
+        if not reported:
+            return
+        if max(reported) > self.loss_threshold:
+            self.rate = max(MIN_RATE, self.rate * RATE_DECREASE)
+        else:
+            self.rate = min(self.max_rate, self.rate * (1 + RATE_INCREASE))
+        self.bucket.rate = self.rate
+        for state in self.receivers.values():
+            state.loss_reported = False
+        self._report_progress()
+
+    def _report_progress(self):
+        if self.progress is None or time.monotonic() - self.progress_sent < PROGRESS_INTERVAL:
+            return
+        self.progress_sent = time.monotonic()
+        self.progress(self.report())
+
+    # Rapport : débit courant, paquets envoyés par type et état de chaque récepteur
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        receivers = {f"{ip}:{port}": {"received": state.received, "done": state.done, "error": state.error,
+                                      "max_loss": round(state.max_loss, 4)}
+                     for (ip, port), state in self.receivers.items()}
+        return {"name": self.name, "size": self.size, "blocks": self.blocks, "elapsed": round(elapsed, 3),
+                "rate": round(self.rate), "sent": dict(self.counts), "bytes_sent": self.sent_bytes, "receivers": receivers,
+                "done": sum(1 for state in self.receivers.values() if state.done)}
+
+# Fichier en cours de réception : blocs écrits à leur place dans <nom>.part, table des
+# blocs reçus, pertes mesurées depuis le dernier retour
+class ReceiveSession:
+    def __init__(self, session, sender, info, path):
+        self.session = session
+        self.sender = sender
+        self.name = info["name"]
+        self.size = int(info["size"])
+        self.block_size = int(info["block_size"])
+        self.blocks = int(info["blocks"])
+        self.sha256 = info["sha256"]
+        self.path = path
+        self.part = path + PART_SUFFIX
+        self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        preallocate(self.fd, self.size)
+        self.have = bytearray(self.blocks)
+        self.count = 0
+        self.highest = -1
+        self.interval_received = 0
+        self.interval_lost = 0
+        self.ended = False
+        self.done = False
+        self.error = None
+        self.started = self.last_packet = time.monotonic()
+        self.finished = None
+
+    # Écrire un bloc ; True si c'était le dernier manquant
+    def on_data(self, seq, payload):
+        self.last_packet = time.monotonic()
+        if self.fd is None or seq >= self.blocks or self.have[seq]:
+            return False
+        if len(payload) != min(self.block_size, self.size - seq * self.block_size):
+            return False
+        pwrite(self.fd, payload, seq * self.block_size)
+        self.have[seq] = 1
+        self.count += 1
+        self.interval_received += 1
+        if seq > self.highest:
+            # Blocs sautés : perdus (sauf à l'arrivée en cours de session)
+            if self.highest >= 0:
+                self.interval_lost += seq - self.highest - 1
+            self.highest = seq
+        return self.count == self.blocks
+
+    # Retour pour l'émetteur : blocs reçus, perte depuis le retour précédent et blocs
+    # manquants (avant END, seulement ceux qui précèdent de NACK_SLACK le plus récent)
+    def feedback(self):
+        message = {"received": self.count, "done": self.done}
+        if self.error:
+            message["error"] = self.error
+        total = self.interval_received + self.interval_lost
+        if total:
+            message["loss"] = round(self.interval_lost / total, 4)
+            self.interval_received = self.interval_lost = 0
+        if self.fd is not None:
+            limit = self.blocks if self.ended else max(0, self.highest + 1 - NACK_SLACK)
+            ranges = missing_ranges(self.have, limit)
+            if ranges:
+                message["missing"] = ranges
+        return json.dumps(message, separators=(",", ":")).encode()
+
+    # Tous les blocs reçus : vérifier la somme de contrôle puis publier le fichier
+    def finish(self):
+        os.close(self.fd)
+        self.fd = None
+        self.finished = time.monotonic()
+        if sha256_file(self.part) != self.sha256:
+            self.error = "Somme de contrôle invalide"
+            os.remove(self.part)
+            return
+        os.replace(self.part, self.path)
+        self.done = True
+
+    def abandon(self, reason):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            try:
+                os.remove(self.part)
+            except OSError:
+                pass
+        self.finished = time.monotonic()
+        self.error = reason
+
+    def state(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {"session": self.session, "sender": self.sender[0], "name": self.name, "size": self.size,
+                "received": self.count, "blocks": self.blocks, "done": self.done, "error": self.error,
+                "elapsed": round(elapsed, 3)}
+
+# Réception des fichiers diffusés au groupe multicast (data_port), dans dest_dir
+#
+# Chaque annonce d'un émetteur ouvre une réception ; les retours (FEEDBACK_INTERVAL)
+# partent d'un socket propre au récepteur, auquel l'émetteur adresse ses réparations
+# unicast. Les fonctions enregistrées par add_listener reçoivent l'état d'une réception
+# terminée (done) ou échouée (error). loss (ou multicast_loss dans la configuration)
+# simule la perte d'une proportion des blocs reçus, pour les tests sur une machine.
+class MulticastReceiver(threading.Thread):
+    def __init__(self, config, dest_dir, loss=None):
+        super().__init__(daemon=True)
+        self.dest_dir = dest_dir
+        self.port = int(config.get("multicast_data_port", DEFAULT_MULTICAST_DATA_PORT))
+        self.interface = config.get("multicast_interface") or "0.0.0.0"
+        self.loss = float(config.get("multicast_loss", 0.0) if loss is None else loss)
+        self.sessions = {}
+        self.refused = set()
+        self.listeners = []
+        self.counts = {"received": 0, "dropped": 0}
+        self.running = threading.Event()
+        self.data_sock = self._listen_socket()
+        self.feedback_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.feedback_sock.bind(("", 0))
+        set_buffers(self.feedback_sock)
+
+    def _listen_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        set_buffers(sock)
+        try:
+            sock.bind((MULTICAST_GROUP, self.port))
+        except OSError:
+            sock.bind(('', self.port))
+        mreq = socket.inet_aton(MULTICAST_GROUP) + socket.inet_aton(self.interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        return sock
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    # Réceptions en cours et récentes
+    def snapshot(self):
+        return [session.state() for session in list(self.sessions.values())]
+
+    def run(self):
+        self.running.set()
+        os.makedirs(self.dest_dir, exist_ok=True)
+        next_feedback = time.monotonic() + FEEDBACK_INTERVAL
+        sockets = [self.data_sock, self.feedback_sock]
+        while self.running.is_set():
+            try:
+                readable, _, _ = select.select(sockets, [], [], max(0.0, next_feedback - time.monotonic()))
+            except (OSError, ValueError):
+                break
+            for sock in readable:
+                self._drain(sock)
+            if time.monotonic() >= next_feedback:
+                self._send_feedback()
+                next_feedback = time.monotonic() + FEEDBACK_INTERVAL
+        for session in list(self.sessions.values()):
+            if session.fd is not None:
+                session.abandon("Réception arrêtée")
+        metrics.add("p2p_multicast_packets_received_total", self.counts["received"])
+        metrics.add("p2p_multicast_packets_dropped_total", self.counts["dropped"])
+
+    def _drain(self, sock):
+        while True:
+            try:
+                datagram, address = sock.recvfrom(MAX_DATAGRAM, socket.MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            message = unpack(datagram)
+            if message is not None:
+                self._handle(address, *message)
+
+    def _handle(self, address, kind, session_id, seq, payload):
+        key = (address[0], session_id)
+        if key in self.refused:
+            return
+        session = self.sessions.get(key)
+        if kind == ANNOUNCE and session is None:
+            session = self._open(key, address, payload)
+            if session is not None and session.blocks == 0:
+                self._complete(session)
+        elif session is None:
+            return
+        elif kind == DATA:
+            if self.loss and random.random() < self.loss:
+                self.counts["dropped"] += 1
+                return
+            self.counts["received"] += 1
+            if session.on_data(seq, payload):
+                self._complete(session)
+        elif kind == END:
+            session.last_packet = time.monotonic()
+            # Fin d'émission : dernière liste des manques ; réception terminée :
+            # confirmation répétée (tant que l'émetteur répète END)
+            if not session.ended or session.finished is not None:
+                session.ended = True
+                self._feedback(session)
+        elif kind == ANNOUNCE:
+            session.last_packet = time.monotonic()
+
+    def _open(self, key, address, payload):
+        try:
+            info = json.loads(bytes(payload))
+            path = resolve_shared_path(self.dest_dir, info["name"])
+            if path is None:
+                raise ValueError(f"nom invalide: {info['name']!r}")
+            if local_sessions.get(key[1]) == path:
+                self.refused.add(key)
+                return None
+            session = ReceiveSession(key[1], address, info, path)
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            print(f"[!] Diffusion multicast de {address[0]} refusée: {e}")
+            self.refused.add(key)
+            return None
+        self.sessions[key] = session
+        print(f"[+] Réception multicast de {session.name} ({session.size} octets) depuis {address[0]}")
+        # Premier retour immédiat : l'émetteur compte ce récepteur
+        self._feedback(session)
+        return session
+
+    def _complete(self, session):
+        try:
+            session.finish()
+        except OSError as e:
+            session.abandon(str(e))
+        metrics.add("p2p_multicast_files_received_total", result="done" if session.done else "error")
+        self._feedback(session)
+        self._notify(session)
+
+    def _feedback(self, session):
+        try:
+            self.feedback_sock.sendto(pack(FEEDBACK, session.session, 0, session.feedback()), session.sender)
+        except OSError:
+            pass
+
+    # Retours périodiques ; réceptions sans paquet depuis RECEIVE_TIMEOUT abandonnées,
+    # réceptions terminées oubliées après DONE_LINGER
+    def _send_feedback(self):
+        now = time.monotonic()
+        for key, session in list(self.sessions.items()):
+            if session.finished is not None:
+                if now - session.finished > DONE_LINGER:
+                    del self.sessions[key]
+                continue
+            if now - session.last_packet > RECEIVE_TIMEOUT:
+                session.abandon("Émetteur silencieux")
+                self._notify(session)
+                continue
+            self._feedback(session)
+
+    def _notify(self, session):
+        state = session.state()
+        for callback in self.listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f"[!] Erreur de notification multicast: {e}")
+
+    def stop(self):
+        self.running.clear()
+        if self.is_alive():
+            self.join(timeout=2)
+        self.data_sock.close()
+        self.feedback_sock.close()
@@ -0,0 +1,29 @@
+import os
+
+# Dossiers des fichiers d'état (file des téléchargements, socket et journal du démon),
+# hors du dossier des sources. Ce module n'importe que la bibliothèque standard : il
+# est utilisé par le client de contrôle (p2p_control), qui doit rester léger.
+APP_DIR_NAME = "p2p-share"
+
+# Dossier des données persistantes : data_dir (config.json), sinon
+# $XDG_DATA_HOME/p2p-share (~/.local/share/p2p-share), ou %LOCALAPPDATA%\p2p-share
+# sous Windows. Créé au besoin, accessible au seul utilisateur
+def data_dir(config):
+    path = config.get("data_dir")
+    if not path:
+        base = (os.environ.get("XDG_DATA_HOME") or os.environ.get("LOCALAPPDATA")
+                or os.path.join(os.path.expanduser("~"), ".local", "share"))
+        path = os.path.join(base, APP_DIR_NAME)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
+
+# Dossier des fichiers d'exécution (socket de contrôle du démon) : runtime_dir
+# (config.json), sinon $XDG_RUNTIME_DIR/p2p-share, sinon le dossier des données
+def runtime_dir(config):
+    path = config.get("runtime_dir")
+    if not path:
+        if not os.environ.get("XDG_RUNTIME_DIR"):
+            return data_dir(config)
+        path = os.path.join(os.environ["XDG_RUNTIME_DIR"], APP_DIR_NAME)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    return path
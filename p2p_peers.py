@@ -0,0 +1,159 @@
+import atexit
+import collections
+import os
+import socket
+import threading
+import time
+
+HOSTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "p2p_hosts.txt")
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_DNS_NEGATIVE_TTL = 30
+DEFAULT_DNS_CACHE_SIZE = 256
+# Délai de regroupement des écritures du fichier hosts
+WRITE_DELAY = 1.0
+# Poids d'une nouvelle mesure dans la moyenne glissante du RTT
+RTT_WEIGHT = 0.25
+
+# Table des pairs connus, partagée par tout le processus
+#
+# p2p_hosts.txt ("<ip> <nom>" par ligne) n'est lu qu'une fois, au premier usage ;
+# ensuite les résolutions se font en mémoire. Les résolutions DNS sont mises en
+# cache, réussies (dns_cache_ttl) comme échouées (dns_negative_ttl), avec éviction
+# des plus anciennes au-delà de dns_cache_size entrées. Pour chaque pair sont
+# notés la date de dernière réponse et le RTT mesuré (moyenne glissante). Les
+# modifications sont écrites par un thread en arrière-plan, de façon atomique
+# (fichier temporaire puis os.replace).
+class PeerRegistry:
+    def __init__(self, path=HOSTS_FILE):
+        self.path = path
+        self.dns_ttl = DEFAULT_DNS_CACHE_TTL
+        self.negative_ttl = DEFAULT_DNS_NEGATIVE_TTL
+        self.max_cached = DEFAULT_DNS_CACHE_SIZE
+        self.hosts = None
+        self.last_seen = {}
+        self.rtt = {}
+        self.dns_cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.dirty = threading.Event()
+        self.write_lock = threading.Lock()
+        self.writer = None
+
+    def configure(self, config):
+        self.dns_ttl = float(config.get("dns_cache_ttl", DEFAULT_DNS_CACHE_TTL))
+        self.negative_ttl = float(config.get("dns_negative_ttl", DEFAULT_DNS_NEGATIVE_TTL))
+        self.max_cached = max(1, int(config.get("dns_cache_size", DEFAULT_DNS_CACHE_SIZE)))
+
+    def _load(self):
+        if self.hosts is not None:
+            return
+        hosts = {}
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    parts = line.split()
+                    if len(parts) >= 2:
+                        hosts[parts[1]] = parts[0]
+        except FileNotFoundError:
+            pass
+        self.hosts = hosts
+
+    # Nom d'hôte -> IP : adresse IP telle quelle, fichier hosts, puis DNS (en cache)
+    #
+    # Un nom irrésoluble est renvoyé tel quel (comme avant), la connexion échouera.
+    def resolve(self, host):
+        try:
+            socket.inet_pton(socket.AF_INET, host)
+            return host
+        except OSError:
+            pass
+        now = time.monotonic()
+        with self.lock:
+            self._load()
+            ip = self.hosts.get(host)
+            if ip is not None:
+                return ip
+            cached = self.dns_cache.get(host)
+            if cached is not None and cached[1] > now:
+                self.dns_cache.move_to_end(host)
+                return cached[0] or host
+        try:
+            ip = socket.gethostbyname(host)
+        except (OSError, UnicodeError):
+            ip = None
+        with self.lock:
+            self.dns_cache[host] = (ip, now + (self.dns_ttl if ip else self.negative_ttl))
+            self.dns_cache.move_to_end(host)
+            while len(self.dns_cache) > self.max_cached:
+                self.dns_cache.popitem(last=False)
+        return ip or host
+
+    # Un pair a répondu (découverte) : noter son adresse, et la date de réponse
+    def seen(self, hostname, ip, rtt=None):
+        with self.lock:
+            self._load()
+            self.last_seen[hostname] = time.time()
+            changed = self.hosts.get(hostname) != ip
+            if changed:
+                self.hosts[hostname] = ip
+                self.dns_cache.pop(hostname, None)
+        if rtt is not None:
+            self.record_rtt(ip, rtt)
+        if changed:
+            self._schedule_write()
+
+    def record_rtt(self, ip, rtt):
+        with self.lock:
+            previous = self.rtt.get(ip)
+            self.rtt[ip] = rtt if previous is None else previous + RTT_WEIGHT * (rtt - previous)
+
+    def get_rtt(self, host):
+        ip = self.resolve(host)
+        with self.lock:
+            return self.rtt.get(ip)
+
+    # Noms des pairs ayant répondu depuis moins de max_age secondes (tous si None)
+    def known_peers(self, max_age=None):
+        with self.lock:
+            self._load()
+            if max_age is None:
+                return sorted(self.hosts)
+            limit = time.time() - max_age
+            return sorted(h for h in self.hosts if self.last_seen.get(h, 0) >= limit)
+
+    def _schedule_write(self):
+        with self.lock:
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, daemon=True)
+                self.writer.start()
+                atexit.register(self.flush)
+        self.dirty.set()
+
+    def _write_loop(self):
+        while True:
+            self.dirty.wait()
+            # Regrouper les modifications rapprochées en une seule écriture
+            time.sleep(WRITE_DELAY)
+            self.flush()
+
+    # Écrire le fichier hosts s'il a changé (fichier temporaire puis os.replace)
+    def flush(self):
+        with self.write_lock:
+            if not self.dirty.is_set():
+                return
+            with self.lock:
+                self.dirty.clear()
+                lines = [f"{ip} {h}\n" for h, ip in self.hosts.items()]
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    f.writelines(lines)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[!] Écriture de {self.path} impossible: {e}")
+
+registry = PeerRegistry()
@@ -0,0 +1,120 @@
+import json
+import socket
+import struct
+
+# Protocole binaire versionné
+#
+# Requête : MAGIC | version (B) | flags (B) | longueur commande (H) | commande texte UTF-8
+# Réponse : MAGIC | version (B) | statut (B) | flags (H) | taille corps (Q) | longueur méta (I)
+#           suivi des métadonnées JSON puis du corps (exactement "taille corps" octets)
+#
+# Un client ancien envoie directement la commande texte ("GET_FILE nom", "LIST_FILES") :
+# le serveur reconnaît le protocole à la présence (ou non) de MAGIC en tête de requête.
+#
+# Version 1 : une seule requête par connexion.
+# Version 2 : connexion persistante ; après chaque réponse, le serveur attend la
+# requête suivante sur la même connexion (le client peut en envoyer plusieurs d'avance).
+MAGIC = b"P2PB"
+PROTOCOL_VERSION = 2
+MIN_PROTOCOL_VERSION = 1
+KEEPALIVE_VERSION = 2
+
+REQUEST_HEADER = struct.Struct("!4sBBH")
+RESPONSE_HEADER = struct.Struct("!4sBBHQI")
+
+# Statuts de réponse
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_INVALID = 2
+STATUS_ERROR = 3
+STATUS_UNSUPPORTED_VERSION = 4
+
+STATUS_MESSAGES = {
+    STATUS_OK: "OK",
+    STATUS_NOT_FOUND: "File not found",
+    STATUS_INVALID: "Invalid command",
+    STATUS_ERROR: "Server error",
+    STATUS_UNSUPPORTED_VERSION: "Unsupported protocol version",
+}
+
+# Erreur de protocole ou de transfert (réponse invalide, transfert tronqué...)
+class ProtocolError(Exception):
+    pass
+
+# Lire exactement n octets (ProtocolError si la connexion se ferme avant)
+def recv_exact(sock, n):
+    data = sock.recv(n, socket.MSG_WAITALL) if hasattr(socket, "MSG_WAITALL") else sock.recv(n)
+    if len(data) == n:
+        return data
+    buf = bytearray(data)
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            raise ProtocolError(f"Connexion fermée ({len(buf)}/{n} octets reçus)")
+        buf += part
+    return bytes(buf)
+
+# Lire et ignorer n octets, par blocs de chunk_size (sans les garder en mémoire)
+def recv_discard(sock, n, chunk_size=65536):
+    buf = bytearray(min(n, chunk_size))
+    while n > 0:
+        received = sock.recv_into(buf, min(n, len(buf)))
+        if not received:
+            raise ProtocolError(f"Connexion fermée ({n} octets manquants)")
+        n -= received
+
+# Lire jusqu'à n octets, moins seulement si la connexion se ferme avant
+def recv_prefix(sock, n):
+    buf = b""
+    while len(buf) < n:
+        part = sock.recv(n - len(buf))
+        if not part:
+            break
+        buf += part
+    return buf
+
+# Lire le début d'une requête : MAGIC pour le protocole binaire, sinon les premiers
+# octets d'une commande texte (la lecture s'arrête dès qu'ils diffèrent de MAGIC)
+def recv_magic(sock):
+    buf = b""
+    while len(buf) < len(MAGIC) and MAGIC.startswith(buf):
+        part = sock.recv(len(MAGIC) - len(buf))
+        if not part:
+            break
+        buf += part
+    return buf
+
+# Construire une requête binaire à partir d'une commande texte
+def pack_request(command, version=PROTOCOL_VERSION, flags=0):
+    payload = command.encode()
+    return REQUEST_HEADER.pack(MAGIC, version, flags, len(payload)) + payload
+
+# Lire la suite d'une requête binaire dont MAGIC a déjà été consommé
+def read_request(sock):
+    _, version, flags, length = REQUEST_HEADER.unpack(MAGIC + recv_exact(sock, REQUEST_HEADER.size - len(MAGIC)))
+    command = recv_exact(sock, length).decode() if length else ""
+    return version, flags, command
+
+# Version retenue pour l'échange (None si la version du client n'est pas supportée)
+def negotiate_version(client_version):
+    if client_version < MIN_PROTOCOL_VERSION:
+        return None
+    return min(client_version, PROTOCOL_VERSION)
+
+# Construire un en-tête de réponse suivi de ses métadonnées
+def pack_response(status, size=0, meta=None, version=PROTOCOL_VERSION, flags=0):
+    meta_bytes = json.dumps(meta).encode() if meta else b""
+    return RESPONSE_HEADER.pack(MAGIC, version, status, flags, size, len(meta_bytes)) + meta_bytes
+
+# Lire un en-tête de réponse et ses métadonnées ; renvoie (version, statut, taille, méta)
+def read_response(sock, head=b""):
+    raw = head + recv_exact(sock, RESPONSE_HEADER.size - len(head))
+    magic, version, status, _, size, meta_len = RESPONSE_HEADER.unpack(raw)
+    if magic != MAGIC:
+        raise ProtocolError("En-tête de réponse invalide")
+    meta = json.loads(recv_exact(sock, meta_len).decode()) if meta_len else {}
+    return version, status, size, meta
+
+# Message lisible associé à une réponse en erreur
+def error_message(status, meta):
+    return meta.get("error") or STATUS_MESSAGES.get(status, f"Statut inconnu {status}")
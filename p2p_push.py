@@ -0,0 +1,297 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from p2p_client import connect, resolve_host
+from p2p_metrics import metrics
+from p2p_protocol import STATUS_OK, ProtocolError, error_message, pack_request, read_response
+from p2p_shaping import SHAPING_SLICE
+from p2p_transfer import PART_SUFFIX, get_chunk_size, preallocate, pwrite, send_file, sha256_file
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_PUSH_FANOUT = 1
+DEFAULT_PUSH_TIMEOUT = 30
+# Attente du rapport d'un nœud après le dernier octet : il attend lui-même ceux de
+# ses enfants (et le rattrapage des nœuds rattachés après une panne)
+DEFAULT_PUSH_REPLY_TIMEOUT = 600
+MAX_PUSH_HEADER = 1024 * 1024
+# Attente de la réponse d'erreur d'un nœud qui a refusé la réplication
+ERROR_REPLY_TIMEOUT = 0.5
+MAX_ROUTE_NODES = 1024
+
+# Réplication en chaîne ou en arbre (PUSH_FILE)
+#
+# La source envoie le fichier à ses enfants dans l'arbre de réplication ; chaque nœud
+# écrit chaque bloc reçu dans un fichier <nom>.<...>.part et le retransmet aussitôt à ses propres
+# enfants : tous les liens transfèrent en même temps, et la durée totale reste proche
+# d'un seul transfert (plus la latence de chaque étage). La requête
+# "PUSH_FILE <longueur>" est suivie d'un en-tête JSON (identifiant, nom, taille, date,
+# SHA-256 et sous-arbre du nœud) puis des données ; la réponse, envoyée une fois les
+# enfants terminés, contient le rapport du sous-arbre (octets, débit par lien, nœuds
+# en panne).
+#
+# Un enfant injoignable, qui refuse la requête ou dont la connexion se coupe est
+# remplacé par ses propres enfants : le nœud s'y connecte directement, leur envoie
+# depuis sa copie locale (sendfile) les données déjà reçues, puis les ajoute au flux.
+
+# Arbre de réplication : targets [(hôte, port)] répartis en largeur, fanout enfants
+# par nœud (1 : chaîne). Renvoie les nœuds du premier étage (enfants de la source)
+def build_route(targets, fanout=DEFAULT_PUSH_FANOUT):
+    fanout = max(1, int(fanout))
+    nodes = [{"host": host, "port": int(port), "children": []} for host, port in targets]
+    for i, node in enumerate(nodes):
+        node["children"] = nodes[fanout * (i + 1):fanout * (i + 2)]
+    return nodes[:fanout]
+
+# Réplication acceptée depuis address : push_accept doit être activé, et address
+# figurer dans push_allowed_peers (noms ou adresses) si cette liste est donnée
+def push_allowed(config, address):
+    if not config.get("push_accept") or address is None:
+        return False
+    allowed = config.get("push_allowed_peers")
+    if not allowed:
+        return True
+    for host in allowed:
+        try:
+            if resolve_host(host) == address:
+                return True
+        except OSError:
+            continue
+    return False
+
+# En-tête de réplication bien formé : nom, taille, date et SHA-256, et sous-arbre
+# [{"host": str, "port": int, "children": [...]}] d'au plus MAX_ROUTE_NODES nœuds
+def valid_push_info(info):
+    try:
+        if not (isinstance(info["name"], str) and isinstance(info["size"], int) and info["size"] >= 0
+                and isinstance(info["mtime"], (int, float)) and isinstance(info["sha256"], str)):
+            return False
+    except (KeyError, TypeError):
+        return False
+    pending = [info.get("route") or []]
+    count = 0
+    while pending:
+        nodes = pending.pop()
+        if not isinstance(nodes, list):
+            return False
+        for node in nodes:
+            count += 1
+            if count > MAX_ROUTE_NODES or not isinstance(node, dict):
+                return False
+            host, port = node.get("host"), node.get("port")
+            if not isinstance(host, str) or not host or isinstance(port, bool) or not isinstance(port, int) \
+                    or not 0 < port < 65536:
+                return False
+            pending.append(node.get("children", []))
+    return True
+
+# Rapport d'un nœud qui n'a pas reçu le fichier
+def failed_report(node, error, rerouted=False):
+    return {"host": node["host"], "port": node["port"], "ok": False, "error": str(error), "rerouted": rerouted,
+            "children": []}
+
+# Connexion vers un enfant et mesure du lien
+class PushLink:
+    def __init__(self, node, sock, rerouted):
+        self.node = node
+        self.sock = sock
+        self.rerouted = rerouted
+        self.started = time.perf_counter()
+
+# Envoi d'un même flux à tous les enfants d'un nœud (ou de la source)
+#
+# local_path contient les données déjà transmises (fichier source, ou copie en cours
+# d'écriture d'un nœud) : elles servent à rattraper les nœuds rattachés en cours de
+# route. shaper (facultatif) : limitation du débit d'envoi du pair (BandwidthShaper),
+# qui compte aussi les octets retransmis.
+class PushRelay:
+    def __init__(self, config, info, route, local_path, shaper=None):
+        self.config = config
+        self.shaper = shaper
+        self.info = info
+        self.route = route
+        self.local_path = local_path
+        self.timeout = float(config.get("push_timeout", DEFAULT_PUSH_TIMEOUT))
+        self.reply_timeout = float(config.get("push_reply_timeout", DEFAULT_PUSH_REPLY_TIMEOUT))
+        self.links = []
+        self.failed = []
+
+    def open(self):
+        for node in self.route:
+            self._attach(node, 0, False)
+
+    # Ouvrir la réplication vers node et lui envoyer les offset premiers octets
+    def _attach(self, node, offset, rerouted):
+        sock = None
+        try:
+            sock = connect(resolve_host(node["host"]), node["port"], self.config, self.timeout)
+            header = json.dumps(dict(self.info, route=node["children"])).encode()
+            sock.sendall(pack_request(f"PUSH_FILE {len(header)}") + header)
+            if offset:
+                with open(self.local_path, "rb") as f:
+                    sent = send_file(sock, f, self.config, 0, offset, self._throttle(node["host"]), SHAPING_SLICE)
+                    if sent != offset:
+                        raise ProtocolError("Copie locale incomplète")
+                metrics.add("p2p_push_catchup_bytes_total", offset)
+        except (OSError, ProtocolError) as e:
+            self._fail(node, self._error(sock, e), offset, rerouted)
+            return
+        self.links.append(PushLink(node, sock, rerouted))
+
+    # Nœud en panne : ses enfants sont rattachés à ce nœud-ci
+    def _fail(self, node, error, offset, rerouted):
+        print(f"[!] Réplication vers {node['host']}:{node['port']} impossible: {error}")
+        metrics.add("p2p_push_failed_nodes_total")
+        self.failed.append(failed_report(node, error, rerouted))
+        for child in node["children"]:
+            self._attach(child, offset, True)
+
+    # Message d'erreur d'un nœud qui a refusé la requête (avant de fermer la connexion),
+    # sinon l'erreur réseau
+    def _error(self, sock, error):
+        if sock is None:
+            return error
+        try:
+            sock.settimeout(ERROR_REPLY_TIMEOUT)
+            _, status, _, meta = read_response(sock)
+            if status != STATUS_OK:
+                error = error_message(status, meta)
+        except (OSError, ProtocolError, ValueError):
+            pass
+        sock.close()
+        return error
+
+    def _throttle(self, host):
+        if self.shaper is None or not self.shaper.limited:
+            return None
+        return lambda n: self.shaper.wait(host, n)
+
+    # Transmettre le bloc data, qui se termine à la position end du fichier
+    def forward(self, data, end):
+        failed = []
+        for link in self.links:
+            host = link.node["host"]
+            try:
+                if self.shaper is not None:
+                    if self.shaper.limited:
+                        self.shaper.wait(host, len(data))
+                    else:
+                        self.shaper.record(host, len(data))
+                link.sock.sendall(data)
+            except OSError as e:
+                failed.append((link, e))
+                continue
+            metrics.add("p2p_bytes_sent_total", len(data), peer=host)
+        for link, e in failed:
+            self.links.remove(link)
+            self._fail(link.node, self._error(link.sock, e), end, link.rerouted)
+
+    # Attendre les rapports des enfants (un enfant qui ne répond pas est remplacé
+    # par les siens, rattrapés depuis la copie locale complète)
+    def finish(self):
+        reports = []
+        size = self.info["size"]
+        while self.links:
+            link = self.links.pop(0)
+            try:
+                link.sock.settimeout(self.reply_timeout)
+                _, status, _, meta = read_response(link.sock)
+            except (OSError, ProtocolError, ValueError) as e:
+                link.sock.close()
+                self._fail(link.node, e, size, link.rerouted)
+                continue
+            link.sock.close()
+            if status != STATUS_OK:
+                self._fail(link.node, error_message(status, meta), size, link.rerouted)
+                continue
+            seconds = time.perf_counter() - link.started
+            report = dict(meta.get("report") or {}, host=link.node["host"], port=link.node["port"],
+                          rerouted=link.rerouted, seconds=round(seconds, 3),
+                          rate=round(size / seconds) if seconds > 0 else None)
+            reports.append(report)
+        metrics.add("p2p_push_forwarded_bytes_total", size * len(reports))
+        return reports + self.failed
+
+    def close(self):
+        for link in self.links:
+            link.sock.close()
+        self.links = []
+
+# Recevoir une réplication (côté serveur) : écrire le fichier dans path en le
+# retransmettant au sous-arbre de l'en-tête ; renvoie le rapport du sous-arbre
+def receive_push(conn, info, path, config, on_data=None, shaper=None):
+    size = info["size"]
+    # Nom propre à cette réception : un nœud peut recevoir deux fois le même envoi
+    # (rattaché par un nœud jugé en panne qui continuait de transmettre)
+    part = f"{path}.{uuid.uuid4().hex}{PART_SUFFIX}"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    relay = PushRelay(config, info, info.get("route") or [], part, shaper)
+    digest = hashlib.sha256()
+    chunk_size = get_chunk_size(config)
+    buf = memoryview(bytearray(chunk_size))
+    total = 0
+    start = time.perf_counter()
+    try:
+        preallocate(fd, size)
+        relay.open()
+        conn.settimeout(relay.timeout)
+        while total < size:
+            n = conn.recv_into(buf[:min(chunk_size, size - total)])
+            if not n:
+                raise ProtocolError(f"Réplication interrompue: {total}/{size} octets reçus")
+            data = buf[:n]
+            # Écrit avant d'être retransmis : la copie locale sert au rattrapage
+            pwrite(fd, data, total)
+            digest.update(data)
+            total += n
+            relay.forward(data, total)
+            if on_data:
+                on_data(n)
+    except BaseException:
+        os.close(fd)
+        relay.close()
+        os.remove(part)
+        raise
+    os.close(fd)
+    elapsed = time.perf_counter() - start
+    children = relay.finish()
+    report = {"ok": True, "bytes": total, "receive_seconds": round(elapsed, 3), "children": children}
+    if digest.hexdigest() != info["sha256"]:
+        report.update(ok=False, error="Somme de contrôle invalide")
+        os.remove(part)
+    else:
+        os.replace(part, path)
+        os.utime(path, (info["mtime"], info["mtime"]))
+    metrics.add("p2p_push_files_total", result="done" if report["ok"] else "error")
+    return report
+
+# Répliquer le fichier local path (nommé name dans les dossiers partagés) vers
+# targets [(hôte, port)] en chaîne (fanout 1) ou en arbre ; renvoie le rapport
+# (durée, débit et rapport de chaque nœud, enfants compris)
+def push_file(targets, path, name, config, fanout=None, sha256=None, shaper=None):
+    st = os.stat(path)
+    info = {"id": uuid.uuid4().hex, "name": name, "size": st.st_size, "mtime": st.st_mtime,
+            "sha256": sha256 or sha256_file(path, get_chunk_size(config))}
+    fanout = fanout or int(config.get("push_fanout", DEFAULT_PUSH_FANOUT))
+    relay = PushRelay(config, info, build_route(targets, fanout), path, shaper)
+    chunk_size = get_chunk_size(config)
+    buf = memoryview(bytearray(chunk_size))
+    total = 0
+    start = time.perf_counter()
+    relay.open()
+    try:
+        with open(path, "rb") as f:
+            while total < st.st_size and relay.links:
+                n = f.readinto(buf[:min(chunk_size, st.st_size - total)])
+                if not n:
+                    raise ProtocolError("Fichier modifié pendant la réplication")
+                total += n
+                relay.forward(buf[:n], total)
+        children = relay.finish()
+    finally:
+        relay.close()
+    seconds = time.perf_counter() - start
+    return {"name": name, "size": st.st_size, "fanout": fanout, "seconds": round(seconds, 3),
+            "rate": round(st.st_size / seconds) if seconds > 0 else None, "children": children}
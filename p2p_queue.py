@@ -0,0 +1,385 @@
+import itertools
+import json
+import os
+import threading
+import time
+from p2p_batch import is_pattern
+from p2p_client import fetch_files, fetch_many, sync_file
+from p2p_control import CANCELLED, DONE, FAILED, FINISHED_STATES, PAUSED, PRIORITY_NORMAL, QUEUED, RUNNING
+from p2p_download import DownloadInterrupted, create_download
+from p2p_paths import data_dir
+from p2p_protocol import ProtocolError
+from p2p_transfer import JOURNAL_SUFFIX, PART_SUFFIX, resolve_shared_path
+
+# Fichier de la file, dans le dossier des données (data_dir) sauf download_queue_file
+QUEUE_FILE_NAME = "p2p_queue.json"
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_DOWNLOAD_WORKERS = 3
+DEFAULT_DOWNLOAD_MAX_ATTEMPTS = 5
+DEFAULT_DOWNLOAD_RETRY_DELAY = 2
+MAX_RETRY_DELAY = 300
+# Intervalle minimal entre deux notifications de progression d'un même élément
+PROGRESS_INTERVAL = 0.25
+
+# Élément de la file : un fichier (sources : pair choisi puis sources supplémentaires)
+# ou un lot de noms, motifs ou dossiers d'un même pair (un seul flux GET_MANY)
+class DownloadItem:
+    def __init__(self, item_id, sources, names, priority=PRIORITY_NORMAL, state=QUEUED, attempts=0,
+                 error=None, message=None, received=0, size=None, created=None):
+        self.id = item_id
+        self.sources = [tuple(source) for source in sources]
+        self.names = list(names)
+        self.priority = priority
+        self.state = state
+        self.attempts = attempts
+        self.error = error
+        self.message = message
+        self.received = received
+        self.size = size
+        self.created = created or time.time()
+        self.next_try = 0.0
+        # Arrêt demandé pendant le transfert : "pause", "cancel" ou "shutdown"
+        self.stop = None
+        self.speed = 0.0
+        self.last_notify = 0.0
+        self.last_sample = (0.0, 0)
+
+    @property
+    def batch(self):
+        return len(self.names) != 1 or is_pattern(self.names[0])
+
+    @property
+    def label(self):
+        host = self.sources[0][0]
+        if self.batch:
+            return f"{len(self.names)} élément(s) de {host}"
+        return f"{self.names[0]} ({host})"
+
+    def to_dict(self):
+        return {"id": self.id, "sources": self.sources, "names": self.names, "priority": self.priority,
+                "state": self.state, "attempts": self.attempts, "error": self.error,
+                "message": self.message, "received": self.received, "size": self.size,
+                "created": self.created}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["id"], data["sources"], data["names"], data.get("priority", PRIORITY_NORMAL),
+                   data.get("state", QUEUED), data.get("attempts", 0), data.get("error"),
+                   data.get("message"), data.get("received", 0), data.get("size"), data.get("created"))
+
+    # État courant transmis aux vues (copie, utilisable depuis un autre thread)
+    def snapshot(self):
+        data = self.to_dict()
+        data.update(label=self.label, speed=self.speed, batch=self.batch)
+        return data
+
+# Fichier de la file par défaut (dans data_dir)
+def queue_path(config):
+    return os.path.join(data_dir(config), QUEUE_FILE_NAME)
+
+# Gestionnaire de téléchargements : file persistante servie par un groupe de workers
+#
+# Les éléments sont pris par priorité puis par ordre d'arrivée ; download_workers
+# téléchargements tournent en même temps (deux éléments portant sur le même fichier
+# ne sont jamais servis ensemble). Un échec est retenté après un délai qui double à
+# chaque essai (download_retry_delay secondes au départ), jusqu'à
+# download_max_attempts essais. Un élément peut être mis en pause (le .part est
+# conservé et le transfert reprend là où il s'était arrêté), repris, annulé ou
+# changé de priorité à tout moment. La file est enregistrée dans path à chaque
+# changement d'état : les téléchargements en cours à l'arrêt reprennent au démarrage
+# suivant. Les fonctions ajoutées par add_listener reçoivent l'état de l'élément
+# (snapshot) à chaque changement, depuis le thread du worker ; la progression est
+# notifiée au plus toutes les PROGRESS_INTERVAL secondes par élément.
+class DownloadManager:
+    def __init__(self, config, dest_dir, local_index=None, path=None):
+        self.config = config
+        self.dest_dir = dest_dir
+        self.local_index = local_index
+        self.path = config.get("download_queue_file") or path or queue_path(config)
+        self.workers = int(config.get("download_workers", DEFAULT_DOWNLOAD_WORKERS))
+        self.max_attempts = int(config.get("download_max_attempts", DEFAULT_DOWNLOAD_MAX_ATTEMPTS))
+        self.retry_delay = float(config.get("download_retry_delay", DEFAULT_DOWNLOAD_RETRY_DELAY))
+        self.items = {}
+        self.ids = itertools.count(1)
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.running = False
+        self.threads = []
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    # Charger la file enregistrée puis lancer les workers
+    def start(self):
+        self._load()
+        with self.lock:
+            self.running = True
+        self.threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, self.workers))]
+        for thread in self.threads:
+            thread.start()
+
+    # Arrêter les workers : les transferts en cours sont interrompus et remis en file
+    def stop(self, timeout=5):
+        with self.lock:
+            self.running = False
+            for item in self.items.values():
+                if item.state == RUNNING:
+                    item.stop = "shutdown"
+            self.changed.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self._save()
+
+    # Ajouter un téléchargement : names est un nom de fichier, ou une liste de noms,
+    # motifs ou dossiers (lot) ; sources est une liste de (hôte, port), le premier
+    # étant le pair choisi. Un élément identique déjà en attente est renvoyé tel quel
+    def enqueue(self, sources, names, priority=PRIORITY_NORMAL):
+        names = [names] if isinstance(names, str) else list(names)
+        sources = list(dict.fromkeys(tuple(source) for source in sources))
+        with self.lock:
+            for item in self.items.values():
+                if item.state not in FINISHED_STATES and item.names == names and item.sources[0] == sources[0]:
+                    return item.snapshot()
+            item = DownloadItem(next(self.ids), sources, names, priority)
+            self.items[item.id] = item
+            self.changed.notify_all()
+        self._changed(item)
+        return item.snapshot()
+
+    # Ajouter d'un coup des lots de plusieurs pairs, servis en parallèle : liste de
+    # (sources, noms)
+    def enqueue_many(self, batches, priority=PRIORITY_NORMAL):
+        return [self.enqueue(sources, names, priority) for sources, names in batches]
+
+    # État de tous les éléments (par ordre d'arrivée)
+    def snapshot(self):
+        with self.lock:
+            return [item.snapshot() for item in sorted(self.items.values(), key=lambda i: i.id)]
+
+    def pause(self, item_id):
+        return self._control(item_id, "pause", (QUEUED,), PAUSED)
+
+    def resume(self, item_id):
+        with self.lock:
+            item = self.items.get(item_id)
+            if item is None or item.state not in (PAUSED, FAILED):
+                return False
+            item.state = QUEUED
+            item.next_try = 0.0
+            if item.attempts >= self.max_attempts:
+                item.attempts = 0
+            item.error = None
+            self.changed.notify_all()
+        self._changed(item)
+        return True
+
+    def cancel(self, item_id):
+        return self._control(item_id, "cancel", (QUEUED, PAUSED, FAILED), CANCELLED)
+
+    def set_priority(self, item_id, priority):
+        with self.lock:
+            item = self.items.get(item_id)
+            if item is None:
+                return False
+            item.priority = priority
+            self.changed.notify_all()
+        self._changed(item)
+        return True
+
+    # Retirer de la file les éléments terminés, en échec ou annulés
+    def clear_finished(self):
+        with self.lock:
+            for item_id in [i for i, item in self.items.items() if item.state in FINISHED_STATES]:
+                del self.items[item_id]
+        self._save()
+
+    # Pause ou annulation : immédiate pour un élément en attente, demandée au
+    # transfert (qui s'arrête au bloc suivant) pour un élément en cours
+    def _control(self, item_id, stop, states, new_state):
+        with self.lock:
+            item = self.items.get(item_id)
+            if item is None:
+                return False
+            if item.state == RUNNING:
+                item.stop = stop
+                return True
+            if item.state not in states:
+                return False
+            item.state = new_state
+        if new_state == CANCELLED:
+            self._discard_partial(item)
+        self._changed(item)
+        return True
+
+    # Prochain élément à servir (à appeler sous self.lock) : (élément, None) ou
+    # (None, délai avant le prochain essai)
+    def _next_item(self):
+        now = time.monotonic()
+        busy = {name for item in self.items.values() if item.state == RUNNING for name in item.names}
+        ready = []
+        wait = None
+        for item in self.items.values():
+            if item.state != QUEUED or busy.intersection(item.names):
+                continue
+            if item.next_try > now:
+                wait = min(wait or item.next_try - now, item.next_try - now)
+                continue
+            ready.append(item)
+        if not ready:
+            return None, wait
+        return min(ready, key=lambda i: (i.priority, i.id)), None
+
+    def _worker(self):
+        while True:
+            with self.lock:
+                while True:
+                    if not self.running:
+                        return
+                    item, wait = self._next_item()
+                    if item is not None:
+                        break
+                    self.changed.wait(wait)
+                item.state = RUNNING
+                item.stop = None
+                item.error = None
+                item.speed = 0.0
+                item.last_sample = (time.monotonic(), item.received)
+            self._changed(item)
+            self._run(item)
+
+    def _run(self, item):
+        error = None
+        try:
+            item.message = self._download(item)
+        except Exception as e:
+            error = e
+        with self.lock:
+            stop, item.stop = item.stop, None
+            item.speed = 0.0
+            if stop == "cancel":
+                item.state = CANCELLED
+            elif stop == "pause":
+                item.state = PAUSED
+            elif stop == "shutdown":
+                item.state = QUEUED
+            elif error is None:
+                item.state = DONE
+            else:
+                item.attempts += 1
+                item.error = str(error)
+                if item.attempts >= self.max_attempts:
+                    item.state = FAILED
+                else:
+                    item.state = QUEUED
+                    delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** (item.attempts - 1))
+                    item.next_try = time.monotonic() + delay
+            self.changed.notify_all()
+        if stop == "cancel":
+            self._discard_partial(item)
+        self._changed(item)
+
+    # Transfert d'un élément ; renvoie le message de fin
+    def _download(self, item):
+        host, port = item.sources[0]
+        progress = lambda received, size: self._progress(item, received, size)
+        if item.batch:
+            results = fetch_many(host, port, item.names, self.dest_dir, self.config, progress)
+            if results is None:
+                # Pair sans GET_MANY : fichiers demandés un par un sur une même connexion
+                results = fetch_files(host, port, item.names, self.dest_dir, self.config, progress)
+            errors = [f"{name}: {error}" for name, _, error in results if error]
+            received = len(results) - len(errors)
+            if errors and not received:
+                raise ProtocolError("; ".join(errors))
+            if errors:
+                return f"{received} fichier(s) téléchargé(s), erreurs: " + "; ".join(errors)
+            return f"{received} fichier(s) téléchargé(s) avec succès."
+        filename = item.names[0]
+        # Copie locale existante : seules les différences sont transférées
+        if self.config.get("delta_sync", True):
+            stats = sync_file(host, port, filename, self.dest_dir, self.config, progress)
+            if stats is not None:
+                on_wire = stats["sent"] + stats["received"]
+                return (f"Fichier '{filename}' synchronisé ({on_wire/1024:.1f} Ko transférés "
+                        f"pour {stats['size']/1024:.1f} Ko).")
+        download = create_download(item.sources, filename, self.dest_dir, self.config, progress, self.local_index)
+        total = download.run()
+        resumed = f", {download.resumed/1024:.1f} Ko déjà présents" if download.resumed else ""
+        return (f"Fichier '{filename}' téléchargé avec succès ({total/1024:.1f} Ko{resumed}, "
+                f"{len(download.sources)} pair(s), {download.connections} connexion(s)).")
+
+    # Progression d'un transfert ; interrompt le transfert si un arrêt est demandé
+    def _progress(self, item, received, size):
+        if item.stop:
+            raise DownloadInterrupted(item.stop)
+        item.received = received
+        item.size = size
+        now = time.monotonic()
+        if now - item.last_notify < PROGRESS_INTERVAL:
+            return
+        start, start_bytes = item.last_sample
+        if now - start >= PROGRESS_INTERVAL:
+            item.speed = (received - start_bytes) / (now - start)
+            item.last_sample = (now, received)
+        item.last_notify = now
+        self._notify(item)
+
+    # Fichiers temporaires d'un téléchargement annulé
+    def _discard_partial(self, item):
+        if item.batch:
+            return
+        local_path = resolve_shared_path(self.dest_dir, item.names[0])
+        if local_path is None:
+            return
+        for path in (local_path + PART_SUFFIX, local_path + JOURNAL_SUFFIX):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _changed(self, item):
+        self._save()
+        self._notify(item)
+
+    def _notify(self, item):
+        snapshot = item.snapshot()
+        for callback in self.listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"[!] Erreur de notification de téléchargement: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"[!] File de téléchargements illisible ({self.path}): {e}")
+            return
+        with self.lock:
+            for entry in data.get("items", []):
+                try:
+                    item = DownloadItem.from_dict(entry)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if item.state == RUNNING:
+                    item.state = QUEUED
+                self.items[item.id] = item
+            self.ids = itertools.count(max(self.items, default=0) + 1)
+
+    # Écriture atomique de la file (fichier temporaire puis os.replace)
+    def _save(self):
+        with self.lock:
+            data = {"items": [item.to_dict() for item in sorted(self.items.values(), key=lambda i: i.id)]}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[!] Écriture de {self.path} impossible: {e}")
@@ -0,0 +1,961 @@
+import asyncio
+import fnmatch
+import json
+import os
+import socket
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from p2p_protocol import (
+    KEEPALIVE_VERSION, MAGIC, PROTOCOL_VERSION, REQUEST_HEADER, STATUS_OK, STATUS_NOT_FOUND, STATUS_INVALID,
+    STATUS_UNSUPPORTED_VERSION, STATUS_MESSAGES, ProtocolError, negotiate_version, pack_response,
+    read_request, recv_discard, recv_exact, recv_magic
+)
+from p2p_batch import FORMAT_FRAMES, FORMATS, MAX_REQUEST_SIZE, entry_header, is_pattern, stream_trailer
+from p2p_cache import FileCache
+from p2p_compress import ENCODING_MASK, choose_encoding, compressed_frames, get_level
+from p2p_delta import (
+    COPY_OP, LITERAL_OP, MAX_DELTA_BLOCK_SIZE, MIN_DELTA_BLOCK_SIZE, OP_COPY, OP_LITERAL,
+    MAX_SIGNATURE_SIZE, FileView, SignatureTable, compute_delta, delta_size, literal_bytes, signature_size
+)
+from p2p_index import SharedIndex
+from p2p_metrics import metrics, profiler, start_http_endpoint
+from p2p_push import MAX_PUSH_HEADER, push_allowed, receive_push, valid_push_info
+from p2p_shaping import SHAPING_SLICE, BandwidthShaper
+from p2p_transfer import (
+    add_time, configure_socket, get_chunk_size, is_partial_file, resolve_shared_path, send_file, sendfile_enabled,
+    set_nodelay, sha256_file
+)
+
+# Valeurs par défaut (surchargeables dans config.json)
+DEFAULT_BACKLOG = 128
+DEFAULT_MAX_TRANSFERS = 32
+DEFAULT_IDLE_TIMEOUT = 30
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+DEFAULT_SEARCH_MAX_RESULTS = 1000
+DEFAULT_LIST_PAGE_SIZE = 1000
+MAX_LIST_PAGE_SIZE = 10000
+# Threads du serveur asyncio réservés aux commandes de métadonnées
+META_WORKERS = 4
+
+# Commandes de transfert de données, soumises à la limitation de débit ; les autres
+# (métadonnées) sont prioritaires
+BULK_COMMANDS = {"GET_FILE", "GET_RANGE", "GET_CHUNK", "DELTA", "GET_MANY", "PUSH_FILE"}
+
+# Adresse IP du pair d'une connexion (clé de sa part de débit)
+def peer_address(conn):
+    try:
+        return conn.getpeername()[0]
+    except OSError:
+        return None
+
+# Requête refusée : renvoyée au client sous forme de réponse d'erreur
+class RequestError(Exception):
+    def __init__(self, status, message=None):
+        self.status = status
+        self.message = message or STATUS_MESSAGES[status]
+        super().__init__(self.message)
+
+# Serveur pair-à-pair : répond aux requêtes des autres pairs (un thread par connexion)
+#
+# Deux protocoles sont acceptés sur le même port : le protocole binaire versionné
+# (requête préfixée par MAGIC, réponse avec en-tête de taille fixe) et l'ancien
+# protocole texte ("OK\n" / "ERROR: ...\n" suivi du contenu brut) pour les anciens pairs.
+# À partir de la version 2 du protocole binaire, une connexion sert plusieurs requêtes
+# successives et reste ouverte jusqu'à idle_timeout secondes entre deux requêtes.
+class PeerServer(threading.Thread):
+    def __init__(self, config):
+        super().__init__(daemon=True)
+        self.config = config
+        self.host = config["host"]
+        self.port = config["port"]
+        self.shared_dir = config["shared_dir"]
+        self.backlog = int(config.get("backlog", DEFAULT_BACKLOG))
+        self.index = SharedIndex(self.shared_dir, config)
+        # Sommes de contrôle déjà calculées : chemin -> (taille, mtime_ns, sha256)
+        self.checksums = {}
+        self.checksums_lock = threading.Lock()
+        # Requêtes en cours de traitement (charge annoncée lors de la découverte) et
+        # connexions ouvertes
+        self.active = 0
+        self.open_connections = 0
+        self.active_lock = threading.Lock()
+        self.max_transfers = int(config.get("max_transfers", DEFAULT_MAX_TRANSFERS))
+        # Débit d'envoi : plafonds max_upload_rate / max_peer_upload_rate (octets/s)
+        self.shaper = BandwidthShaper.from_config(config, "upload")
+        # Fichiers servis gardés ouverts, partagés par les envois (file_cache_size octets)
+        self.file_cache = FileCache.from_config(config)
+        self.commands = {
+            "GET_FILE": self.cmd_get_file,
+            "GET_RANGE": self.cmd_get_range,
+            "CHECKSUM": self.cmd_checksum,
+            "LIST_FILES": self.cmd_list_files,
+            "LIST_FILES_V2": self.cmd_list_files_v2,
+            "MANIFEST": self.cmd_manifest,
+            "GET_CHUNK": self.cmd_get_chunk,
+            "DELTA": self.cmd_delta,
+            "GET_MANY": self.cmd_get_many,
+            "PUSH_FILE": self.cmd_push_file,
+            "SEARCH": self.cmd_search,
+            "LIST_PAGE": self.cmd_list_page,
+            "BANDWIDTH": self.cmd_bandwidth,
+            "STATS": self.cmd_stats,
+        }
+        self.register_metrics()
+
+    # Jauges du serveur (évaluées à la lecture des mesures)
+    def register_metrics(self):
+        metrics.gauge("p2p_requests_active", lambda: self.active)
+        metrics.gauge("p2p_connections_active", lambda: self.open_connections)
+        metrics.gauge("p2p_transfers_active", self.shaper.active_transfers)
+        metrics.gauge("p2p_upload_rate_bytes", lambda: round(self.shaper.total_meter.current()))
+        metrics.gauge("p2p_file_cache_bytes", lambda: self.file_cache.total)
+        metrics.gauge("p2p_file_cache_entries", lambda: len(self.file_cache.entries))
+        metrics.gauge("p2p_file_cache_hit_ratio", self.file_cache.hit_ratio)
+        metrics.describe("p2p_bytes_sent_total", "Octets envoyés, par pair")
+        metrics.describe("p2p_bytes_received_total", "Octets reçus, par pair")
+        metrics.describe("p2p_send_seconds_total", "Temps passé à envoyer des données, par pair")
+        metrics.describe("p2p_io_seconds_total", "Temps des envois par catégorie (disk, network, sendfile, "
+                                                 "compress, throttle)")
+        metrics.describe("p2p_request_duration_seconds", "Durée de traitement des requêtes, par commande")
+        metrics.describe("p2p_file_cache_requests_total", "Ouvertures de fichiers servis, par résultat du cache "
+                                                          "(hit, miss, bypass)")
+
+    # Socket d'écoute commune aux différents modes de serveur
+    def listen_socket(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self.host, self.port))
+        s.listen(self.backlog)
+        return s
+
+    def run(self):
+        self.index.start()
+        start_http_endpoint(self.config)
+        s = self.listen_socket()
+        print(f"[+] Serveur P2P en écoute sur {self.host}:{self.port}")
+        while True:
+            conn, addr = s.accept()
+            set_nodelay(conn)
+            threading.Thread(target=self.handle_client, args=(conn, addr), daemon=True).start()
+
+    # Gérer une connexion entrante : détection du protocole puis exécution des commandes
+    # (plusieurs à la suite si la version négociée garde la connexion ouverte)
+    def handle_client(self, conn, addr):
+        idle_timeout = float(self.config.get("idle_timeout", DEFAULT_IDLE_TIMEOUT))
+        first = True
+        self.count_connection(1)
+        try:
+            while True:
+                try:
+                    head = recv_magic(conn)
+                except socket.timeout:
+                    if first:
+                        raise
+                    return
+                if not head and not first:
+                    return
+                if head == MAGIC:
+                    client_version, flags, request = read_request(conn)
+                    version = negotiate_version(client_version)
+                    if version is None:
+                        conn.sendall(self.version_error())
+                        return
+                else:
+                    # Ancien protocole texte : version None (une requête de moins de 4 octets
+                    # est déjà entièrement lue)
+                    version, flags = None, 0
+                    if len(head) == len(MAGIC):
+                        head += conn.recv(1024)
+                    request = head.decode()
+                self.dispatch(conn, request, version, flags)
+                if version is None or version < KEEPALIVE_VERSION:
+                    return
+                # Connexion persistante : fermée après idle_timeout sans nouvelle requête
+                first = False
+                conn.settimeout(idle_timeout)
+        except Exception as e:
+            metrics.add("p2p_connection_errors_total", error=type(e).__name__)
+            print(f"[!] Erreur avec {addr}: {e}")
+        finally:
+            self.count_connection(-1)
+            conn.close()
+
+    def count_connection(self, delta):
+        with self.active_lock:
+            self.open_connections += delta
+        if delta > 0:
+            metrics.add("p2p_connections_total")
+
+    # Octets envoyés à un pair et temps passé par catégorie (voir send_file)
+    def count_sent(self, peer, n, timings=None):
+        metrics.add("p2p_bytes_sent_total", n, peer=peer)
+        if timings:
+            for kind, seconds in timings.items():
+                metrics.add("p2p_io_seconds_total", seconds, kind=kind)
+            metrics.add("p2p_send_seconds_total", timings.get("network", 0.0) + timings.get("sendfile", 0.0),
+                        peer=peer)
+
+    def count_received(self, conn, n):
+        metrics.add("p2p_bytes_received_total", n, peer=peer_address(conn))
+
+    # Envoyer une réponse courte (en-tête, métadonnées, listing)
+    def send_reply(self, conn, data):
+        start = time.perf_counter()
+        conn.sendall(data)
+        self.count_sent(peer_address(conn), len(data), {"network": time.perf_counter() - start})
+
+    # Envoyer count octets du fichier ; sur une connexion persistante, un envoi incomplet
+    # (fichier tronqué entre-temps) rendrait la suite du flux illisible : elle est fermée
+    def send_body(self, conn, f, offset, count):
+        peer = peer_address(conn)
+        timings = {}
+        if self.shaper.limited:
+            sent = send_file(conn, f, self.config, offset, count, lambda n: self.shaper.wait(peer, n), SHAPING_SLICE,
+                             timings)
+        else:
+            sent = send_file(conn, f, self.config, offset, count, timings=timings)
+            self.shaper.record(peer, sent)
+        self.count_sent(peer, sent, timings)
+        if sent != count:
+            raise ProtocolError("Fichier modifié pendant l'envoi")
+
+    # Envoyer des données d'un transfert déjà en mémoire (trames compressées, petits
+    # fichiers regroupés), par tranches si le débit est limité
+    def send_data(self, conn, data):
+        peer = peer_address(conn)
+        timings = {}
+        if not self.shaper.limited:
+            start = time.perf_counter()
+            conn.sendall(data)
+            add_time(timings, "network", start)
+            self.shaper.record(peer, len(data))
+        else:
+            view = memoryview(data)
+            for offset in range(0, len(view), SHAPING_SLICE):
+                part = view[offset:offset + SHAPING_SLICE]
+                start = time.perf_counter()
+                self.shaper.wait(peer, len(part))
+                add_time(timings, "throttle", start)
+                start = time.perf_counter()
+                conn.sendall(part)
+                add_time(timings, "network", start)
+        self.count_sent(peer, len(data), timings)
+
+    # flags : octet flags de la requête binaire (algorithmes de compression acceptés)
+    def dispatch(self, conn, request, version, flags=0):
+        command, _, arg = request.partition(" ")
+        command = command.strip()
+        handler = self.commands.get(command)
+        start = time.perf_counter()
+        peer = self.begin_request(conn, command, request, version)
+        error = None
+        try:
+            if handler is None:
+                raise RequestError(STATUS_INVALID)
+            profiler.call(handler, conn, arg.strip(), version, flags)
+        except RequestError as e:
+            error = e.status
+            self.send_reply(conn, self.error_response(e.status, version, e.message))
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self.end_request(command, peer, start, error)
+
+    # Début et fin d'une requête : charge annoncée, classe de priorité (transfert de
+    # données compté pour son pair, ou métadonnées prioritaires) et mesures (octets de
+    # la requête, puis nombre, erreurs et durée par commande) ; renvoie le pair
+    def begin_request(self, conn, command, request, version):
+        self.track(1)
+        peer = peer_address(conn)
+        header_size = REQUEST_HEADER.size if version is not None else 0
+        metrics.add("p2p_bytes_received_total", header_size + len(request), peer=peer)
+        if command not in BULK_COMMANDS:
+            self.shaper.begin_meta()
+        else:
+            self.shaper.begin(peer)
+        return peer
+
+    def end_request(self, command, peer, start, error=None):
+        if command not in BULK_COMMANDS:
+            self.shaper.end_meta()
+        else:
+            self.shaper.end(peer)
+        self.track(-1)
+        # Commandes inconnues regroupées : leur nom vient du client
+        label = command if command in self.commands else "INVALID"
+        metrics.add("p2p_requests_total", command=label)
+        if error is not None:
+            metrics.add("p2p_request_errors_total", command=label, error=error)
+        metrics.observe("p2p_request_duration_seconds", time.perf_counter() - start, command=label)
+
+    def track(self, delta):
+        with self.active_lock:
+            self.active += delta
+
+    # Charge du serveur : (requêtes en cours, emplacements de transfert libres)
+    def load(self):
+        return self.active, max(0, self.max_transfers - self.active)
+
+    def version_error(self):
+        meta = {"error": STATUS_MESSAGES[STATUS_UNSUPPORTED_VERSION], "max_version": PROTOCOL_VERSION}
+        return pack_response(STATUS_UNSUPPORTED_VERSION, meta=meta)
+
+    # Réponse d'erreur dans le protocole de la connexion
+    def error_response(self, status, version, message=None):
+        message = message or STATUS_MESSAGES[status]
+        if version is None:
+            return f"ERROR: {message}\n".encode()
+        return pack_response(status, meta={"error": message}, version=version)
+
+    # En-tête d'une réponse avec un corps de taille connue (envoyé ensuite par l'appelant)
+    def ok_response(self, size, version, meta=None, legacy_header=True):
+        if version is None:
+            return b"OK\n" if legacy_header else b""
+        return pack_response(STATUS_OK, size, meta, version=version)
+
+    def send_ok(self, conn, size, version, meta=None, legacy_header=True):
+        header = self.ok_response(size, version, meta, legacy_header)
+        if header:
+            self.send_reply(conn, header)
+
+    # Ouvrir le fichier demandé et calculer la plage à envoyer
+    #
+    # arg vaut "<fichier>" (GET_FILE) ou "<fichier> <offset> <longueur>" (GET_RANGE) ;
+    # renvoie (fichier ouvert, offset, nombre d'octets, métadonnées).
+    def open_transfer(self, arg, ranged=False):
+        offset, length = 0, None
+        filename = arg
+        if ranged:
+            try:
+                filename, offset, length = arg.rsplit(" ", 2)
+                offset, length = int(offset), int(length)
+            except ValueError:
+                raise RequestError(STATUS_INVALID)
+        filepath = resolve_shared_path(self.shared_dir, filename)
+        if filepath is None or not os.path.isfile(filepath):
+            raise RequestError(STATUS_NOT_FOUND)
+        f = self.file_cache.open(filepath, offset, length)
+        st = os.fstat(f.fileno())
+        if offset < 0 or (length is not None and length < 0) or offset > st.st_size:
+            f.close()
+            raise RequestError(STATUS_INVALID, "Invalid range")
+        count = st.st_size - offset if length is None else min(length, st.st_size - offset)
+        meta = {"name": filename, "size": st.st_size, "mtime": st.st_mtime}
+        if ranged:
+            meta["offset"] = offset
+        return f, offset, count, meta
+
+    def cmd_get_file(self, conn, arg, version, flags=0, ranged=False):
+        f, offset, count, meta = self.open_transfer(arg, ranged)
+        with f:
+            configure_socket(conn, self.config)
+            encoding = choose_encoding(flags, self.config, meta["name"], f, offset, count)
+            if encoding is None:
+                self.send_ok(conn, count, version, meta)
+                self.send_body(conn, f, offset, count)
+                return
+            # Corps compressé en trames (l'en-tête garde la taille décompressée)
+            # (le temps d'attente des trames, lecture et compression, est compté à part)
+            meta["encoding"] = encoding
+            self.send_ok(conn, count, version, meta)
+            frames = iter(compressed_frames(f, offset, count, encoding, get_level(self.config, encoding),
+                                            get_chunk_size(self.config) * 4))
+            timings = {}
+            try:
+                while True:
+                    start = time.perf_counter()
+                    frame = next(frames, None)
+                    add_time(timings, "compress", start)
+                    if frame is None:
+                        break
+                    self.send_data(conn, frame)
+            finally:
+                self.count_sent(peer_address(conn), 0, timings)
+
+    # GET_RANGE <fichier> <offset> <longueur> : envoyer une plage d'octets du fichier
+    # (la longueur est tronquée à la fin du fichier ; une longueur nulle permet de
+    # connaître la taille totale, renvoyée dans les métadonnées)
+    def cmd_get_range(self, conn, arg, version, flags=0):
+        self.cmd_get_file(conn, arg, version, flags, ranged=True)
+
+    # SHA-256 d'un fichier : celui de l'index s'il est à jour, sinon calculé (et gardé
+    # en cache tant que la taille et la date du fichier ne changent pas)
+    def file_checksum(self, filepath, st, filename=None):
+        entry = self.index.get(filename) if filename else None
+        if entry and entry["sha256"] and (entry["size"], entry["mtime_ns"]) == (st.st_size, st.st_mtime_ns):
+            return entry["sha256"]
+        with self.checksums_lock:
+            cached = self.checksums.get(filepath)
+        if cached and cached[:2] == (st.st_size, st.st_mtime_ns):
+            return cached[2]
+        checksum = sha256_file(filepath, get_chunk_size(self.config))
+        with self.checksums_lock:
+            self.checksums[filepath] = (st.st_size, st.st_mtime_ns, checksum)
+        return checksum
+
+    # CHECKSUM <fichier> : taille, date et SHA-256 du fichier dans les métadonnées
+    def cmd_checksum(self, conn, filename, version, flags=0):
+        filepath = resolve_shared_path(self.shared_dir, filename)
+        if filepath is None or not os.path.isfile(filepath):
+            raise RequestError(STATUS_NOT_FOUND)
+        st = os.stat(filepath)
+        meta = {"name": filename, "size": st.st_size, "mtime": st.st_mtime,
+                "sha256": self.file_checksum(filepath, st, filename)}
+        self.send_ok(conn, 0, version, meta)
+
+    # MANIFEST <fichier> : empreintes SHA-256 des blocs du fichier (32 octets chacune,
+    # dans l'ordre) ; la taille de bloc et la racine de Merkle sont dans les métadonnées
+    def cmd_manifest(self, conn, filename, version, flags=0):
+        if resolve_shared_path(self.shared_dir, filename) is None:
+            raise RequestError(STATUS_NOT_FOUND)
+        result = self.index.manifest(filename.replace(os.sep, "/"))
+        if result is None:
+            raise RequestError(STATUS_NOT_FOUND)
+        manifest, checksum, entry = result
+        body = manifest.pack_digests()
+        meta = {"name": filename, "size": manifest.size, "mtime": entry["mtime"],
+                "chunk_size": manifest.chunk_size, "root": manifest.root, "sha256": checksum}
+        self.send_ok(conn, len(body), version, meta)
+        self.send_reply(conn, body)
+
+    # Ouvrir le bloc d'empreinte donnée (hex) parmi les fichiers partagés
+    def open_chunk(self, hexdigest):
+        try:
+            digest = bytes.fromhex(hexdigest)
+        except ValueError:
+            raise RequestError(STATUS_INVALID)
+        location = self.index.find_chunk(digest)
+        if location is None:
+            raise RequestError(STATUS_NOT_FOUND)
+        path, offset, length = location
+        try:
+            f = self.file_cache.open(path, offset, length)
+        except OSError:
+            raise RequestError(STATUS_NOT_FOUND)
+        if os.fstat(f.fileno()).st_size < offset + length:
+            f.close()
+            raise RequestError(STATUS_NOT_FOUND)
+        return f, offset, length, {"chunk": hexdigest}
+
+    # GET_CHUNK <empreinte hex> : contenu d'un bloc, à vérifier par le client
+    def cmd_get_chunk(self, conn, hexdigest, version, flags=0):
+        f, offset, count, meta = self.open_chunk(hexdigest)
+        with f:
+            self.send_ok(conn, count, version, meta)
+            self.send_body(conn, f, offset, count)
+
+    # DELTA <fichier> <taille locale> <taille de bloc> : la requête est suivie de la
+    # signature de la copie du client (voir p2p_delta) ; la réponse est le delta qui
+    # transforme cette copie en la version du serveur. La signature est lue en entier
+    # avant toute vérification, pour que le client reçoive la réponse d'erreur et que
+    # la connexion reste utilisable.
+    def cmd_delta(self, conn, arg, version, flags=0):
+        try:
+            filename, old_size, block_size = arg.rsplit(" ", 2)
+            old_size, block_size = int(old_size), int(block_size)
+        except ValueError:
+            raise RequestError(STATUS_INVALID)
+        if old_size < 0 or not MIN_DELTA_BLOCK_SIZE <= block_size <= MAX_DELTA_BLOCK_SIZE:
+            raise RequestError(STATUS_INVALID, "Invalid block size")
+        # La signature suit la requête sans attendre : une signature trop grande n'est
+        # pas lue (la connexion est fermée après la réponse d'erreur), celle d'un
+        # fichier absent est ignorée sans être gardée en mémoire
+        length = signature_size(old_size, block_size)
+        if length > MAX_SIGNATURE_SIZE:
+            self.send_reply(conn, self.error_response(STATUS_INVALID, version, "Signature too large"))
+            raise ProtocolError("Signature DELTA trop grande")
+        filepath = resolve_shared_path(self.shared_dir, filename)
+        if filepath is None or not os.path.isfile(filepath):
+            recv_discard(conn, length)
+            self.count_received(conn, length)
+            raise RequestError(STATUS_NOT_FOUND)
+        signature = recv_exact(conn, length)
+        self.count_received(conn, len(signature))
+        table = SignatureTable(signature, block_size, old_size)
+        with open(filepath, "rb") as f:
+            st = os.fstat(f.fileno())
+            ops = compute_delta(FileView(f), table)
+            meta = {"name": filename, "size": st.st_size, "mtime": st.st_mtime, "block_size": block_size,
+                    "old_size": old_size, "literal": literal_bytes(ops),
+                    "sha256": self.file_checksum(filepath, st, filename)}
+            configure_socket(conn, self.config)
+            self.send_ok(conn, delta_size(ops), version, meta)
+            # Données littérales envoyées directement depuis le fichier (sendfile)
+            for op, first, count in ops:
+                if op == OP_COPY:
+                    self.send_reply(conn, COPY_OP.pack(OP_COPY, first, count))
+                else:
+                    self.send_reply(conn, LITERAL_OP.pack(OP_LITERAL, count))
+                    self.send_body(conn, f, first, count)
+
+    # Fichiers désignés par une liste de noms, de motifs (glob) ou de dossiers ;
+    # renvoie (chemins relatifs sans doublon, éléments sans correspondance)
+    def select_files(self, items):
+        indexed = self.index.names()
+        selected = {}
+        missing = []
+        for item in items:
+            item = item.strip().replace(os.sep, "/")
+            if not item:
+                continue
+            filepath = None if is_pattern(item) else resolve_shared_path(self.shared_dir, item)
+            if is_pattern(item):
+                matches = [rel for rel in indexed if fnmatch.fnmatchcase(rel, item)]
+            elif filepath is not None and os.path.isfile(filepath) and not is_partial_file(item):
+                matches = [item]
+            else:
+                # Dossier : tous les fichiers indexés qu'il contient
+                prefix = item.rstrip("/") + "/"
+                matches = [rel for rel in indexed if rel.startswith(prefix)]
+            for rel in matches:
+                selected[rel] = True
+            if not matches:
+                missing.append(item)
+        return list(selected), missing
+
+    # GET_MANY <longueur> [tar] : la requête est suivie de la liste (un élément par
+    # ligne) des noms, motifs ou dossiers demandés ; la réponse enchaîne tous les
+    # fichiers dans un seul flux (voir p2p_batch). Les petits fichiers sont regroupés
+    # dans un tampon avant envoi pour limiter le nombre d'écritures sur la socket ;
+    # les gros partent directement par send_file.
+    def cmd_get_many(self, conn, arg, version, flags=0):
+        length, _, archive_format = arg.partition(" ")
+        try:
+            length = int(length)
+        except ValueError:
+            raise RequestError(STATUS_INVALID)
+        if not 0 <= length <= MAX_REQUEST_SIZE:
+            # Liste impossible à lire : la connexion ne peut pas continuer
+            raise ProtocolError("Requête GET_MANY trop grande")
+        items = recv_exact(conn, length).decode(errors="replace").split("\n") if length else []
+        self.count_received(conn, length)
+        archive_format = archive_format.strip() or FORMAT_FRAMES
+        if archive_format not in FORMATS:
+            raise RequestError(STATUS_INVALID, "Unknown archive format")
+        names, missing = self.select_files(items)
+        entries = []
+        total = len(stream_trailer(archive_format))
+        for rel in names:
+            filepath = resolve_shared_path(self.shared_dir, rel)
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                missing.append(rel)
+                continue
+            header, padding = entry_header(rel, st.st_size, st.st_mtime, archive_format)
+            entries.append((filepath, st.st_size, header, padding))
+            total += len(header) + st.st_size + len(padding)
+        meta = {"files": len(entries), "missing": missing, "format": archive_format}
+        configure_socket(conn, self.config)
+        self.send_ok(conn, total, version, meta)
+        chunk_size = get_chunk_size(self.config)
+        pending = bytearray()
+        for filepath, size, header, padding in entries:
+            pending += header
+            # Petits fichiers lus une fois dans le tampon : ouverts sans le cache, qu'ils
+            # évinceraient
+            with open(filepath, "rb") if size <= chunk_size else self.file_cache.open(filepath) as f:
+                if size <= chunk_size:
+                    start = time.perf_counter()
+                    data = f.read(size)
+                    metrics.add("p2p_io_seconds_total", time.perf_counter() - start, kind="disk")
+                    if len(data) != size:
+                        raise ProtocolError("Fichier modifié pendant l'envoi")
+                    pending += data
+                else:
+                    self.send_data(conn, pending)
+                    pending = bytearray()
+                    self.send_body(conn, f, 0, size)
+            pending += padding
+            if len(pending) >= chunk_size * 4:
+                self.send_data(conn, pending)
+                pending = bytearray()
+        self.send_data(conn, pending + stream_trailer(archive_format))
+
+    # PUSH_FILE <longueur> : la requête est suivie d'un en-tête JSON (longueur octets)
+    # puis du contenu du fichier, écrit dans le dossier partagé et retransmis au
+    # sous-arbre de l'en-tête (voir p2p_push) ; la réponse contient le rapport du
+    # sous-arbre. Les données suivent la requête sans attendre : une requête refusée
+    # ferme la connexion après la réponse d'erreur. Désactivée par défaut : un pair
+    # n'accepte de réplication que si push_accept est activé, et seulement des pairs
+    # de push_allowed_peers si cette liste est donnée.
+    def cmd_push_file(self, conn, arg, version, flags=0):
+        try:
+            length = int(arg)
+        except ValueError:
+            length = 0
+        if version is None or not 0 < length <= MAX_PUSH_HEADER:
+            raise ProtocolError("Requête PUSH_FILE invalide")
+        if not push_allowed(self.config, peer_address(conn)):
+            self.send_reply(conn, self.error_response(STATUS_INVALID, version, "Push not accepted"))
+            raise ProtocolError("Réplication refusée")
+        try:
+            info = json.loads(recv_exact(conn, length))
+            valid = isinstance(info, dict) and valid_push_info(info)
+        except (ValueError, RecursionError):
+            info, valid = None, False
+        self.count_received(conn, length)
+        filename = info["name"] if valid else None
+        filepath = resolve_shared_path(self.shared_dir, filename) if valid else None
+        if filepath is None or is_partial_file(filename) or os.path.isdir(filepath):
+            self.send_reply(conn, self.error_response(STATUS_INVALID, version, "Invalid push"))
+            raise ProtocolError("Réplication refusée")
+        report = receive_push(conn, info, filepath, self.config, lambda n: self.count_received(conn, n),
+                              self.shaper)
+        if report["ok"]:
+            self.index.update_file(filename.replace(os.sep, "/"))
+        self.send_ok(conn, 0, version, {"report": report})
+
+    # Réponses de listing servies depuis l'index (aucun parcours du dossier)
+    def list_response(self, version):
+        body = self.index.list_body()
+        return self.ok_response(len(body), version, legacy_header=False) + body
+
+    def list_v2_response(self, version):
+        body = self.index.list_body_v2()
+        return self.ok_response(len(body), version, {"format": "json"}, legacy_header=False) + body
+
+    def cmd_list_files(self, conn, arg, version, flags=0):
+        self.send_reply(conn, self.list_response(version))
+
+    # LIST_FILES_V2 : liste récursive avec taille, date et SHA-256 de chaque fichier
+    def cmd_list_files_v2(self, conn, arg, version, flags=0):
+        self.send_reply(conn, self.list_v2_response(version))
+
+    # LIST_PAGE <paramètres> : une page de la liste des fichiers, pour les très grands
+    # dossiers partagés. Paramètres au format d'une chaîne de requête URL : after
+    # (curseur : dernier nom de la page précédente), limit, prefix, min_size, max_size
+    # et since (date de modification minimale). Le corps contient une entrée JSON par
+    # ligne (lisible au fur et à mesure de la réception) ; les métadonnées donnent le
+    # curseur de la page suivante ("next", absent à la fin de la liste)
+    def cmd_list_page(self, conn, arg, version, flags=0):
+        try:
+            params = {k: v[-1] for k, v in urllib.parse.parse_qs(arg, keep_blank_values=True).items()}
+            limit = min(int(params.get("limit", DEFAULT_LIST_PAGE_SIZE)), MAX_LIST_PAGE_SIZE)
+            min_size = int(params["min_size"]) if params.get("min_size") else None
+            max_size = int(params["max_size"]) if params.get("max_size") else None
+            since = float(params["since"]) if params.get("since") else None
+        except ValueError:
+            raise RequestError(STATUS_INVALID, "Invalid listing parameters")
+        if limit <= 0:
+            raise RequestError(STATUS_INVALID, "Invalid listing parameters")
+        files, cursor = self.index.page(params.get("after", ""), limit, params.get("prefix", ""),
+                                        min_size, max_size, since)
+        body = "".join(json.dumps(entry) + "\n" for entry in files).encode()
+        meta = {"format": "ndjson", "count": len(files), "generation": self.index.generation}
+        if cursor is not None:
+            meta["next"] = cursor
+        self.send_reply(conn, self.ok_response(len(body), version, meta, legacy_header=False) + body)
+
+    # SEARCH <motif> : fichiers de l'index dont le nom correspond (motif glob ou
+    # sous-chaîne, sans tenir compte de la casse), au format JSON de LIST_FILES_V2
+    def cmd_search(self, conn, pattern, version, flags=0):
+        if not pattern:
+            raise RequestError(STATUS_INVALID, "Empty pattern")
+        limit = int(self.config.get("search_max_results", DEFAULT_SEARCH_MAX_RESULTS))
+        files, truncated = self.index.search(pattern, limit)
+        body = json.dumps({"files": files, "truncated": truncated}).encode()
+        self.send_reply(conn, self.ok_response(len(body), version, {"format": "json"}, legacy_header=False) + body)
+
+    # BANDWIDTH : répartition courante du débit d'envoi (JSON) : plafonds, débit mesuré,
+    # réponses de métadonnées en cours et, pour chaque pair, transferts en cours, débit
+    # mesuré et part allouée
+    def cmd_bandwidth(self, conn, arg, version, flags=0):
+        body = json.dumps({"upload": self.shaper.snapshot(), "max_transfers": self.max_transfers}).encode()
+        self.send_reply(conn, self.ok_response(len(body), version, {"format": "json"}, legacy_header=False) + body)
+
+    # STATS [prometheus] : mesures du serveur (voir p2p_metrics) : octets envoyés et reçus
+    # par pair, nombre, erreurs et latence des requêtes par commande, transferts et
+    # connexions en cours, temps passé en lecture disque et en envoi réseau. Corps JSON,
+    # ou texte au format Prometheus avec l'argument "prometheus"
+    def cmd_stats(self, conn, arg, version, flags=0):
+        if arg == "prometheus":
+            body, meta = metrics.prometheus().encode(), {"format": "prometheus"}
+        elif not arg:
+            body, meta = json.dumps(metrics.snapshot()).encode(), {"format": "json"}
+        else:
+            raise RequestError(STATUS_INVALID, "Unknown stats format")
+        self.send_reply(conn, self.ok_response(len(body), version, meta, legacy_header=False) + body)
+
+# Serveur pair-à-pair asyncio : une seule boucle d'événements pour toutes les connexions
+#
+# Mêmes commandes et mêmes réponses que PeerServer. Les transferts et les listings
+# sont servis directement par la boucle (envoi des fichiers via loop.sock_sendfile) ;
+# les autres commandes s'exécutent dans un pool de threads borné. Le nombre de
+# transferts simultanés est limité (max_transfers), une connexion inactive plus de
+# idle_timeout secondes est fermée, et stop() arrête le serveur proprement en
+# laissant aux connexions en cours shutdown_timeout secondes pour se terminer.
+class AsyncPeerServer(PeerServer):
+    def __init__(self, config):
+        super().__init__(config)
+        self.idle_timeout = float(config.get("idle_timeout", DEFAULT_IDLE_TIMEOUT))
+        self.shutdown_timeout = float(config.get("shutdown_timeout", DEFAULT_SHUTDOWN_TIMEOUT))
+        # Threads en plus des transferts : les métadonnées n'attendent jamais un transfert
+        self.executor = ThreadPoolExecutor(max_workers=self.max_transfers + META_WORKERS)
+        self.async_commands = {
+            "GET_FILE": self.acmd_get_file,
+            "GET_RANGE": self.acmd_get_range,
+            "LIST_FILES": self.acmd_list_files,
+            "LIST_FILES_V2": self.acmd_list_files_v2,
+            "GET_CHUNK": self.acmd_get_chunk,
+        }
+        self.loop = None
+        self.stopping = None
+        self.transfers = None
+        self.ready = threading.Event()
+        self.connections = set()
+        self.idle_connections = set()
+
+    def run(self):
+        self.index.start()
+        start_http_endpoint(self.config)
+        asyncio.run(self.serve())
+
+    # Demander l'arrêt du serveur (appelable depuis n'importe quel thread)
+    def stop(self):
+        self.ready.wait()
+        self.loop.call_soon_threadsafe(self.stopping.set)
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.transfers = asyncio.Semaphore(self.max_transfers)
+        s = self.listen_socket()
+        s.setblocking(False)
+        print(f"[+] Serveur P2P (asyncio) en écoute sur {self.host}:{self.port}")
+        self.ready.set()
+        accept_task = asyncio.create_task(self.accept_loop(s))
+        await self.stopping.wait()
+        # Arrêt : plus de nouvelles connexions, puis attente des connexions en cours
+        accept_task.cancel()
+        s.close()
+        # Connexions persistantes en attente d'une requête : fermées immédiatement
+        for task in list(self.idle_connections):
+            task.cancel()
+        if self.connections:
+            _, pending = await asyncio.wait(set(self.connections), timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.executor.shutdown(wait=False)
+        print("[+] Serveur P2P arrêté")
+
+    async def accept_loop(self, s):
+        while True:
+            conn, addr = await self.loop.sock_accept(s)
+            set_nodelay(conn)
+            task = asyncio.create_task(self.handle_client_async(conn, addr))
+            self.connections.add(task)
+            task.add_done_callback(self.connections.discard)
+
+    # Lectures/écritures soumises au délai d'inactivité
+    async def recv(self, conn, n):
+        return await asyncio.wait_for(self.loop.sock_recv(conn, n), self.idle_timeout)
+
+    async def recv_prefix(self, conn, n):
+        buf = b""
+        while len(buf) < n:
+            part = await self.recv(conn, n - len(buf))
+            if not part:
+                break
+            buf += part
+        return buf
+
+    async def recv_magic(self, conn):
+        buf = b""
+        while len(buf) < len(MAGIC) and MAGIC.startswith(buf):
+            part = await self.recv(conn, len(MAGIC) - len(buf))
+            if not part:
+                break
+            buf += part
+        return buf
+
+    async def send(self, conn, data):
+        if data:
+            start = time.perf_counter()
+            await asyncio.wait_for(self.loop.sock_sendall(conn, data), self.idle_timeout)
+            self.count_sent(peer_address(conn), len(data), {"network": time.perf_counter() - start})
+
+    async def handle_client_async(self, conn, addr):
+        first = True
+        self.count_connection(1)
+        try:
+            while True:
+                task = asyncio.current_task()
+                if not first:
+                    self.idle_connections.add(task)
+                try:
+                    head = await self.recv_magic(conn)
+                except asyncio.TimeoutError:
+                    if first:
+                        raise
+                    return
+                finally:
+                    self.idle_connections.discard(task)
+                if not head and not first:
+                    return
+                if head == MAGIC:
+                    raw = await self.recv_prefix(conn, REQUEST_HEADER.size - len(MAGIC))
+                    if len(raw) < REQUEST_HEADER.size - len(MAGIC):
+                        return
+                    _, client_version, flags, length = REQUEST_HEADER.unpack(MAGIC + raw)
+                    request = (await self.recv_prefix(conn, length)).decode()
+                    version = negotiate_version(client_version)
+                    if version is None:
+                        await self.send(conn, self.version_error())
+                        return
+                else:
+                    # Ancien protocole texte
+                    version, flags = None, 0
+                    if len(head) == len(MAGIC):
+                        head += await self.recv(conn, 1024)
+                    request = head.decode()
+                await self.dispatch_async(conn, request, version, flags)
+                # Connexion persistante : attente de la requête suivante (sauf à l'arrêt)
+                if version is None or version < KEEPALIVE_VERSION or self.stopping.is_set():
+                    return
+                first = False
+        except asyncio.TimeoutError:
+            print(f"[!] Connexion inactive fermée: {addr}")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            metrics.add("p2p_connection_errors_total", error=type(e).__name__)
+            print(f"[!] Erreur avec {addr}: {e}")
+        finally:
+            self.count_connection(-1)
+            conn.close()
+
+    # Les commandes servies par la boucle sont mesurées ici, celles du pool par dispatch
+    async def dispatch_async(self, conn, request, version, flags=0):
+        command, _, arg = request.partition(" ")
+        command = command.strip()
+        handler = self.async_commands.get(command)
+        if flags & ENCODING_MASK and command in ("GET_FILE", "GET_RANGE"):
+            # Compression dans un thread : transfert servi par le pool (qui compte
+            # lui-même la requête dans la charge)
+            handler = None
+        # Profilage à la demande : suit le thread de la boucle tant qu'il est actif
+        profiler.follow()
+        try:
+            if handler is not None:
+                start = time.perf_counter()
+                peer = self.begin_request(conn, command, request, version)
+                error = None
+                try:
+                    await handler(conn, arg.strip(), version, flags)
+                except Exception as e:
+                    error = e.status if isinstance(e, RequestError) else type(e).__name__
+                    raise
+                finally:
+                    self.end_request(command, peer, start, error)
+            elif command in BULK_COMMANDS:
+                await self.run_blocking(conn, request, version, flags)
+            else:
+                # Métadonnées (ou commande inconnue, refusée et mesurée par dispatch)
+                await self.run_blocking(conn, request, version, flags, bulk=False)
+        except RequestError as e:
+            await self.send(conn, self.error_response(e.status, version, e.message))
+
+    # Commande exécutée en mode bloquant dans le pool (pas de version asyncio, ou
+    # transfert compressé) ; seuls les transferts de données (bulk) prennent une place
+    # de transfert, les métadonnées passent devant
+    async def run_blocking(self, conn, request, version, flags, bulk=True):
+        if bulk:
+            async with self.transfers:
+                await self.run_in_pool(conn, request, version, flags)
+        else:
+            await self.run_in_pool(conn, request, version, flags)
+
+    async def run_in_pool(self, conn, request, version, flags):
+        conn.settimeout(self.idle_timeout)
+        try:
+            await self.loop.run_in_executor(self.executor, self.dispatch, conn, request, version, flags)
+        finally:
+            conn.setblocking(False)
+
+    async def acmd_get_file(self, conn, arg, version, flags=0, ranged=False):
+        async with self.transfers:
+            f, offset, count, meta = self.open_transfer(arg, ranged)
+            with f:
+                configure_socket(conn, self.config)
+                await self.send(conn, self.ok_response(count, version, meta))
+                if await self.send_file_async(conn, f, offset, count) != count:
+                    raise ProtocolError("Fichier modifié pendant l'envoi")
+
+    async def acmd_get_range(self, conn, arg, version, flags=0):
+        await self.acmd_get_file(conn, arg, version, flags, ranged=True)
+
+    async def acmd_get_chunk(self, conn, hexdigest, version, flags=0):
+        async with self.transfers:
+            f, offset, count, meta = self.open_chunk(hexdigest)
+            with f:
+                await self.send(conn, self.ok_response(count, version, meta))
+                if await self.send_file_async(conn, f, offset, count) != count:
+                    raise ProtocolError("Fichier modifié pendant l'envoi")
+
+    async def acmd_list_files(self, conn, arg, version, flags=0):
+        await self.send(conn, self.list_response(version))
+
+    async def acmd_list_files_v2(self, conn, arg, version, flags=0):
+        await self.send(conn, self.list_v2_response(version))
+
+    # Envoi d'un fichier par tranches : chaque tranche doit aboutir avant idle_timeout
+    # (tranches de SHAPING_SLICE octets, chacune à son tour, si le débit est limité)
+    async def send_file_async(self, conn, f, offset, count):
+        chunk_size = get_chunk_size(self.config)
+        peer = peer_address(conn)
+        limited = self.shaper.limited
+        timings = {}
+        sent = 0
+        if sendfile_enabled(self.config):
+            step = SHAPING_SLICE if limited else chunk_size * 16
+            try:
+                while sent < count:
+                    if limited:
+                        start = time.perf_counter()
+                        await self.shaper.wait_async(peer, min(step, count - sent))
+                        add_time(timings, "throttle", start)
+                    start = time.perf_counter()
+                    n = await asyncio.wait_for(
+                        self.loop.sock_sendfile(conn, f, offset + sent, min(step, count - sent)),
+                        self.idle_timeout)
+                    add_time(timings, "sendfile", start)
+                    if not n:
+                        break
+                    sent += n
+                    if not limited:
+                        self.shaper.record(peer, n)
+            finally:
+                self.count_sent(peer, sent, timings)
+            return sent
+        # Envoi bufferisé : octets et temps réseau comptés par send()
+        buf = memoryview(bytearray(chunk_size))
+        f.seek(offset)
+        try:
+            while sent < count:
+                start = time.perf_counter()
+                n = f.readinto(buf[:min(chunk_size, count - sent)])
+                add_time(timings, "disk", start)
+                if not n:
+                    break
+                if limited:
+                    start = time.perf_counter()
+                    await self.shaper.wait_async(peer, n)
+                    add_time(timings, "throttle", start)
+                else:
+                    self.shaper.record(peer, n)
+                await self.send(conn, buf[:n])
+                sent += n
+        finally:
+            self.count_sent(peer, 0, timings)
+        return sent
+
+# Créer le serveur selon le mode configuré ("threaded" par défaut, ou "asyncio")
+def create_server(config):
+    if config.get("server_mode", "threaded") == "asyncio":
+        return AsyncPeerServer(config)
+    return PeerServer(config)
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+
+# Limitation de débit par seaux à jetons (token buckets)
+#
+# Un seau se remplit de rate octets par seconde, jusqu'à burst octets. Envoyer n
+# octets en retire n ; s'il n'y en a pas assez, le solde devient négatif et
+# l'envoi doit attendre que le seau se soit rempli d'autant (réservation) : les
+# envois concurrents sont ainsi servis dans l'ordre de leurs demandes.
+
+# Durée de remplissage d'un seau plein (rafale autorisée), en secondes
+DEFAULT_BURST_TIME = 0.25
+MIN_BURST = 64 * 1024
+# Tranche envoyée entre deux réservations (transferts limités)
+SHAPING_SLICE = 64 * 1024
+# Attente maximale d'un transfert volumineux laissant passer une réponse de métadonnées
+META_YIELD_TIMEOUT = 0.05
+META_YIELD_STEP = 0.005
+# Fenêtre de mesure du débit effectif
+RATE_WINDOW = 1.0
+# Nombre de pairs suivis au-delà duquel les pairs inactifs sont oubliés
+MAX_TRACKED_PEERS = 1024
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(MIN_BURST, self.rate * DEFAULT_BURST_TIME))
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Réserver n octets : délai (en secondes) à attendre avant de les envoyer
+    def reserve(self, n):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= n
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+# Débit mesuré sur la fenêtre courante et la précédente (RATE_WINDOW chacune)
+class RateMeter:
+    def __init__(self):
+        self.start = time.monotonic()
+        self.count = 0
+        self.previous = (0, 0.0)
+
+    def add(self, n):
+        now = time.monotonic()
+        elapsed = now - self.start
+        if elapsed >= RATE_WINDOW:
+            self.previous = (self.count, elapsed) if elapsed < 2 * RATE_WINDOW else (0, 0.0)
+            self.start = now
+            self.count = 0
+        self.count += n
+
+    def current(self):
+        elapsed = time.monotonic() - self.start
+        if elapsed >= 2 * RATE_WINDOW:
+            return 0.0
+        count, duration = self.previous
+        return (count + self.count) / max(duration + elapsed, 0.001)
+
+# Répartition du débit entre pairs : plafond global et plafond par pair (octets/s,
+# 0 pour illimité)
+#
+# Deux classes de priorité : les réponses de métadonnées (listes, recherche, sommes
+# de contrôle...) ne sont jamais ralenties, et tant qu'une est en cours
+# (begin_meta/end_meta) les transferts de données lui cèdent la place entre deux
+# tranches. Sans aucun plafond, les transferts ne sont pas découpés et rien n'est
+# ralenti ; seules les statistiques sont tenues à jour.
+class BandwidthShaper:
+    def __init__(self, rate=0, peer_rate=0):
+        self.rate = 0
+        self.peer_rate = 0
+        self.bucket = None
+        self.peer_buckets = {}
+        self.meters = {}
+        self.total_meter = RateMeter()
+        self.transfers = {}
+        self.meta_active = 0
+        self.lock = threading.Lock()
+        self.meta_done = threading.Condition(self.lock)
+        self.set_limits(rate, peer_rate)
+
+    # direction : "upload" (serveur) ou "download" (client)
+    @classmethod
+    def from_config(cls, config, direction):
+        shaper = cls()
+        shaper.configure(config, direction)
+        return shaper
+
+    def configure(self, config, direction):
+        self.set_limits(config.get(f"max_{direction}_rate", 0), config.get(f"max_peer_{direction}_rate", 0))
+
+    # Changer les plafonds (les seaux ne sont recréés que si leur débit change)
+    def set_limits(self, rate, peer_rate):
+        rate, peer_rate = int(rate or 0), int(peer_rate or 0)
+        with self.lock:
+            if rate != self.rate:
+                self.rate = rate
+                self.bucket = TokenBucket(rate) if rate else None
+            if peer_rate != self.peer_rate:
+                self.peer_rate = peer_rate
+                self.peer_buckets = {}
+
+    @property
+    def limited(self):
+        return bool(self.rate or self.peer_rate)
+
+    def begin(self, peer):
+        with self.lock:
+            self.transfers[peer] = self.transfers.get(peer, 0) + 1
+
+    def end(self, peer):
+        with self.lock:
+            count = self.transfers.get(peer, 0) - 1
+            if count > 0:
+                self.transfers[peer] = count
+            else:
+                self.transfers.pop(peer, None)
+
+    def begin_meta(self):
+        with self.lock:
+            self.meta_active += 1
+
+    def end_meta(self):
+        with self.lock:
+            self.meta_active -= 1
+            if not self.meta_active:
+                self.meta_done.notify_all()
+
+    # Délai à respecter avant d'échanger n octets avec peer
+    def reserve(self, peer, n):
+        with self.lock:
+            bucket = self.peer_buckets.get(peer)
+            if bucket is None and self.peer_rate:
+                bucket = self.peer_buckets[peer] = TokenBucket(self.peer_rate)
+            total = self.bucket
+        delay = 0.0
+        if total is not None:
+            delay = total.reserve(n)
+        if bucket is not None:
+            delay = max(delay, bucket.reserve(n))
+        return delay
+
+    # Compter n octets échangés avec peer (débit mesuré)
+    def record(self, peer, n):
+        with self.lock:
+            meter = self.meters.get(peer)
+            if meter is None:
+                if len(self.meters) >= MAX_TRACKED_PEERS:
+                    self._forget_idle()
+                meter = self.meters[peer] = RateMeter()
+            meter.add(n)
+            self.total_meter.add(n)
+
+    # Oublier les pairs sans transfert en cours ni trafic récent
+    def _forget_idle(self):
+        for peer in [p for p, meter in self.meters.items() if p not in self.transfers and not meter.current()]:
+            del self.meters[peer]
+            self.peer_buckets.pop(peer, None)
+
+    # Version bloquante de reserve : attendre son tour, en laissant d'abord passer
+    # les réponses de métadonnées en cours (META_YIELD_TIMEOUT au plus)
+    def wait(self, peer, n):
+        delay = self.reserve(peer, n)
+        if delay:
+            time.sleep(delay)
+        self.record(peer, n)
+        with self.lock:
+            if self.meta_active:
+                self.meta_done.wait(META_YIELD_TIMEOUT)
+
+    # Équivalent asyncio de wait (la réponse de métadonnées est servie par un autre
+    # thread ou par la boucle elle-même)
+    async def wait_async(self, peer, n):
+        delay = self.reserve(peer, n)
+        if delay:
+            await asyncio.sleep(delay)
+        self.record(peer, n)
+        deadline = time.monotonic() + META_YIELD_TIMEOUT
+        while self.meta_active and time.monotonic() < deadline:
+            await asyncio.sleep(META_YIELD_STEP)
+
+    # Nombre de transferts en cours, tous pairs confondus
+    def active_transfers(self):
+        with self.lock:
+            return sum(self.transfers.values())
+
+    # État courant : plafonds, débit mesuré et part allouée à chaque pair actif
+    def snapshot(self):
+        with self.lock:
+            active = dict(self.transfers)
+            meters = dict(self.meters)
+        share = self.rate / len(active) if self.rate and active else 0
+        peers = {}
+        for peer, meter in meters.items():
+            rate = meter.current()
+            if peer not in active and not rate:
+                continue
+            allocation = min(r for r in (share, self.peer_rate) if r) if (share or self.peer_rate) else 0
+            peers[str(peer)] = {"transfers": active.get(peer, 0), "rate": round(rate),
+                                "allocation": round(allocation) if peer in active else 0}
+        return {"rate_limit": self.rate, "peer_rate_limit": self.peer_rate,
+                "rate": round(self.total_meter.current()), "metadata_pending": self.meta_active,
+                "peers": peers}
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import socket
+import threading
+import time
+
+# Valeurs par défaut des paramètres de transfert (surchargeables dans config.json)
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_SOCKET_BUFFER_SIZE = 1024 * 1024
+
+# Fichiers d'un téléchargement en cours (données partielles et journal des plages reçues)
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".part.json"
+
+# Fichier temporaire de téléchargement, à ne pas partager
+def is_partial_file(name):
+    return name.endswith(PART_SUFFIX) or name.endswith(JOURNAL_SUFFIX)
+
+# Taille des blocs lus/écrits pendant un transfert
+def get_chunk_size(config):
+    return int(config.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+# Le mode zero-copy n'est utilisé que s'il est activé et que l'OS fournit sendfile()
+def sendfile_enabled(config):
+    return bool(config.get("use_sendfile", True)) and hasattr(os, "sendfile")
+
+# Chemin local d'un fichier du dossier partagé, ou None s'il sort de ce dossier
+def resolve_shared_path(shared_dir, filename):
+    root = os.path.abspath(shared_dir)
+    path = os.path.abspath(os.path.join(root, filename))
+    if not filename or os.path.commonpath([root, path]) != root or path == root:
+        return None
+    return path
+
+# Appliquer les tailles de tampon socket configurées (SO_SNDBUF / SO_RCVBUF)
+def configure_socket(sock, config):
+    size = int(config.get("socket_buffer_size", DEFAULT_SOCKET_BUFFER_SIZE))
+    if size <= 0:
+        return
+    for option in (socket.SO_SNDBUF, socket.SO_RCVBUF):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, option, size)
+        except OSError:
+            pass
+
+# Désactiver l'algorithme de Nagle : sur une connexion persistante, l'en-tête et le
+# corps d'une réponse (deux écritures) ne doivent pas attendre l'acquittement retardé
+# de la réponse précédente
+def set_nodelay(sock):
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+# Ajouter la durée écoulée depuis start à timings[kind] (si timings n'est pas None)
+def add_time(timings, kind, start):
+    if timings is not None:
+        timings[kind] = timings.get(kind, 0.0) + time.perf_counter() - start
+
+# Envoi zero-copy : le noyau copie directement le fichier vers la socket
+def send_file_zero_copy(conn, f, offset=0, count=None, timings=None):
+    start = time.perf_counter()
+    try:
+        return conn.sendfile(f, offset, count)
+    finally:
+        add_time(timings, "sendfile", start)
+
+# Envoi bufferisé : lecture par blocs dans un tampon réutilisé puis sendall
+def send_file_buffered(conn, f, offset=0, count=None, chunk_size=DEFAULT_CHUNK_SIZE, timings=None):
+    if offset:
+        f.seek(offset)
+    buf = memoryview(bytearray(chunk_size))
+    total_sent = 0
+    while count is None or total_sent < count:
+        size = chunk_size if count is None else min(chunk_size, count - total_sent)
+        start = time.perf_counter()
+        n = f.readinto(buf[:size])
+        add_time(timings, "disk", start)
+        if not n:
+            break
+        start = time.perf_counter()
+        conn.sendall(buf[:n])
+        add_time(timings, "network", start)
+        total_sent += n
+    return total_sent
+
+# Envoyer (une partie d')un fichier ouvert en binaire selon le mode configuré
+#
+# throttle(n) (facultatif, limitation de débit) est appelé avant chaque tranche de
+# slice_size octets ; count doit alors être connu.
+# timings (dictionnaire facultatif) reçoit le temps passé par catégorie : "sendfile"
+# (lecture et envoi par le noyau), ou "disk" et "network" (envoi bufferisé), et
+# "throttle" (attente de la limitation de débit).
+def send_file(conn, f, config, offset=0, count=None, throttle=None, slice_size=DEFAULT_CHUNK_SIZE,
+              timings=None):
+    if count == 0:
+        return 0
+    if throttle is not None:
+        sent = 0
+        while sent < count:
+            size = min(slice_size, count - sent)
+            start = time.perf_counter()
+            throttle(size)
+            add_time(timings, "throttle", start)
+            n = send_file(conn, f, config, offset + sent, size, timings=timings)
+            if not n:
+                break
+            sent += n
+        return sent
+    if sendfile_enabled(config):
+        return send_file_zero_copy(conn, f, offset, count, timings)
+    return send_file_buffered(conn, f, offset, count, get_chunk_size(config), timings)
+
+# Réserver la taille finale du fichier sur disque avant de l'écrire
+def preallocate(fd, size):
+    if size <= 0:
+        return
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+_pwrite_lock = threading.Lock()
+
+# Écrire des données à une position donnée sans déplacer la position courante
+def pwrite(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            n = os.pwrite(fd, view, offset)
+        else:
+            with _pwrite_lock:
+                os.lseek(fd, offset, os.SEEK_SET)
+                n = os.write(fd, view)
+        view = view[n:]
+        offset += n
+
+_pread_lock = threading.Lock()
+
+# Lire au plus size octets à une position donnée sans déplacer la position courante
+# (moins à la fin du fichier)
+def pread(fd, size, offset):
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with _pread_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+# Somme de contrôle SHA-256 d'un fichier (lecture par blocs)
+def sha256_file(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    digest = hashlib.sha256()
+    buf = memoryview(bytearray(chunk_size))
+    with open(path, "rb") as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(buf[:n])
+    return digest.hexdigest()